@@ -0,0 +1,151 @@
+import base64
+import binascii
+import json
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+from memlib import memory_sampled
+from profilelib import profile_sampled
+from routelib import match_route
+from torguapi import torguapi_http_error
+
+from counties.app.counties_api import counties_handler
+from municipalities.app.municipalities_api import (
+    changes_handler,
+    history_handler,
+    municipalities_handler,
+    xref_handler,
+)
+
+# Handlers of the API routes that can be requested in a batch
+BATCH_ROUTES = {
+    "/nj/counties": counties_handler,
+    "/nj/counties/{GEOID}": counties_handler,
+    "/nj/municipalities": municipalities_handler,
+    "/nj/municipalities/{year}": municipalities_handler,
+    "/nj/municipalities/{year}/{GEOID}": municipalities_handler,
+    "/nj/municipalities/history/{GEOID}": history_handler,
+    "/nj/municipality_xrefs/{year_ref}/{year}": xref_handler,
+    "/nj/municipality_xref_panel/{years}": xref_handler,
+    "/nj/municipality_changes/{year_ref}/{year}": changes_handler,
+}
+
+# Maximum number of paths in a batch
+MAX_BATCH_PATHS = 10
+
+
+def parse_batch_paths(event):
+    """
+    Gets the list of API paths from the body of a batch event
+
+    The body is a JSON object with a "paths" list of relative API paths, such
+    as "/nj/municipalities/2010?page_size=50".
+
+    Args:
+        event: Batch API Gateway event
+
+    Returns:
+        list of paths, or None if the body is invalid
+    """
+    body = event.get("body", None) or ""
+    try:
+        if event.get("isBase64Encoded", False):
+            body = base64.b64decode(body, validate=True).decode()
+        paths = json.loads(body)["paths"]
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+        return None
+    if not isinstance(paths, list) or not 0 < len(paths) <= MAX_BATCH_PATHS:
+        return None
+    if not all(isinstance(path, str) for path in paths):
+        return None
+    return paths
+
+
+def make_sub_event(path):
+    """
+    Returns the API Gateway event of a GET of a relative API path
+
+    Args:
+        path: relative API path, with optional query string
+
+    Returns:
+        handler of the path's route, and its event, or (None, None) if no
+        route matches
+    """
+    split = urlsplit(path)
+    matched = match_route(BATCH_ROUTES, split.path)
+    if matched is None:
+        return None, None
+    resource, path_parameters = matched
+    query_parameters = dict(parse_qsl(split.query))
+    event = {
+        "httpMethod": "GET",
+        "resource": resource,
+        "path": "/" + split.path.strip("/"),
+        "pathParameters": path_parameters or None,
+        "queryStringParameters": query_parameters or None,
+        "headers": {},
+    }
+    return BATCH_ROUTES[resource], event
+
+
+def make_sub_result(path, response):
+    """
+    Converts the response to one path of a batch to an entry of the envelope
+
+    JSON bodies are included as JSON, and other bodies as strings.
+
+    Args:
+        path: requested path
+        response: HTTP result of the handler
+
+    Returns:
+        dict with "path", "status", "headers" and "body"
+    """
+    body = response.get("body", "")
+    try:
+        body = json.loads(body) if body else None
+    except ValueError:
+        pass
+    return {
+        "path": path,
+        "status": int(response["statusCode"]),
+        "headers": response.get("headers", None) or {},
+        "body": body,
+    }
+
+
+@profile_sampled("batch_handler")
+@memory_sampled("batch_handler")
+def batch_handler(event, context):
+    """
+    Handles batch API events
+
+    Each path in the batch is dispatched to the handler of its route, in
+    this process, so every path is answered from the same warm tables.  Each
+    path keeps its own status in the envelope; the batch itself fails only
+    if its body is invalid.
+
+    Args:
+        event: API Gateway event
+        context: API Gateway context
+
+    Returns:
+        HTTP result with an envelope of the results, or a torguapi error response
+    """
+    paths = parse_batch_paths(event)
+    if paths is None:
+        return torguapi_http_error(HTTPStatus.BAD_REQUEST, "Invalid batch request")
+    results = []
+    for path in paths:
+        handler, sub_event = make_sub_event(path)
+        if handler is None:
+            response = torguapi_http_error(HTTPStatus.NOT_FOUND, f"Invalid path {path}")
+        else:
+            response = handler(sub_event, context)
+        results.append(make_sub_result(path, response))
+    return {
+        "statusCode": HTTPStatus.OK.value,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({"responses": results}),
+    }
@@ -0,0 +1,250 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class TableCache:
+    """
+    Thread-safe cache of built values, such as tables and their indexes
+
+    Each key has its own lock, so that builds are single-flight: when several
+    threads ask for a missing value at once, one of them builds it and the
+    others wait for its result, and a build for one key does not block reads
+    or builds of other keys.  Cached values are read without locking.
+
+    A refresh builds the new value while the old one is still being served,
+    and then swaps it in with a single assignment, so readers see either the
+    old value or the new one, never a partial update.  To keep related values,
+    such as a table and its indexes, consistent with each other, cache them
+    together under one key.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._checked = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock(self, key):
+        """Returns the lock for key, creating it if required"""
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, key, builder):
+        """
+        Returns the cached value for key, building it if required
+
+        Args:
+            key: cache key
+            builder: Function of no arguments that builds the value
+
+        Returns:
+            cached value
+        """
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        with self._lock(key):
+            if key not in self._values:
+                self._values[key] = builder()
+                self._checked[key] = time.monotonic()
+            return self._values[key]
+
+    async def get_async(self, key, builder, executor=None):
+        """
+        Returns the cached value for key, building it in executor if required
+
+        Args:
+            key: cache key
+            builder: Function of no arguments that builds the value
+            executor: Optional concurrent.futures.Executor.  Defaults to the
+                loop's default executor.
+
+        Returns:
+            cached value
+        """
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.get, key, builder)
+
+    def peek(self, key, default=None):
+        """Returns the cached value for key, or default, without building it"""
+        return self._values.get(key, default)
+
+    def set(self, key, value):
+        """Replaces the cached value for key"""
+        with self._lock(key):
+            self._values[key] = value
+
+    def refresh(self, key, builder):
+        """
+        Rebuilds the value for key, and swaps it in
+
+        Concurrent refreshes of the same key are serialized.  Until the build
+        completes, readers get the previous value; if the build fails, the
+        previous value is kept.
+
+        Args:
+            key: cache key
+            builder: Function of no arguments that builds the value
+
+        Returns:
+            new value
+        """
+        with self._lock(key):
+            value = builder()
+            self._values[key] = value
+            self._checked[key] = time.monotonic()
+            return value
+
+    def refresh_if_stale(self, key, builder, get_version, interval):
+        """
+        Refreshes the value for key if its version has changed
+
+        The cached value must be a dict with a "data_version" entry.  At most
+        once per interval seconds after the value was built, it is compared
+        with get_version(), and the value is refreshed if they differ.  Values
+        that are not cached yet are left to be built by get.
+
+        Args:
+            key: cache key
+            builder: Function of no arguments that builds the value
+            get_version: Function of no arguments that returns the current version
+            interval: Minimum number of seconds between checks
+
+        Returns:
+            True if the value was refreshed
+        """
+        value = self._values.get(key, None)
+        if value is None:
+            return False
+        now = time.monotonic()
+        if now - self._checked.get(key, float("-inf")) < interval:
+            return False
+        self._checked[key] = now
+        if get_version() == value["data_version"]:
+            return False
+        self.refresh(key, builder)
+        return True
+
+    def invalidate(self, key=None):
+        """
+        Removes the value for key, or all values, so the next get rebuilds it
+
+        Args:
+            key: Optional cache key.  If None, every key is invalidated.
+        """
+        keys = list(self._values) if key is None else [key]
+        for key in keys:
+            with self._lock(key):
+                self._values.pop(key, None)
+
+
+class LRUCache:
+    """
+    Thread-safe mapping that keeps at most max_entries values
+
+    Beyond max_entries, the least recently read or written value is evicted,
+    so memoizing results keyed by client-chosen params cannot grow without
+    bound.
+    """
+
+    def __init__(self, max_entries, items=()):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        for key, value in items:
+            self[key] = value
+
+    def get(self, key, default=None):
+        """Returns the value for key, or default, and marks it recently used"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def items(self):
+        """Returns a list of the (key, value) pairs, least recently used first"""
+        with self._lock:
+            return list(self._entries.items())
+
+
+class RequestCoalescer:
+    """
+    Thread-safe coalescing of identical calls that are in flight at once
+
+    The first call for a key runs, and calls for the same key that arrive
+    while it is running wait for it and share its result (or exception),
+    rather than repeating the work.  Nothing is kept once a call completes,
+    so unlike TableCache this does not cache results.  The numbers of calls
+    that ran and that shared a result are counted, to show how often
+    coalescing happens.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def run(self, key, fn):
+        """
+        Returns fn(), or the result of a call for key that is already running
+
+        Args:
+            key: hashable key identifying the call
+            fn: Function of no arguments
+
+        Returns:
+            result of fn
+            True if the result was shared from another call
+        """
+        with self._lock:
+            future = self._in_flight.get(key, None)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return result, False
+
+    def stats(self):
+        """Returns the "leaders" and "followers" counts, and the coalesced share"""
+        with self._lock:
+            total = self.leaders + self.followers
+            return {
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "coalesced_share": self.followers / total if total else 0.0,
+            }
@@ -0,0 +1,136 @@
+import functools
+import json
+import os
+import random
+import time
+
+# Query params kept in captured events.  Other query params, and all headers
+# but Accept, are dropped, so captures hold no client or credential data.
+CAPTURED_QUERY_PARAMETERS = {
+    "page_size",
+    "page_number",
+    "sort",
+    "meta_only",
+    "from",
+    "to",
+}
+
+# Prefix of the filter query params, which are also kept
+CAPTURED_FILTER_PREFIX = "filter["
+
+# Headers kept in captured events, in lower case
+CAPTURED_HEADERS = {"accept"}
+
+# Set when the first invocation of the container has been captured or skipped
+_warm = False
+
+
+def capture_sample_rate():
+    """Returns CAPTURE_SAMPLE_RATE, the fraction of invocations to capture"""
+    return float(os.environ.get("CAPTURE_SAMPLE_RATE", 0))
+
+
+def normalize_event(event):
+    """
+    Returns the parts of an API Gateway event that determine its response
+
+    The method, resource, path and path params are kept, together with the
+    query params in CAPTURED_QUERY_PARAMETERS or starting with
+    CAPTURED_FILTER_PREFIX, and the headers in CAPTURED_HEADERS.  The request
+    context, body and all other headers are dropped.
+
+    Args:
+        event: API Gateway event
+
+    Returns:
+        API Gateway event, with headers normalized to lower case
+    """
+    query_parameters = event.get("queryStringParameters", None) or {}
+    headers = event.get("headers", None) or {}
+    kept_query_parameters = {
+        key: value
+        for key, value in query_parameters.items()
+        if key in CAPTURED_QUERY_PARAMETERS or key.startswith(CAPTURED_FILTER_PREFIX)
+    }
+    return {
+        "httpMethod": event.get("httpMethod", "GET"),
+        "resource": event.get("resource", None),
+        "path": event.get("path", None),
+        "pathParameters": event.get("pathParameters", None),
+        "queryStringParameters": kept_query_parameters or None,
+        "headers": {
+            key.lower(): value
+            for key, value in headers.items()
+            if key.lower() in CAPTURED_HEADERS
+        },
+    }
+
+
+def traffic_captured(route):
+    """
+    Decorates an API handler to capture a sample of its invocations
+
+    An invocation is captured with probability CAPTURE_SAMPLE_RATE (default
+    0, never).  A captured invocation prints a JSON log line with the route,
+    the event normalized by normalize_event, the status code of the
+    response, the duration of the handler, and whether it was the first
+    invocation of the container.  The log lines can be replayed with
+    tools/replay.py.
+
+    Args:
+        route: route name in the log, the name of the handler
+
+    Returns:
+        decorator
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def captured(event, context):
+            global _warm
+            cold, _warm = not _warm, True
+            if random.random() >= capture_sample_rate():
+                return handler(event, context)
+            start = time.perf_counter()
+            response = handler(event, context)
+            record = {
+                "capture": route,
+                "event": normalize_event(event),
+                "status": response["statusCode"],
+                "duration_ms": (time.perf_counter() - start) * 1000,
+                "cold": cold,
+            }
+            print(json.dumps(record))
+            return response
+
+        return captured
+
+    return decorator
+
+
+def read_captures(lines):
+    """
+    Reads captured invocations from log lines
+
+    Lines that are not capture records, such as other log output, are
+    skipped, so an export of the function logs can be read directly.
+
+    Args:
+        lines: iterable of log lines
+
+    Returns:
+        list of capture records
+    """
+    captures = []
+    for line in lines:
+        line = line.strip()
+        start = line.find("{")
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except json.JSONDecodeError:
+            continue
+        if isinstance(record, dict) and "capture" in record and "event" in record:
+            captures.append(record)
+    return captures
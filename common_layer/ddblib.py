@@ -1,7 +1,10 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 
 import pandas as pd
 from boto3.dynamodb.types import TypeDeserializer
+from memlib import memory_sampled
 
 
 def ddb_decimal_to_numeric(key, value, integral_keys):
@@ -28,6 +31,7 @@ def ddb_itemlist_to_py(ddb_itemlist, integral_keys):
     return [ddb_item_to_py(ddb_item, integral_keys) for ddb_item in ddb_itemlist]
 
 
+@memory_sampled("ddb_itemlist_to_pd")
 def ddb_itemlist_to_pd(ddb_itemlist, integral_keys=set()):
     """
     Converts a DynamoDB 'Items' list to a pd.DataFrame
@@ -44,3 +48,168 @@ def ddb_itemlist_to_pd(ddb_itemlist, integral_keys=set()):
         A pandas DataFram representing the itemlist
     """
     return pd.DataFrame(ddb_itemlist_to_py(ddb_itemlist, integral_keys))
+
+
+def pd_to_ddb_itemlist(tbl, numeric_keys=("row_number",)):
+    """
+    Converts a pd.DataFrame to a DynamoDB 'Items' list in wire format
+
+    This is the inverse of ddb_itemlist_to_pd for tables, like the CSV dumps,
+    whose attributes are all numbers or strings.
+
+    Args:
+        tbl: pd.DataFrame
+        numeric_keys: Optional list of columns to encode as numbers.  Other
+            columns are encoded as strings.
+
+    Returns:
+        'Item' list for DynamoDB
+    """
+    columns = list(tbl.columns)
+    types = ["N" if column in numeric_keys else "S" for column in columns]
+    return [
+        {
+            column: {type_: str(value)}
+            for column, type_, value in zip(columns, types, row)
+        }
+        for row in tbl.itertuples(index=False, name=None)
+    ]
+
+
+def ddb_get_version(client, versions_table, table_name):
+    """
+    Returns the version marker of a table, from the versions table
+
+    Args:
+        client: boto3 DynamoDB client
+        versions_table: name of the versions table, keyed by table_name
+        table_name: name of the versioned table
+
+    Returns:
+        int version, or 0 if the table has no version marker
+    """
+    data = client.get_item(
+        TableName=versions_table, Key={"table_name": {"S": table_name}}
+    )
+    return int(data.get("Item", {}).get("version", {"N": "0"})["N"])
+
+
+def ddb_bump_version(client, versions_table, table_name):
+    """
+    Increments the version marker of a table, in the versions table
+
+    Args:
+        client: boto3 DynamoDB client
+        versions_table: name of the versions table, keyed by table_name
+        table_name: name of the versioned table
+
+    Returns:
+        int new version
+    """
+    data = client.update_item(
+        TableName=versions_table,
+        Key={"table_name": {"S": table_name}},
+        UpdateExpression="ADD #version :one",
+        ExpressionAttributeNames={"#version": "version"},
+        ExpressionAttributeValues={":one": {"N": "1"}},
+        ReturnValues="UPDATED_NEW",
+    )
+    return int(data["Attributes"]["version"]["N"])
+
+
+def ddb_scan_segment(client, table_name, segment=0, total_segments=1):
+    """
+    Scans one segment of a DynamoDB table, following LastEvaluatedKey
+
+    Args:
+        client: boto3 DynamoDB client
+        table_name: DynamoDB table name
+        segment: Segment number, from 0 to total_segments - 1
+        total_segments: Number of segments in a parallel scan
+
+    Returns:
+        'Item' list for the segment
+    """
+    kwargs = {"TableName": table_name}
+    if total_segments > 1:
+        kwargs.update({"Segment": segment, "TotalSegments": total_segments})
+    items = []
+    while True:
+        data = client.scan(**kwargs)
+        items.extend(data["Items"])
+        if "LastEvaluatedKey" not in data:
+            return items
+        kwargs["ExclusiveStartKey"] = data["LastEvaluatedKey"]
+
+
+def ddb_scan_items(client, table_name, total_segments=1):
+    """
+    Scans a whole DynamoDB table, scanning segments concurrently
+
+    With total_segments greater than 1, a parallel scan is made, with each
+    segment scanned in its own thread.  boto3 clients are thread safe, so the
+    client is shared between the threads.  The items are returned in segment
+    order.
+
+    Args:
+        client: boto3 DynamoDB client
+        table_name: DynamoDB table name
+        total_segments: Number of segments to scan concurrently
+
+    Returns:
+        'Item' list for the table
+    """
+    if total_segments <= 1:
+        return ddb_scan_segment(client, table_name)
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        segments = executor.map(
+            lambda segment: ddb_scan_segment(
+                client, table_name, segment, total_segments
+            ),
+            range(total_segments),
+        )
+        return [item for items in segments for item in items]
+
+
+def ddb_stream_records_to_changes(records, key="row_number"):
+    """
+    Collapses DynamoDB Streams style change records into one change per key
+
+    Each record has an "eventName" of "INSERT", "MODIFY" or "REMOVE", and a
+    "dynamodb" dict with the item "Keys" and, except for removals, its
+    "NewImage".  When a key changes more than once, the last record wins.
+
+    Args:
+        records: list of change records, in the order they were made
+        key: numeric key attribute
+
+    Returns:
+        dict mapping int key value to the new 'Item', or to None for removed
+        items
+    """
+    changes = {}
+    for record in records:
+        data = record["dynamodb"]
+        value = int(data["Keys"][key]["N"])
+        event_name = record["eventName"]
+        if event_name == "REMOVE":
+            changes[value] = None
+        elif event_name in ("INSERT", "MODIFY"):
+            changes[value] = data["NewImage"]
+        else:
+            raise ValueError(f"Unknown eventName {event_name}")
+    return changes
+
+
+def ddb_read_stream_records(path):
+    """
+    Reads a replay file of DynamoDB Streams style change records
+
+    Args:
+        path: file with one JSON record per line.  Blank lines are skipped.
+
+    Returns:
+        list of change records
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,29 @@
+import asyncio
+
+
+async def load_all(loaders, executor=None):
+    """
+    Runs several loaders concurrently, each in a thread of executor
+
+    This is intended for deployments in which one process serves several
+    tables, e.g.
+        await load_all({
+            "counties": get_counties_table,
+            "municipalities": get_municipalities_table,
+        })
+    Loaders backed by a cachelib.TableCache are single-flight, so a load
+    started here is shared with any concurrent requests for the same table.
+
+    Args:
+        loaders: dict mapping name to function of no arguments
+        executor: Optional concurrent.futures.Executor.  Defaults to the loop's
+            default executor.
+
+    Returns:
+        dict mapping name to result of loader
+    """
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *(loop.run_in_executor(executor, loader) for loader in loaders.values())
+    )
+    return dict(zip(loaders, results))
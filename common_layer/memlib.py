@@ -0,0 +1,153 @@
+import functools
+import json
+import os
+import random
+import resource
+import threading
+import traceback
+import tracemalloc
+
+# Frames of the profiler itself, which are left out of the allocation sites
+IGNORED_FRAMES = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+# Profiled calls in progress, in all threads.  Each maps a token of the call
+# to the peak traced memory before the last reset of the peak, which is
+# process-wide, so a reset by any call is folded into all of them.
+_peaks = {}
+_peaks_lock = threading.Lock()
+
+# Whether tracing was started by the profiled calls in progress, rather than
+# by the process, as with PYTHONTRACEMALLOC
+_tracing_started = False
+
+# Depth of the profiled calls in progress in the current thread
+_local = threading.local()
+
+
+def memory_sample_rate():
+    """Returns MEMORY_SAMPLE_RATE, the fraction of calls to profile"""
+    return float(os.environ.get("MEMORY_SAMPLE_RATE", 0))
+
+
+def peak_rss_bytes():
+    """Returns the peak resident set size of the process"""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def top_allocation_sites(before, after, limit):
+    """
+    Returns the source lines that allocated the most memory between snapshots
+
+    Args:
+        before: tracemalloc.Snapshot at the start of a phase
+        after: tracemalloc.Snapshot at the end of a phase
+        limit: number of sites
+
+    Returns:
+        list of dicts with "site", "size_bytes" and "count"
+    """
+    stats = after.filter_traces(IGNORED_FRAMES).compare_to(
+        before.filter_traces(IGNORED_FRAMES), "lineno"
+    )
+    return [
+        {
+            "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_bytes": stat.size_diff,
+            "count": stat.count_diff,
+        }
+        for stat in stats[:limit]
+        if stat.size_diff > 0
+    ]
+
+
+def memory_sampled(phase):
+    """
+    Decorates a function to profile its memory use in a sample of calls
+
+    A call is profiled if it is nested in a profiled call, or else with
+    probability MEMORY_SAMPLE_RATE (default 0, never).  A profiled call
+    takes tracemalloc snapshots before and after the function, and prints a
+    JSON log line with the memory allocated and not freed by the phase, the
+    peak memory allocated during it, the peak RSS of the process, and the
+    MEMORY_SAMPLE_TOP (default 10) source lines that allocated the most.
+    Tracing is started by the first profiled call, and stopped when the last
+    one in progress, in any thread, returns, so unsampled calls run at full
+    speed.  The peaks of calls that overlap in other threads include each
+    other's allocations.
+
+    Args:
+        phase: name of the phase in the log
+
+    Returns:
+        decorator
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def sampled(*args, **kwargs):
+            nested = getattr(_local, "depth", 0) > 0
+            if not nested and random.random() >= memory_sample_rate():
+                return fn(*args, **kwargs)
+            return profile_phase(phase, fn, *args, **kwargs)
+
+        return sampled
+
+    return decorator
+
+
+def profile_phase(phase, fn, *args, **kwargs):
+    """
+    Calls fn, and prints the memory profile of the call as phase
+
+    A failure to profile the call is logged, and does not replace its result.
+    """
+    global _tracing_started
+    token = object()
+    with _peaks_lock:
+        if not _peaks and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        fold_peak(tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        _peaks[token] = 0
+        before = tracemalloc.take_snapshot()
+        start = tracemalloc.get_traced_memory()[0]
+    _local.depth = getattr(_local, "depth", 0) + 1
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _local.depth -= 1
+        try:
+            with _peaks_lock:
+                try:
+                    current, peak = tracemalloc.get_traced_memory()
+                    after = tracemalloc.take_snapshot()
+                    peak = max(_peaks[token], peak)
+                    fold_peak(peak)
+                finally:
+                    del _peaks[token]
+                    if not _peaks and _tracing_started:
+                        tracemalloc.stop()
+                        _tracing_started = False
+            limit = int(os.environ.get("MEMORY_SAMPLE_TOP", 10))
+            record = {
+                "memory_profile": phase,
+                "allocated_bytes": current - start,
+                "peak_traced_bytes": peak - start,
+                "peak_rss_bytes": peak_rss_bytes(),
+                "top": top_allocation_sites(before, after, limit),
+            }
+            print(json.dumps(record))
+        except Exception:
+            traceback.print_exc()
+
+
+def fold_peak(peak):
+    """Raises the peaks of the profiled calls in progress to peak, under _peaks_lock"""
+    for token, value in _peaks.items():
+        _peaks[token] = max(value, peak)
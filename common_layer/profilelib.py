@@ -0,0 +1,224 @@
+import functools
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+
+# Header that switches profiling on for one request, if it matches PROFILE_TOKEN
+PROFILE_HEADER = "x-debug-profile"
+
+# Output formats, by file extension
+PROFILE_FORMATS = {"collapsed": "txt", "speedscope": "speedscope.json"}
+
+
+class StackSampler:
+    """
+    Statistical profiler that samples the stack of one thread
+
+    A background thread reads the stack of the profiled thread every
+    interval seconds, with sys._current_frames, so the profiled code is not
+    instrumented and runs at close to full speed.  Each sample is the stack
+    of (function, file, first line) frames, outermost first.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval = interval
+        self.samples = []
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._start = None
+
+    def start(self):
+        """Starts sampling"""
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling"""
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._start
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id, None)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.samples.append(tuple(reversed(stack)))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def frame_label(frame):
+    """Returns the label of a (function, file, line) frame in a collapsed stack"""
+    name, file_name, line = frame
+    return f"{name} ({file_name}:{line})".replace(";", ":")
+
+
+def collapsed_stacks(samples):
+    """
+    Formats samples as collapsed stacks, for flamegraph.pl and similar tools
+
+    Args:
+        samples: list of stacks from StackSampler
+
+    Returns:
+        text with one "frame;frame;... count" line per distinct stack
+    """
+    counts = {}
+    for stack in samples:
+        key = ";".join(frame_label(frame) for frame in stack)
+        counts[key] = counts.get(key, 0) + 1
+    return "".join(f"{key} {count}\n" for key, count in sorted(counts.items()))
+
+
+def speedscope_profile(samples, name, interval):
+    """
+    Formats samples as a speedscope sampled profile
+
+    Args:
+        samples: list of stacks from StackSampler
+        name: profile name
+        interval: sampling interval in seconds, used as the weight of a sample
+
+    Returns:
+        dict in the speedscope file format
+    """
+    frames = []
+    frame_indexes = {}
+    stacks = []
+    for stack in samples:
+        indexes = []
+        for frame in stack:
+            if frame not in frame_indexes:
+                frame_indexes[frame] = len(frames)
+                function, file_name, line = frame
+                frames.append({"name": function, "file": file_name, "line": line})
+            indexes.append(frame_indexes[frame])
+        stacks.append(indexes)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": len(stacks) * interval,
+                "samples": stacks,
+                "weights": [interval] * len(stacks),
+            }
+        ],
+        "name": name,
+    }
+
+
+def write_profile(sampler, name, directory, format="collapsed"):
+    """
+    Writes the samples of a sampler to a new file in directory
+
+    Args:
+        sampler: stopped StackSampler
+        name: profile name, used in the file name
+        directory: output directory, created if required
+        format: "collapsed" or "speedscope"
+
+    Returns:
+        path of the written file
+    """
+    if format not in PROFILE_FORMATS:
+        raise ValueError(f"Unsupported format {format}")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}-{time.time_ns()}.{PROFILE_FORMATS[format]}")
+    with open(path, "w") as f:
+        if format == "collapsed":
+            f.write(collapsed_stacks(sampler.samples))
+        else:
+            json.dump(speedscope_profile(sampler.samples, name, sampler.interval), f)
+    return path
+
+
+def is_profile_requested(event):
+    """
+    Returns True if an API Gateway event should be profiled
+
+    An event is profiled if it has the PROFILE_HEADER header with the value of
+    PROFILE_TOKEN, or else with probability PROFILE_SAMPLE_RATE (default 0).
+    Without PROFILE_TOKEN, the header is ignored.
+    """
+    token = os.environ.get("PROFILE_TOKEN", "")
+    if token:
+        headers = event.get("headers", None) or {}
+        for key, value in headers.items():
+            if key.lower() == PROFILE_HEADER and hmac.compare_digest(
+                value.encode(), token.encode()
+            ):
+                return True
+    return random.random() < float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+
+
+def profile_sampled(name):
+    """
+    Decorates an API handler to profile a sample of its invocations
+
+    Profiled invocations, chosen by is_profile_requested, run under a
+    StackSampler with an interval of PROFILE_INTERVAL_MS (default 5)
+    milliseconds.  The profile is written to PROFILE_DIR (default
+    /tmp/profiles) in PROFILE_FORMAT, "collapsed" (default) or "speedscope",
+    and its path and duration are printed as a JSON log line.  A profile
+    that cannot be written is logged, and the response is returned as is.
+
+    Args:
+        name: profile name
+
+    Returns:
+        decorator
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def profiled(event, context):
+            if not is_profile_requested(event):
+                return handler(event, context)
+            interval = float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000
+            with StackSampler(interval=interval) as sampler:
+                response = handler(event, context)
+            try:
+                path = write_profile(
+                    sampler,
+                    name,
+                    os.environ.get("PROFILE_DIR", "/tmp/profiles"),
+                    os.environ.get("PROFILE_FORMAT", "collapsed"),
+                )
+            except Exception:
+                traceback.print_exc()
+                return response
+            record = {
+                "profile": name,
+                "path": path,
+                "duration_seconds": sampler.duration,
+                "samples": len(sampler.samples),
+            }
+            print(json.dumps(record))
+            return response
+
+        return profiled
+
+    return decorator
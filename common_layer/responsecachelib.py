@@ -0,0 +1,391 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from http import HTTPStatus
+
+import boto3
+from cachelib import RequestCoalescer
+from responselib import copy_response, make_render_key, params_memoized
+
+# Default lifetime of cached responses, in seconds
+DEFAULT_TTL_SECONDS = 3600
+
+# Default limit on the size of a cached response, which keeps DynamoDB items
+# under the 400 KB item limit
+DEFAULT_MAX_BYTES = 350000
+
+# Default limit on the total size of the entries of a FileBackend
+DEFAULT_FILE_CACHE_BYTES = 256 * 1024 * 1024
+
+# Number of puts to a FileBackend between sweeps of its directory
+FILE_CACHE_SWEEP_INTERVAL = 100
+
+# Coalescer of identical requests in flight at once, shared by the handlers
+# decorated with request_coalesced
+request_coalescer = RequestCoalescer()
+
+
+class MemoryBackend:
+    """
+    In-process response cache backend, for tests and local runs
+
+    Entries are evicted least recently used first, beyond max_entries.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the (expires_at, payload) entry for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, expires_at, payload):
+        """Stores payload under key until expires_at"""
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class FileBackend:
+    """
+    Response cache backend with one file per entry, e.g. on a shared EFS mount
+
+    Entries are written to a temporary file and renamed into place, so
+    readers never see a partial entry.  The modification time of an entry
+    file is set to its expiry time.  Expired entries are removed when they
+    are read, and every FILE_CACHE_SWEEP_INTERVAL puts, the directory is
+    swept of expired entries, and of the entries that expire first beyond
+    max_bytes in total.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_FILE_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Returns the (expires_at, payload) entry for key, or None"""
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        if entry["expires_at"] <= time.time():
+            self._remove(self._path(key))
+            return None
+        return entry["expires_at"], entry["payload"]
+
+    def put(self, key, expires_at, payload):
+        """Stores payload under key until expires_at"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"expires_at": expires_at, "payload": payload}, f)
+        os.utime(temporary, (expires_at, expires_at))
+        os.replace(temporary, path)
+        with self._lock:
+            sweep = self._puts % FILE_CACHE_SWEEP_INTERVAL == 0
+            self._puts += 1
+        if sweep:
+            self.sweep()
+
+    def sweep(self):
+        """
+        Removes expired entries, and the entries that expire first beyond max_bytes
+
+        Entries can be removed by several processes at once, so entries that
+        are already gone are skipped.
+
+        Returns:
+            number of entries removed
+        """
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        now = time.time()
+        total_bytes = sum(size for _, size, _ in entries)
+        removed = 0
+        for expires_at, size, path in entries:
+            if expires_at > now and total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+            removed += 1
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class DynamoDBBackend:
+    """
+    Response cache backend in a DynamoDB table keyed by cache_key (S)
+
+    The expiry time is stored in expires_at, which can be used as the TTL
+    attribute of the table, so that DynamoDB deletes expired entries.
+    """
+
+    def __init__(self, table_name, client=None):
+        self.table_name = table_name
+        self.client = boto3.client("dynamodb") if client is None else client
+
+    def get(self, key):
+        """Returns the (expires_at, payload) entry for key, or None"""
+        data = self.client.get_item(
+            TableName=self.table_name, Key={"cache_key": {"S": key}}
+        )
+        item = data.get("Item", None)
+        if item is None:
+            return None
+        return float(item["expires_at"]["N"]), item["payload"]["S"]
+
+    def put(self, key, expires_at, payload):
+        """Stores payload under key until expires_at"""
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "cache_key": {"S": key},
+                "expires_at": {"N": str(int(expires_at))},
+                "payload": {"S": payload},
+            },
+        )
+
+
+class ResponseCache:
+    """
+    Second-level cache of rendered API responses, shared between containers
+
+    Responses are keyed by the name of the handler, the version of the
+    dataset and a key of the request, such as from make_render_key or
+    make_params_key, so a new dataset version misses every old entry.  Only
+    successful responses of at most max_bytes are cached.  Backend errors
+    are logged and treated as misses, so the cache never fails a request.
+    """
+
+    def __init__(self, backend, ttl=DEFAULT_TTL_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(name, data_version, request_key):
+        """Returns the cache key of the response of a handler to a request"""
+        payload = json.dumps([name, data_version, request_key])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, name, data_version, request_key):
+        """Returns the cached response to the request, or None"""
+        try:
+            entry = self.backend.get(self.make_key(name, data_version, request_key))
+        except Exception:
+            traceback.print_exc()
+            return None
+        if entry is None:
+            return None
+        expires_at, payload = entry
+        if expires_at <= time.time():
+            return None
+        return json.loads(payload)
+
+    def put(self, name, data_version, request_key, response):
+        """
+        Caches the response to the request, if it is cacheable
+
+        Returns:
+            True if the response was cached
+        """
+        if response["statusCode"] != HTTPStatus.OK:
+            return False
+        payload = json.dumps(response)
+        if len(payload.encode()) > self.max_bytes:
+            return False
+        try:
+            self.backend.put(
+                self.make_key(name, data_version, request_key),
+                time.time() + self.ttl,
+                payload,
+            )
+        except Exception:
+            traceback.print_exc()
+            return False
+        return True
+
+
+@functools.lru_cache(maxsize=None)
+def make_response_cache(kind, location, ttl, max_bytes):
+    """
+    Returns a ResponseCache, shared by calls with the same arguments
+
+    Args:
+        kind: "dynamodb", "file" or "memory"
+        location: table name for "dynamodb", directory for "file"
+        ttl: lifetime of entries, in seconds
+        max_bytes: size limit of cached responses
+
+    Returns:
+        ResponseCache
+    """
+    if kind == "dynamodb":
+        backend = DynamoDBBackend(location)
+    elif kind == "file":
+        backend = FileBackend(location)
+    elif kind == "memory":
+        backend = MemoryBackend()
+    else:
+        raise ValueError(f"Unsupported response cache {kind}")
+    return ResponseCache(backend, ttl, max_bytes)
+
+
+def get_response_cache():
+    """
+    Returns the ResponseCache configured by the environment, or None
+
+    RESPONSE_CACHE selects the backend, "dynamodb" (with the table
+    RESPONSE_CACHE_TABLE), "file" (in the directory RESPONSE_CACHE_DIR) or
+    "memory".  If it is unset or empty, there is no second-level cache.
+    RESPONSE_CACHE_TTL_SECONDS and RESPONSE_CACHE_MAX_BYTES set the lifetime
+    and size limit of entries.
+    """
+    kind = os.environ.get("RESPONSE_CACHE", "")
+    if not kind:
+        return None
+    location = {
+        "dynamodb": os.environ.get("RESPONSE_CACHE_TABLE"),
+        "file": os.environ.get("RESPONSE_CACHE_DIR", "/tmp/responses"),
+    }.get(kind, None)
+    return make_response_cache(
+        kind,
+        location,
+        float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+        int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+    )
+
+
+def response_cached(name, get_data_version, make_key=make_render_key):
+    """
+    Decorates an API handler to serve responses from the second-level cache
+
+    The cache is looked up before the handler runs, so a hit is served
+    without loading the tables or building the indexes.  Responses are
+    cached under the dataset version from get_data_version; if it returns
+    None, because the version is not tracked, the cache is bypassed.  It is
+    also bypassed for requests that make_key returns None for, such as
+    invalid requests.  The handler runs within params_memoized, so params
+    processed for the key are not processed again.
+
+    Args:
+        name: handler name, part of the cache key
+        get_data_version: Function of no arguments that returns the dataset
+            version
+        make_key: Function of an event that returns a key of the request,
+            or None if it is not to be cached
+
+    Returns:
+        decorator
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def cached(event, context):
+            with params_memoized():
+                cache = get_response_cache()
+                if cache is None:
+                    return handler(event, context)
+                try:
+                    data_version = get_data_version()
+                except Exception:
+                    traceback.print_exc()
+                    data_version = None
+                if data_version is None:
+                    return handler(event, context)
+                try:
+                    request_key = make_key(event)
+                except Exception:
+                    traceback.print_exc()
+                    request_key = None
+                if request_key is None:
+                    return handler(event, context)
+                response = cache.get(name, data_version, request_key)
+                if response is not None:
+                    return response
+                response = handler(event, context)
+                cache.put(name, data_version, request_key, response)
+                return response
+
+        return cached
+
+    return decorator
+
+
+def request_coalesced(name, make_key=make_render_key):
+    """
+    Decorates an API handler to coalesce identical concurrent requests
+
+    Requests with the same handler name and key that arrive while one of
+    them is being handled wait for it, and get a copy of its response, with
+    its own headers.  Requests that make_key returns None for, such as invalid
+    requests, are not coalesced.
+    This matters in hosts that run the handlers on several threads, where a
+    popular page that is not cached, or a table refresh, would otherwise
+    have every waiting request build the same response.  request_coalescer
+    counts how often it happens.  As with response_cached, the handler runs
+    within params_memoized.
+
+    Args:
+        name: handler name, part of the coalescing key
+        make_key: Function of an event that returns a key of the request, or
+            None if it is not to be coalesced
+
+    Returns:
+        decorator
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def coalesced(event, context):
+            with params_memoized():
+                try:
+                    request_key = make_key(event)
+                except Exception:
+                    traceback.print_exc()
+                    request_key = None
+                if request_key is None:
+                    return handler(event, context)
+                response, shared = request_coalescer.run(
+                    (name, request_key), lambda: handler(event, context)
+                )
+                return copy_response(response) if shared else response
+
+        return coalesced
+
+    return decorator
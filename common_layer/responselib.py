@@ -0,0 +1,351 @@
+import base64
+import contextlib
+import hashlib
+import json
+import threading
+from http import HTTPStatus
+
+import pandas as pd
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+JSONAPI_CONTENT_TYPE = "application/vnd.api+json"
+CSV_CONTENT_TYPE = "text/csv"
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+# Processed params of the events being handled, per thread; see params_memoized
+_params_memo = threading.local()
+
+
+def table_version(tbl):
+    """
+    Returns a fingerprint of the contents of a table
+
+    The fingerprint changes whenever any value in the table changes, so it
+    can be used to version responses derived from the table.
+
+    Args:
+        tbl: pd.DataFrame
+
+    Returns:
+        hex digest string
+    """
+    hashed = pd.util.hash_pandas_object(tbl.astype(str), index=False)
+    return hashlib.sha256(hashed.to_numpy().tobytes()).hexdigest()
+
+
+def is_head_request(event):
+    """Returns True if the API Gateway event is a HEAD request"""
+    return event.get("httpMethod", None) == "HEAD"
+
+
+def parse_meta_only(event, query_parameters):
+    """
+    Determines whether only the meta block was requested
+
+    HEAD requests are always meta only.  Otherwise, the optional meta_only
+    query param must be "true" or "false".
+
+    Args:
+        event: API Gateway event
+        query_parameters: dict of query params
+
+    Returns:
+        True or False, or None if the meta_only param is invalid
+    """
+    if is_head_request(event):
+        return True
+    meta_only = query_parameters.get("meta_only", "false").lower()
+    if meta_only not in ("true", "false"):
+        return None
+    return meta_only == "true"
+
+
+def make_etag(version, links, meta):
+    """Returns a weak ETag for the links and meta of a table version"""
+    payload = json.dumps([version, links, meta], sort_keys=True, default=str)
+    return f'W/"{hashlib.sha256(payload.encode()).hexdigest()[:32]}"'
+
+
+def make_meta_header(key):
+    """Converts a meta key such as record_count to a header such as X-Record-Count"""
+    return "X-" + "-".join(word.capitalize() for word in key.split("_"))
+
+
+def meta_result(links, meta, etag, head=False):
+    """
+    Returns an HTTP result containing only the links and meta blocks
+
+    The meta values are also returned as X- headers, so that HEAD requests,
+    which have no body, can read them.
+
+    Args:
+        links: links dict, from torguapi_make_links_and_meta
+        meta: meta dict, from torguapi_make_links_and_meta
+        etag: ETag header value
+        head: If True, return an empty body
+
+    Returns:
+        HTTP result dict with statusCode, headers and body
+    """
+    headers = {"Content-Type": JSONAPI_CONTENT_TYPE, "ETag": etag}
+    headers.update({make_meta_header(key): str(value) for key, value in meta.items()})
+    body = "" if head else json.dumps({"links": links, "meta": meta})
+    return {"statusCode": HTTPStatus.OK.value, "headers": headers, "body": body}
+
+
+def supported_content_types():
+    """Returns the supported response content types, in order of preference"""
+    content_types = [JSONAPI_CONTENT_TYPE, CSV_CONTENT_TYPE]
+    if pyarrow is not None:
+        content_types.append(ARROW_CONTENT_TYPE)
+    if msgpack is not None:
+        content_types.append(MSGPACK_CONTENT_TYPE)
+    return content_types
+
+
+def get_header(event, name):
+    """Returns a header from an API Gateway event, ignoring case, or None"""
+    headers = event.get("headers", None) or {}
+    for key, value in headers.items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+
+def parse_accept(accept):
+    """
+    Parses an Accept header into a list of media ranges and quality values
+
+    Args:
+        accept: Accept header value
+
+    Returns:
+        list of (media range, q) tuples, in header order
+    """
+    media_ranges = []
+    for item in accept.split(","):
+        media_range, *accept_params = [part.strip() for part in item.split(";")]
+        if not media_range:
+            continue
+        q = 1.0
+        for accept_param in accept_params:
+            key, _, value = accept_param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        media_ranges.append((media_range.lower(), q))
+    return media_ranges
+
+
+def negotiate_content_type(event):
+    """
+    Chooses the response content type from the Accept header of an event
+
+    "application/json" is treated as JSON:API.  Ties are broken by the order of
+    supported_content_types, and JSON:API is returned if there is no Accept
+    header or no acceptable supported type.
+
+    Args:
+        event: API Gateway event
+
+    Returns:
+        content type
+    """
+    accept = get_header(event, "Accept")
+    if not accept:
+        return JSONAPI_CONTENT_TYPE
+    media_ranges = parse_accept(accept)
+
+    def quality(content_type):
+        aliases = {content_type, content_type.split("/")[0] + "/*", "*/*"}
+        if content_type == JSONAPI_CONTENT_TYPE:
+            aliases.add("application/json")
+        qs = [q for media_range, q in media_ranges if media_range in aliases]
+        return max(qs, default=0.0)
+
+    best = max(supported_content_types(), key=quality)
+    if quality(best) <= 0.0:
+        return JSONAPI_CONTENT_TYPE
+    return best
+
+
+def make_render_key(event):
+    """
+    Returns a key identifying the response to an API Gateway event
+
+    Events with the same key get the same response, so the key can be used to
+    look up prerendered responses.
+
+    Args:
+        event: API Gateway event
+
+    Returns:
+        tuple of method, path, query params and negotiated content type
+    """
+    query_parameters = event.get("queryStringParameters", None) or {}
+    return (
+        event.get("httpMethod", "GET"),
+        event.get("path", None),
+        tuple(sorted(query_parameters.items())),
+        negotiate_content_type(event),
+    )
+
+
+def make_params_key(process_params, event):
+    """
+    Returns a key identifying the response to an API Gateway event from its params
+
+    Unlike make_render_key, the query is represented by the params processed
+    from it, so unknown query params, and different spellings of the same
+    params, do not make distinct keys.  Use functools.partial to bind
+    process_params, for response_cached and request_coalesced.  The params
+    are processed with process_params_once, so within params_memoized the
+    handler reuses them.
+
+    Args:
+        process_params: process_*_params function of the handler
+        event: API Gateway event
+
+    Returns:
+        tuple of method, path, JSON of the params and negotiated content type,
+        or None if the params are invalid
+    """
+    status_code, _, params = process_params_once(process_params, event)
+    if status_code != HTTPStatus.OK:
+        return None
+    return (
+        event.get("httpMethod", "GET"),
+        event.get("path", None),
+        json.dumps(params, sort_keys=True),
+        negotiate_content_type(event),
+    )
+
+
+@contextlib.contextmanager
+def params_memoized():
+    """
+    Within the block, process_params_once processes each event only once
+
+    response_cached and request_coalesced run the handler in this block, so
+    the params processed for their keys are reused by the handler, rather
+    than being processed again for each.  Nested blocks share the memo of
+    the outermost one, which is dropped when it exits, so an event that is
+    changed and handled again is processed again.
+    """
+    if getattr(_params_memo, "entries", None) is not None:
+        yield
+        return
+    _params_memo.entries = {}
+    try:
+        yield
+    finally:
+        _params_memo.entries = None
+
+
+def process_params_once(process_params, event):
+    """
+    Returns process_params(event), reusing the result within params_memoized
+
+    Outside params_memoized, process_params is simply called.  The result
+    is shared, so callers must not change the params.
+
+    Args:
+        process_params: process_*_params function of the handler
+        event: API Gateway event
+
+    Returns:
+        result of process_params(event)
+    """
+    entries = getattr(_params_memo, "entries", None)
+    if entries is None:
+        return process_params(event)
+    key = (process_params, id(event))
+    entry = entries.get(key, None)
+    if entry is None or entry[0] is not event:
+        entry = entries[key] = (event, process_params(event))
+    return entry[1]
+
+
+def copy_response(response):
+    """
+    Returns a copy of an HTTP result that can be changed without changing response
+
+    The headers dict is copied along with the result, so prerendered or
+    shared responses are never modified through a copy.  The body is a
+    string, and is shared.
+    """
+    copied = dict(response)
+    if copied.get("headers", None) is not None:
+        copied["headers"] = dict(copied["headers"])
+    return copied
+
+
+def make_prewarm_event(path, path_parameters=None):
+    """Returns a plain GET API Gateway event for path, for prerendering responses"""
+    return {
+        "httpMethod": "GET",
+        "path": path,
+        "pathParameters": path_parameters,
+        "queryStringParameters": None,
+        "headers": {},
+    }
+
+
+def make_link_header(links):
+    """Converts a links dict to a Link header value"""
+    return ", ".join(f'<{link}>; rel="{name}"' for name, link in links.items())
+
+
+def formatted_result(result_set, links, meta, content_type):
+    """
+    Returns an HTTP result with the result set encoded as content_type
+
+    The links are returned in a Link header and the meta values as X- headers.
+    CSV is returned as text; Arrow IPC streams and MessagePack (a map of
+    column name to column values) are returned base64 encoded.
+
+    Args:
+        result_set: pd.DataFrame
+        links: links dict, from torguapi_make_links_and_meta
+        meta: meta dict, from torguapi_make_links_and_meta
+        content_type: One of CSV_CONTENT_TYPE, ARROW_CONTENT_TYPE or MSGPACK_CONTENT_TYPE
+
+    Returns:
+        HTTP result dict with statusCode, headers, body and isBase64Encoded
+    """
+    headers = {"Content-Type": content_type, "Link": make_link_header(links)}
+    headers.update({make_meta_header(key): str(value) for key, value in meta.items()})
+    if content_type == CSV_CONTENT_TYPE:
+        body = result_set.to_csv(index=False)
+        is_base64_encoded = False
+    elif content_type == ARROW_CONTENT_TYPE:
+        table = pyarrow.Table.from_pandas(result_set, preserve_index=False)
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        body = base64.b64encode(sink.getvalue().to_pybytes()).decode()
+        is_base64_encoded = True
+    elif content_type == MSGPACK_CONTENT_TYPE:
+        columns = {column: result_set[column].tolist() for column in result_set}
+        body = base64.b64encode(msgpack.packb(columns)).decode()
+        is_base64_encoded = True
+    else:
+        raise ValueError(f"Unsupported content type {content_type}")
+    return {
+        "statusCode": HTTPStatus.OK.value,
+        "headers": headers,
+        "body": body,
+        "isBase64Encoded": is_base64_encoded,
+    }
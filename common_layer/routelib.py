@@ -0,0 +1,143 @@
+import re
+import threading
+from collections import OrderedDict
+
+# Patterns for path parameters in route templates, such as {year} in
+# /nj/municipalities/{year}
+TEMPLATE_PARAMETER = re.compile(r"{(\w+)\+?}")
+
+
+def compile_routes(templates, patterns):
+    """
+    Compiles route templates into a table of path parameter validators
+
+    Every parameter in every template must have a pattern, so that a route
+    that cannot be validated fails at import time rather than per request.
+
+    Args:
+        templates: list of route templates, such as "/nj/municipalities/{year}"
+        patterns: dict mapping path parameter name to regular expression
+
+    Returns:
+        dict mapping template to tuple of (parameter name, compiled pattern)
+    """
+    compiled = {name: re.compile(pattern) for name, pattern in patterns.items()}
+    routes = {}
+    for template in templates:
+        names = TEMPLATE_PARAMETER.findall(template)
+        unknown = [name for name in names if name not in compiled]
+        if unknown:
+            raise ValueError(f"No pattern for {unknown} in route {template}")
+        routes[template] = tuple((name, compiled[name]) for name in names)
+    return routes
+
+
+def find_invalid_path_parameter(routes, event):
+    """
+    Returns the first path parameter of an event that does not match its pattern
+
+    The validators are looked up by the event resource (the route template).
+    For other resources, such as a proxy resource, every path parameter with a
+    validator in some route is checked.
+
+    Args:
+        routes: route table from compile_routes
+        event: API Gateway event
+
+    Returns:
+        (name, value) of the invalid parameter, or None if all are valid
+    """
+    path_parameters = event.get("pathParameters", None) or {}
+    validators = routes.get(event.get("resource", None), None)
+    if validators is None:
+        validators = {
+            name: pattern
+            for route_validators in routes.values()
+            for name, pattern in route_validators
+        }.items()
+    for name, pattern in validators:
+        value = path_parameters.get(name, None)
+        if value is not None and not pattern.fullmatch(value):
+            return name, value
+    return None
+
+
+def match_route(routes, path):
+    """
+    Finds the route template of a path, and its path parameters
+
+    As in API Gateway, a literal segment takes precedence over a path
+    parameter, so /nj/municipalities/history/{GEOID} is preferred to
+    /nj/municipalities/{year}/{GEOID}.  Path parameters are not validated;
+    see find_invalid_path_parameter.
+
+    Args:
+        routes: dict keyed by route template, such as a route table from
+            compile_routes
+        path: request path, such as "/nj/municipalities/2010"
+
+    Returns:
+        (template, dict of path params), or None if no route matches
+    """
+    segments = path.strip("/").split("/")
+    best = None
+    for template in routes:
+        template_segments = template.strip("/").split("/")
+        if len(template_segments) != len(segments):
+            continue
+        path_parameters = {}
+        literals = 0
+        for template_segment, segment in zip(template_segments, segments):
+            parameter = TEMPLATE_PARAMETER.fullmatch(template_segment)
+            if parameter is not None and segment:
+                path_parameters[parameter.group(1)] = segment
+            elif template_segment == segment:
+                literals += 1
+            else:
+                break
+        else:
+            if best is None or literals > best[0]:
+                best = (literals, template, path_parameters)
+    return None if best is None else best[1:]
+
+
+def memoize_links_and_meta(make_links_and_meta, maxsize=1024):
+    """
+    Memoizes a torguapi_make_links_and_meta style function
+
+    The links and meta depend only on the path and the pagination values in
+    aux, so results are cached by (path, page_size, page_number, record_count),
+    in a thread-safe LRU cache of at most maxsize entries.  Copies are
+    returned, so callers may modify them.
+
+    Args:
+        make_links_and_meta: Function of (aux, path) returning (links, meta)
+        maxsize: Maximum number of cached results
+
+    Returns:
+        memoized function of (aux, path)
+    """
+    cache = OrderedDict()
+    lock = threading.Lock()
+
+    def memoized(aux, path):
+        key = (
+            path,
+            aux.get("page_size", None),
+            aux.get("page_number", None),
+            aux.get("record_count", None),
+        )
+        with lock:
+            result = cache.get(key, None)
+            if result is not None:
+                cache.move_to_end(key)
+        if result is None:
+            result = make_links_and_meta(aux, path)
+            with lock:
+                cache[key] = result
+                if len(cache) > maxsize:
+                    cache.popitem(last=False)
+        links, meta = result
+        return dict(links), dict(meta)
+
+    return memoized
@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+from tablelib import intern_string
+
+# Name of the manifest in each published version directory
+MANIFEST = "manifest.json"
+
+
+def current_pointer(directory, name):
+    """Returns the path of the file naming the current version of table name"""
+    return os.path.join(directory, f"{name}.current")
+
+
+def publish_table(tbl, directory, name, keep=2):
+    """
+    Publishes a table as memory-mappable column files
+
+    Numeric and boolean columns are written as .npy files.  Categorical and
+    string columns are written as integer codes, which are memory-mapped
+    too, plus their distinct values.  The files go in a new version directory,
+    and then the current version pointer of the table is replaced with
+    os.replace, so readers see either the old version or the new one.  Older
+    versions beyond keep are removed; processes that still map them keep
+    their mappings until they attach to the new version.
+
+    Args:
+        tbl: pd.DataFrame, e.g. from compact_table
+        directory: directory for published tables, e.g. on /dev/shm
+        name: table name
+        keep: number of versions to keep
+
+    Returns:
+        name of the published version
+    """
+    version = f"{name}-{time.time_ns()}"
+    path = os.path.join(directory, version)
+    os.makedirs(path)
+    columns = []
+    for position, key in enumerate(tbl.columns):
+        column = tbl[key]
+        file_name = f"{position}.npy"
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            values = list(column.cat.categories)
+            codes = column.cat.codes.to_numpy()
+            kind = "category"
+        elif column.dtype == object:
+            codes, uniques = pd.factorize(column)
+            values = list(uniques)
+            kind = "object"
+        else:
+            codes = column.to_numpy()
+            values = None
+            kind = "numeric"
+        np.save(os.path.join(path, file_name), codes, allow_pickle=False)
+        columns.append({"name": key, "kind": kind, "file": file_name, "values": values})
+    with open(os.path.join(path, MANIFEST), "w") as f:
+        json.dump({"version": version, "columns": columns}, f)
+
+    pointer = current_pointer(directory, name)
+    with open(f"{pointer}.tmp", "w") as f:
+        f.write(version)
+    os.replace(f"{pointer}.tmp", pointer)
+
+    versions = sorted(
+        entry
+        for entry in os.listdir(directory)
+        if entry.startswith(f"{name}-")
+        and os.path.isdir(os.path.join(directory, entry))
+    )
+    for old_version in versions[:-keep]:
+        shutil.rmtree(os.path.join(directory, old_version), ignore_errors=True)
+    return version
+
+
+def published_version(directory, name):
+    """Returns the current version of a published table, or None"""
+    try:
+        with open(current_pointer(directory, name)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def attach_table(directory, name):
+    """
+    Attaches to the current version of a published table, read-only
+
+    Numeric columns and the codes of categorical columns are memory-mapped,
+    so their pages are shared by every process that attaches.  String columns
+    are rebuilt from their codes and distinct values, which are interned, so
+    each process holds one pointer per cell rather than one string per cell.
+
+    Args:
+        directory: directory for published tables
+        name: table name
+
+    Returns:
+        name of the attached version
+        pd.DataFrame, with a RangeIndex
+    """
+    version = published_version(directory, name)
+    if version is None:
+        raise FileNotFoundError(f"No published version of {name} in {directory}")
+    path = os.path.join(directory, version)
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    data = {}
+    for column in manifest["columns"]:
+        codes = np.asarray(np.load(os.path.join(path, column["file"]), mmap_mode="r"))
+        if column["kind"] == "category":
+            data[column["name"]] = pd.Categorical.from_codes(codes, column["values"])
+        elif column["kind"] == "object":
+            values = np.array(
+                [intern_string(value) for value in column["values"]] + [None],
+                dtype=object,
+            )
+            data[column["name"]] = values[codes]
+        else:
+            data[column["name"]] = codes
+    return version, pd.DataFrame(data, copy=False)
@@ -0,0 +1,67 @@
+import sys
+
+from util import un_none
+
+
+def intern_string(value):
+    """Intern value if it is a string, so that equal strings share one object"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def compact_table(tbl, dtypes=None, interned_keys=()):
+    """
+    Converts a table to a compact in-memory representation
+
+    Columns listed in dtypes are converted to the given dtype, e.g. "int16"
+    for years or "category" for columns with few distinct values.  The string
+    values of the columns in interned_keys are interned, so that repeated
+    values, including values repeated across columns, share a single object.
+    Columns that are not in the table are ignored.
+
+    Args:
+        tbl: pd.DataFrame
+        dtypes: Optional dict mapping column name to dtype
+        interned_keys: Optional list of object columns to intern
+
+    Returns:
+        A compacted copy of tbl
+    """
+    dtypes = un_none(dtypes, {})
+    compacted = tbl.astype({key: dtypes[key] for key in dtypes if key in tbl})
+    for key in interned_keys:
+        if key not in compacted:
+            continue
+        compacted[key] = compacted[key].map(intern_string).astype(object)
+    return compacted
+
+
+def table_footprint(tbl):
+    """
+    Reports the memory used by a table, by column
+
+    Unlike DataFrame.memory_usage(deep=True), each Python object is counted
+    once, however many cells refer to it, so the effect of interning is
+    reflected in the report.
+
+    Args:
+        tbl: pd.DataFrame
+
+    Returns:
+        dict with "columns", mapping column name to bytes, "index" and "total"
+    """
+    seen = set()
+    columns = {}
+    for key in tbl.columns:
+        column = tbl[key]
+        if column.dtype != object:
+            columns[key] = int(column.memory_usage(index=False, deep=True))
+            continue
+        values = column.to_numpy()
+        size = values.nbytes
+        for value in values:
+            if id(value) not in seen:
+                seen.add(id(value))
+                size += sys.getsizeof(value)
+        columns[key] = int(size)
+    index = int(tbl.index.memory_usage(deep=True))
+    return {"columns": columns, "index": index, "total": sum(columns.values()) + index}
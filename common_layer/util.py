@@ -1,3 +1,23 @@
+import os
+from urllib.parse import urlencode
+
+
 def un_none(obj, default):
     """Replace None with empty dict"""
     return obj if obj is not None else default
+
+
+def add_query_to_links(links, query):
+    """Append query params to every link, so that they survive pagination"""
+    if not query:
+        return links
+    encoded = urlencode(query)
+    return {
+        name: f"{link}{'&' if '?' in link else '?'}{encoded}"
+        for name, link in links.items()
+    }
+
+
+def env_flag(name):
+    """Returns True if the environment variable name is set to "true" """
+    return os.environ.get(name, "false").lower() == "true"
@@ -1,6 +1,26 @@
+import functools
 import traceback
 from http import HTTPStatus
 
+from capturelib import traffic_captured
+from memlib import memory_sampled
+from profilelib import profile_sampled
+from responsecachelib import request_coalesced, response_cached
+from responselib import (
+    JSONAPI_CONTENT_TYPE,
+    copy_response,
+    formatted_result,
+    is_head_request,
+    make_etag,
+    make_params_key,
+    make_prewarm_event,
+    make_render_key,
+    meta_result,
+    negotiate_content_type,
+    parse_meta_only,
+    process_params_once,
+)
+from routelib import compile_routes, find_invalid_path_parameter, memoize_links_and_meta
 from torguapi import (
     TorguapiInvalidRequest,
     torguapi_get_page_parameters,
@@ -8,11 +28,20 @@ from torguapi import (
     torguapi_make_links_and_meta,
     torguapi_result,
 )
-from util import un_none
+from util import env_flag, un_none
 
-from .counties_data import get_counties_table
+from .counties_data import get_counties_data_version, get_counties_snapshot
 from .counties_lib import CountiesNotFoundError, handle_get_counties, handle_get_county
 
+# Routes of the counties API, with the patterns their path parameters must match
+COUNTIES_ROUTES = compile_routes(
+    ["/nj/counties", "/nj/counties/{GEOID}"],
+    {"GEOID": r"\d{5}"},
+)
+
+# torguapi_make_links_and_meta, memoized by path and pagination
+make_links_and_meta = memoize_links_and_meta(torguapi_make_links_and_meta)
+
 
 def process_counties_params(event):
     """
@@ -32,9 +61,18 @@ def process_counties_params(event):
         params = torguapi_get_page_parameters(query_parameters)
     except TorguapiInvalidRequest as e:
         return HTTPStatus.BAD_REQUEST, str(e), {}
+    invalid = find_invalid_path_parameter(COUNTIES_ROUTES, event)
+    if invalid is not None:
+        name, value = invalid
+        return HTTPStatus.BAD_REQUEST, f"Invalid {name} {value}", params
     GEOID = path_parameters.get("GEOID", None)
     if GEOID is not None:
         params["GEOID"] = GEOID
+    meta_only = parse_meta_only(event, query_parameters)
+    if meta_only is None:
+        return HTTPStatus.BAD_REQUEST, "Invalid meta_only", params
+    if meta_only:
+        params["meta_only"] = True
     return HTTPStatus.OK, None, params
 
 
@@ -45,13 +83,31 @@ def make_counties_path(aux):
     return "nj/counties"
 
 
-def return_counties_table(result_set, aux):
-    """Assemble, path and meta, and pass to torguapi_result"""
+def return_counties_table(result_set, aux, content_type=JSONAPI_CONTENT_TYPE):
+    """Assemble, path and meta, and pass to torguapi_result or formatted_result"""
     path = make_counties_path(aux)
-    links, meta = torguapi_make_links_and_meta(aux, path)
+    links, meta = make_links_and_meta(aux, path)
+    if content_type != JSONAPI_CONTENT_TYPE:
+        return formatted_result(result_set, links, meta, content_type)
     return torguapi_result(result_set, links, meta)
 
 
+def return_counties_meta(aux, version, head):
+    """Assemble, path and meta, and return them without a result set"""
+    path = make_counties_path(aux)
+    links, meta = make_links_and_meta(aux, path)
+    return meta_result(links, meta, make_etag(version, links, meta), head)
+
+
+# Key of the response to an event, from its processed params
+make_counties_key = functools.partial(make_params_key, process_counties_params)
+
+
+@profile_sampled("counties_handler")
+@memory_sampled("counties_handler")
+@traffic_captured("counties_handler")
+@request_coalesced("counties_handler", make_counties_key)
+@response_cached("counties_handler", get_counties_data_version, make_counties_key)
 def counties_handler(event, context):
     """
     Handles counties API events
@@ -65,23 +121,35 @@ def counties_handler(event, context):
     Returns:
         A torguapi HTTP resultset response or error response
     """
+    status_code, status_message, params = process_params_once(
+        process_counties_params, event
+    )
+    if status_code != HTTPStatus.OK:
+        return torguapi_http_error(status_code, status_message)
+
     try:
-        counties = get_counties_table()
+        snapshot = get_counties_snapshot()
+        counties, indexes = snapshot["table"], snapshot["indexes"]
     except Exception:
         traceback.print_exc()
         return torguapi_http_error(
             HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error"
         )
 
-    status_code, status_message, params = process_counties_params(event)
-    if status_code != HTTPStatus.OK:
-        return torguapi_http_error(status_code, status_message)
+    rendered = indexes["rendered"].get(make_render_key(event), None)
+    if rendered is not None:
+        return copy_response(rendered)
+
     try:
         if "GEOID" not in params:
             result_set, aux = handle_get_counties(counties, params)
+            if params.get("meta_only", False):
+                return return_counties_meta(
+                    aux, indexes["version"], is_head_request(event)
+                )
         else:
             result_set, aux = handle_get_county(counties, params)
-        return return_counties_table(result_set, aux)
+        return return_counties_table(result_set, aux, negotiate_content_type(event))
 
     except CountiesNotFoundError as e:
         return torguapi_http_error(HTTPStatus.NOT_FOUND, str(e))
@@ -90,3 +158,27 @@ def counties_handler(event, context):
         return torguapi_http_error(
             HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error"
         )
+
+
+def prewarm_counties():
+    """
+    Loads the counties table and indexes, and prerenders popular responses
+
+    Prerendered responses are stored with the indexes, so they are dropped
+    when the table is refreshed.
+    """
+    indexes = get_counties_snapshot()["indexes"]
+    for event in [make_prewarm_event("/nj/counties")]:
+        response = counties_handler(event, None)
+        if response["statusCode"] == HTTPStatus.OK:
+            indexes["rendered"][make_render_key(event)] = response
+
+
+# With PREWARM set, do the loading during the Lambda init phase, which is off
+# the request path with provisioned concurrency.  On failure, fall back to
+# loading on the first request.
+if env_flag("PREWARM"):
+    try:
+        prewarm_counties()
+    except Exception:
+        traceback.print_exc()
@@ -1,24 +1,165 @@
 import os
 
 import boto3
-from ddblib import ddb_itemlist_to_pd
+from cachelib import TableCache
+from ddblib import ddb_get_version, ddb_itemlist_to_pd, ddb_scan_items
+from memlib import memory_sampled
+from responselib import table_version
+from shmlib import attach_table, publish_table, published_version
+from tablelib import compact_table, table_footprint
 
-# Cached result of build
-counties_table = None
+# Cache of the counties table and the indexes derived from it, which are
+# stored together under TABLE_KEY as {"table": ..., "indexes": ...,
+# "data_version": ...}, so that a refresh swaps them all at once
+counties_cache = TableCache()
+TABLE_KEY = "counties"
+
+# Compact column types of the counties table
+COUNTIES_DTYPES = {"row_number": "int32"}
+
+# String columns of the counties table whose values are interned
+COUNTIES_INTERNED_KEYS = ["GEOID", "county"]
 
 
 def get_counties_table():
     """Return cached result, or build from DynamoDB"""
-    global counties_table
-    if counties_table is None:
+    return get_counties_snapshot()["table"]
+
+
+def get_counties_snapshot():
+    """
+    Return the cached snapshot, building it from DynamoDB if required
+
+    The snapshot is a dict with the "table", the "indexes" built from it and
+    the "data_version".  Handlers read the table and the indexes from one
+    snapshot, so a refresh between two separate reads cannot pair a table
+    with the row positions of another version.
+    """
+    refresh_counties_table_if_stale()
+    return counties_cache.get(TABLE_KEY, load_counties_snapshot)
+
+
+async def get_counties_table_async(executor=None):
+    """Return cached result, or build from DynamoDB in executor"""
+    snapshot = await counties_cache.get_async(
+        TABLE_KEY, load_counties_snapshot, executor
+    )
+    return snapshot["table"]
+
+
+def get_counties_indexes():
+    """Return cached indexes, building the table and indexes if required"""
+    return counties_cache.get(TABLE_KEY, load_counties_snapshot)["indexes"]
+
+
+def refresh_counties_table():
+    """Rebuild the table and indexes from DynamoDB, and swap them in together"""
+    return counties_cache.refresh(TABLE_KEY, load_counties_snapshot)["table"]
+
+
+def refresh_counties_table_if_stale():
+    """
+    Rebuild the table and indexes if the version marker has changed
+
+    The marker in TABLE_VERSIONS, or the published version in
+    SHARED_TABLE_DIR, is checked at most once every VERSION_CHECK_SECONDS
+    seconds.  If neither is set, or the interval is 0, the cached table is
+    kept until the process is recycled.
+
+    Returns:
+        True if the table was rebuilt
+    """
+    interval = float(os.environ.get("VERSION_CHECK_SECONDS", 0))
+    if interval <= 0:
+        return False
+    if not (os.environ.get("TABLE_VERSIONS") or os.environ.get("SHARED_TABLE_DIR")):
+        return False
+    return counties_cache.refresh_if_stale(
+        TABLE_KEY, load_counties_snapshot, get_counties_version, interval
+    )
+
+
+def get_counties_version():
+    """Return the version marker of the counties table, or None if not tracked"""
+    shared_dir = os.environ.get("SHARED_TABLE_DIR")
+    if shared_dir:
+        return published_version(shared_dir, TABLE_KEY)
+    versions_table = os.environ.get("TABLE_VERSIONS")
+    if not versions_table:
+        return None
+    client = boto3.client("dynamodb")
+    return ddb_get_version(client, versions_table, os.environ.get("TABLE_COUNTIES"))
+
+
+def get_counties_data_version():
+    """
+    Return the version of the counties data being served, or None if not tracked
+
+    This is the version of the cached table, if there is one, and otherwise
+    the current version marker, so it is available without a scan.
+    """
+    snapshot = counties_cache.peek(TABLE_KEY)
+    if snapshot is not None:
+        return snapshot["data_version"]
+    return get_counties_version()
+
+
+def invalidate_counties_table():
+    """Drop the cached table and indexes, so the next request rebuilds them"""
+    counties_cache.invalidate(TABLE_KEY)
+
+
+def load_counties_snapshot():
+    """Build the table and its indexes from DynamoDB, or from SHARED_TABLE_DIR if set"""
+    shared_dir = os.environ.get("SHARED_TABLE_DIR")
+    if shared_dir:
+        data_version, tbl = attach_table(shared_dir, TABLE_KEY)
+    else:
         table_name = os.environ.get("TABLE_COUNTIES")
-        counties_table = build_counties_table(table_name)
-    return counties_table
+        total_segments = int(os.environ.get("SCAN_SEGMENTS", 1))
+        # Read the version before the scan, so that an update during the scan
+        # is picked up by the next check rather than missed
+        data_version = get_counties_version()
+        tbl = build_counties_table(table_name, total_segments)
+    return {
+        "table": tbl,
+        "indexes": build_counties_indexes(tbl),
+        "data_version": data_version,
+    }
+
+
+def publish_counties_table(directory):
+    """
+    Scan the counties table and publish it to directory, for attach_table
+
+    This is for hosts that run several worker processes: the parent process
+    publishes the table, and workers with SHARED_TABLE_DIR set to directory
+    map it read-only, and switch to a newly published version on the next
+    version check.
 
+    Returns:
+        name of the published version
+    """
+    table_name = os.environ.get("TABLE_COUNTIES")
+    total_segments = int(os.environ.get("SCAN_SEGMENTS", 1))
+    tbl = build_counties_table(table_name, total_segments)
+    return publish_table(tbl, directory, TABLE_KEY)
 
-def build_counties_table(table_name):
-    """Scan counties table and convert to dataframe"""
+
+@memory_sampled("build_counties_table")
+def build_counties_table(table_name, total_segments=1):
+    """Scan counties table, in total_segments concurrent segments, and convert to dataframe"""
     client = boto3.client("dynamodb")
-    data = client.scan(TableName=table_name)
-    counties = ddb_itemlist_to_pd(data["Items"], ["row_number"]).sort_values("GEOID")
-    return counties
+    items = ddb_scan_items(client, table_name, total_segments)
+    counties = ddb_itemlist_to_pd(items, ["row_number"]).sort_values("GEOID")
+    return compact_table(counties, COUNTIES_DTYPES, COUNTIES_INTERNED_KEYS)
+
+
+@memory_sampled("build_counties_indexes")
+def build_counties_indexes(counties):
+    """Build the indexes derived from the counties table"""
+    return {
+        "version": table_version(counties),
+        "footprint": table_footprint(counties),
+        "rendered": {},
+    }
@@ -18,14 +18,17 @@ def handle_get_counties(counties, params):
     return the appropropriate slice of the counties table. It will
     return only two columns:  GEOID and county.
 
+    If the "meta_only" param is set, no result set is built and None is
+    returned in its place.
+
     If the results are emtpy, this function will throw a CountiesNotFound exception.
 
     Args:
         counties: counties table
-        params: dict of params, possibly including pagination params
+        params: dict of params, possibly including pagination and meta_only params
 
     Returns:
-        subset of counties table
+        subset of counties table, or None
         dict of pagination-related params suitable for passing to torguapi_result
     """
 
@@ -42,10 +45,11 @@ def handle_get_counties(counties, params):
     if page_number < 1 or page_number > page_count:
         status_msg = f"Page number {page_number} not found"
         raise CountiesNotFoundError(status_msg)
+    if params.get("meta_only", False):
+        return None, aux
 
     offset = (page_number - 1) * page_size
-    page = counties[offset : offset + page_size].copy()
-    result_set = page[["GEOID", "county"]]
+    result_set = counties.iloc[offset : offset + page_size][["GEOID", "county"]]
     return result_set, aux
 
 
@@ -68,7 +72,7 @@ def handle_get_county(counties, params):
         dict containing GEOID param
     """
     GEOID = params["GEOID"]
-    results = counties[counties["GEOID"] == GEOID][["GEOID", "county"]]
+    results = counties.loc[counties["GEOID"] == GEOID, ["GEOID", "county"]]
     if results.empty:
         raise CountiesNotFoundError(f"County GEOID {GEOID} not found")
     return results, {"GEOID": GEOID}
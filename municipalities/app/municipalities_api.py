@@ -1,6 +1,26 @@
+import functools
 import traceback
 from http import HTTPStatus
 
+from capturelib import traffic_captured
+from memlib import memory_sampled
+from profilelib import profile_sampled
+from responsecachelib import request_coalesced, response_cached
+from responselib import (
+    JSONAPI_CONTENT_TYPE,
+    copy_response,
+    formatted_result,
+    is_head_request,
+    make_etag,
+    make_params_key,
+    make_prewarm_event,
+    make_render_key,
+    meta_result,
+    negotiate_content_type,
+    parse_meta_only,
+    process_params_once,
+)
+from routelib import compile_routes, find_invalid_path_parameter, memoize_links_and_meta
 from torguapi import (
     TorguapiInvalidRequest,
     torguapi_get_page_parameters,
@@ -8,17 +28,75 @@ from torguapi import (
     torguapi_make_links_and_meta,
     torguapi_result,
 )
-from util import un_none
+from util import add_query_to_links, env_flag, un_none
 
-from .municipalities_data import get_municipalities_table
+from .municipalities_data import (
+    get_municipalities_data_version,
+    get_municipalities_snapshot,
+)
 from .municipalities_lib import (
     DEFAULT_YEAR,
+    FILTER_KEYS,
+    SORT_KEYS,
     MunicipalitiesNotFoundError,
+    build_changes_table,
+    handle_get_changes,
+    handle_get_history,
     handle_get_municipalities,
+    handle_get_municipalities_range,
     handle_get_municipality,
+    handle_get_xref_panel,
     handle_get_xrefs,
 )
 
+# Routes of the municipalities API, with the patterns their path parameters must
+# match
+MUNICIPALITIES_ROUTES = compile_routes(
+    [
+        "/nj/municipalities",
+        "/nj/municipalities/{year}",
+        "/nj/municipalities/{year}/{GEOID}",
+        "/nj/municipalities/history/{GEOID}",
+        "/nj/municipality_xrefs/{year_ref}/{year}",
+        "/nj/municipality_xref_panel/{years}",
+        "/nj/municipality_changes/{year_ref}/{year}",
+    ],
+    {
+        "year": r"\d{4}",
+        "year_ref": r"\d{4}",
+        "years": r"\d{4}(-\d{4})?(,\d{4}(-\d{4})?)*",
+        "GEOID": r"\d{10}",
+    },
+)
+
+# Query params of the other municipalities routes that do not apply to history,
+# which is not paginated, filtered or sorted.  Filter params are matched by
+# HISTORY_UNSUPPORTED_PREFIX.
+HISTORY_UNSUPPORTED_PARAMETERS = (
+    "page_size",
+    "page_number",
+    "from",
+    "to",
+    "sort",
+    "meta_only",
+)
+HISTORY_UNSUPPORTED_PREFIX = "filter["
+
+# Names of path parameters in error messages
+PATH_PARAMETER_NAMES = {"year_ref": "reference year"}
+
+# torguapi_make_links_and_meta, memoized by path and pagination
+make_links_and_meta = memoize_links_and_meta(torguapi_make_links_and_meta)
+
+
+def find_invalid_municipalities_path_parameter(event):
+    """Returns an error message for an invalid path parameter, or None"""
+    invalid = find_invalid_path_parameter(MUNICIPALITIES_ROUTES, event)
+    if invalid is None:
+        return None
+    name, value = invalid
+    return f"Invalid {PATH_PARAMETER_NAMES.get(name, name)} {value}"
+
 
 def process_municipality_params(event):
     """
@@ -39,18 +117,130 @@ def process_municipality_params(event):
         params = torguapi_get_page_parameters(query_parameters)
     except TorguapiInvalidRequest as e:
         return HTTPStatus.BAD_REQUEST, str(e), {}
+    status_message = find_invalid_municipalities_path_parameter(event)
+    if status_message is not None:
+        return HTTPStatus.BAD_REQUEST, status_message, params
     year = path_parameters.get("year", None)
     GEOID = path_parameters.get("GEOID", None)
     if year is not None:
-        if not year.isnumeric():
-            return HTTPStatus.BAD_REQUEST, "Invalid year " + year, params
+        params["year"] = int(year)
+    if GEOID is not None:
+        params["GEOID"] = GEOID
+    if "from" in query_parameters or "to" in query_parameters:
+        year_range = parse_year_range(
+            query_parameters.get("from", ""), query_parameters.get("to", "")
+        )
+        if year_range is None or year is not None:
+            return HTTPStatus.BAD_REQUEST, "Invalid year range", params
+        params["from"], params["to"] = year_range
+    filters = {
+        key: query_parameters[f"filter[{key}]"]
+        for key in FILTER_KEYS
+        if f"filter[{key}]" in query_parameters
+    }
+    if filters:
+        params["filter"] = filters
+    sort = query_parameters.get("sort", None)
+    if sort is not None:
+        if sort.removeprefix("-") not in SORT_KEYS:
+            return HTTPStatus.BAD_REQUEST, "Invalid sort " + sort, params
         else:
-            params["year"] = int(year)
+            params["sort"] = sort
+    meta_only = parse_meta_only(event, query_parameters)
+    if meta_only is None:
+        return HTTPStatus.BAD_REQUEST, "Invalid meta_only", params
+    if meta_only:
+        params["meta_only"] = True
+    return HTTPStatus.OK, None, params
+
+
+def process_history_params(event):
+    """
+    Gets path and query params from API Gateway history event and does
+    initial processing
+
+    The history of a GEOID is returned whole, so the pagination, year range,
+    filter, sort and meta_only params of the other routes are rejected rather
+    than ignored.
+
+    Args:
+        event: Municipality history API Gateway event
+
+    Returns:
+        HTTPStatus
+        Error message (or None, if HTTPStatus.OK)
+        dict of processed parameters
+    """
+    path_parameters = un_none(event["pathParameters"], {})
+    query_parameters = un_none(event["queryStringParameters"], {})
+    status_message = find_invalid_municipalities_path_parameter(event)
+    if status_message is not None:
+        return HTTPStatus.BAD_REQUEST, status_message, {}
+    for key in sorted(query_parameters):
+        if key in HISTORY_UNSUPPORTED_PARAMETERS or key.startswith(
+            HISTORY_UNSUPPORTED_PREFIX
+        ):
+            return HTTPStatus.BAD_REQUEST, "Unsupported query parameter " + key, {}
+    params = {}
+    GEOID = path_parameters.get("GEOID", None)
     if GEOID is not None:
         params["GEOID"] = GEOID
     return HTTPStatus.OK, None, params
 
 
+def parse_years(years):
+    """
+    Parses a years path parameter into a sorted list of years
+
+    The parameter is a comma-separated list of four-digit years and year
+    ranges, such as "2000-2025" or "2000,2010,2020-2025".
+
+    Args:
+        years: years path parameter
+
+    Returns:
+        sorted list of distinct years, or None if the parameter is invalid
+    """
+    parsed = set()
+    for item in years.split(","):
+        start, separator, end = item.partition("-")
+        if not separator:
+            end = start
+        if not all(len(year) == 4 and year.isnumeric() for year in (start, end)):
+            return None
+        start, end = int(start), int(end)
+        if end < start:
+            return None
+        parsed.update(range(start, end + 1))
+    return sorted(parsed)
+
+
+def parse_year_range(year_from, year_to):
+    """
+    Parses the from and to query params of a year range
+
+    Args:
+        year_from: from query parameter, the first year of the range
+        year_to: to query parameter, the last year of the range
+
+    Returns:
+        tuple of first and last year, or None if the range is invalid
+    """
+    if not all(len(year) == 4 and year.isnumeric() for year in (year_from, year_to)):
+        return None
+    year_from, year_to = int(year_from), int(year_to)
+    if year_to < year_from:
+        return None
+    return year_from, year_to
+
+
+def format_years(years):
+    """Formats a sorted list of years as a years path parameter"""
+    if years == list(range(years[0], years[-1] + 1)) and len(years) > 1:
+        return f"{years[0]}-{years[-1]}"
+    return ",".join(str(year) for year in years)
+
+
 def process_xref_params(event):
     """
     Gets path and query params from API Gateway XREFs event and does initial processing
@@ -69,24 +259,35 @@ def process_xref_params(event):
         params = torguapi_get_page_parameters(query_parameters)
     except TorguapiInvalidRequest as e:
         return HTTPStatus.BAD_REQUEST, str(e), {}
+    status_message = find_invalid_municipalities_path_parameter(event)
+    if status_message is not None:
+        return HTTPStatus.BAD_REQUEST, status_message, params
 
     year = path_parameters.get("year", None)
     year_ref = path_parameters.get("year_ref", None)
-    if year is not None:
-        if not year.isnumeric():
-            return HTTPStatus.BAD_REQUEST, "Invalid year " + year, params
+    years = path_parameters.get("years", None)
+    if years is not None:
+        parsed_years = parse_years(years)
+        if parsed_years is None:
+            return HTTPStatus.BAD_REQUEST, "Invalid years " + years, params
         else:
-            params["year"] = int(year)
+            params["years"] = parsed_years
+    if year is not None:
+        params["year"] = int(year)
     if year_ref is not None:
-        if not year_ref.isnumeric():
-            return HTTPStatus.BAD_REQUEST, "Invalid reference year " + year_ref, params
-        else:
-            params["year_ref"] = int(year_ref)
+        params["year_ref"] = int(year_ref)
+    meta_only = parse_meta_only(event, query_parameters)
+    if meta_only is None:
+        return HTTPStatus.BAD_REQUEST, "Invalid meta_only", params
+    if meta_only:
+        params["meta_only"] = True
     return HTTPStatus.OK, None, params
 
 
 def make_municipalities_path(aux):
     """Returns path to be passed to torguapi_result"""
+    if "from" in aux:
+        return "nj/municipalities"
     year = aux.get("year", DEFAULT_YEAR)
     path = f"nj/municipalities/{year}"
     if "GEOID" in aux:
@@ -94,27 +295,117 @@ def make_municipalities_path(aux):
     return path
 
 
+def make_municipalities_query(aux):
+    """Returns year range, filter and sort query params to be added to the links"""
+    query = {key: aux[key] for key in ("from", "to") if key in aux}
+    query.update(
+        {f"filter[{key}]": value for key, value in aux.get("filter", {}).items()}
+    )
+    if "sort" in aux:
+        query["sort"] = aux["sort"]
+    return query
+
+
 def make_xref_path(aux):
     """Returns path to be passed to torguapi_result"""
+    if "years" in aux:
+        return f"nj/municipality_xref_panel/{format_years(aux['years'])}"
     year = aux["year"]
     year_ref = aux["year_ref"]
     return f"nj/municipality_xrefs/{year_ref}/{year}"
 
 
-def return_municipalities_table(result_set, aux):
-    """Assemble, path and meta, and pass to torguapi_result"""
+def make_changes_path(aux):
+    """Returns path to be passed to torguapi_result"""
+    year = aux["year"]
+    year_ref = aux["year_ref"]
+    return f"nj/municipality_changes/{year_ref}/{year}"
+
+
+def make_history_path(aux):
+    """Returns path to be passed to torguapi_result"""
+    return f"nj/municipalities/history/{aux['GEOID']}"
+
+
+def return_municipalities_table(result_set, aux, content_type=JSONAPI_CONTENT_TYPE):
+    """Assemble, path and meta, and pass to torguapi_result or formatted_result"""
     path = make_municipalities_path(aux)
-    links, meta = torguapi_make_links_and_meta(aux, path)
+    links, meta = make_links_and_meta(aux, path)
+    links = add_query_to_links(links, make_municipalities_query(aux))
+    if content_type != JSONAPI_CONTENT_TYPE:
+        return formatted_result(result_set, links, meta, content_type)
     return torguapi_result(result_set, links, meta)
 
 
-def return_xref_table(result_set, aux):
-    """Assemble, path and meta, and pass to torguapi_result"""
+def return_xref_table(result_set, aux, content_type=JSONAPI_CONTENT_TYPE):
+    """Assemble, path and meta, and pass to torguapi_result or formatted_result"""
     path = make_xref_path(aux)
-    links, meta = torguapi_make_links_and_meta(aux, path)
+    links, meta = make_links_and_meta(aux, path)
+    if content_type != JSONAPI_CONTENT_TYPE:
+        return formatted_result(result_set, links, meta, content_type)
+    return torguapi_result(result_set, links, meta)
+
+
+def return_changes_table(result_set, aux, content_type=JSONAPI_CONTENT_TYPE):
+    """Assemble, path and meta, and pass to torguapi_result or formatted_result"""
+    path = make_changes_path(aux)
+    links, meta = make_links_and_meta(aux, path)
+    if content_type != JSONAPI_CONTENT_TYPE:
+        return formatted_result(result_set, links, meta, content_type)
+    return torguapi_result(result_set, links, meta)
+
+
+def return_history_table(result_set, aux, content_type=JSONAPI_CONTENT_TYPE):
+    """Assemble, path and meta, and pass to torguapi_result or formatted_result"""
+    path = make_history_path(aux)
+    links, meta = make_links_and_meta(aux, path)
+    if content_type != JSONAPI_CONTENT_TYPE:
+        return formatted_result(result_set, links, meta, content_type)
     return torguapi_result(result_set, links, meta)
 
 
+def return_municipalities_meta(aux, version, head):
+    """Assemble, path and meta, and return them without a result set"""
+    path = make_municipalities_path(aux)
+    links, meta = make_links_and_meta(aux, path)
+    links = add_query_to_links(links, make_municipalities_query(aux))
+    return meta_result(links, meta, make_etag(version, links, meta), head)
+
+
+def return_xref_meta(aux, version, head):
+    """Assemble, path and meta, and return them without a result set"""
+    path = make_xref_path(aux)
+    links, meta = make_links_and_meta(aux, path)
+    return meta_result(links, meta, make_etag(version, links, meta), head)
+
+
+def return_history_meta(aux, version, head):
+    """Assemble, path and meta, and return them without a result set"""
+    path = make_history_path(aux)
+    links, meta = make_links_and_meta(aux, path)
+    return meta_result(links, meta, make_etag(version, links, meta), head)
+
+
+def return_changes_meta(aux, version, head):
+    """Assemble, path and meta, and return them without a result set"""
+    path = make_changes_path(aux)
+    links, meta = make_links_and_meta(aux, path)
+    return meta_result(links, meta, make_etag(version, links, meta), head)
+
+
+# Key of the response to an event, from its processed params
+make_municipalities_key = functools.partial(
+    make_params_key, process_municipality_params
+)
+
+
+@profile_sampled("municipalities_handler")
+@memory_sampled("municipalities_handler")
+@traffic_captured("municipalities_handler")
+@request_coalesced("municipalities_handler", make_municipalities_key)
+@response_cached(
+    "municipalities_handler", get_municipalities_data_version, make_municipalities_key
+)
 def municipalities_handler(event, context):
     """
     Handles municipalities API events
@@ -128,24 +419,57 @@ def municipalities_handler(event, context):
     Returns:
         A torguapi HTTP resultset response or error response
     """
+    status_code, status_message, params = process_params_once(
+        process_municipality_params, event
+    )
+    if status_code != HTTPStatus.OK:
+        return torguapi_http_error(status_code, status_message)
+
     try:
-        municipalities = get_municipalities_table()
+        snapshot = get_municipalities_snapshot()
+        municipalities, indexes = snapshot["table"], snapshot["indexes"]
     except Exception:
         traceback.print_exc()
         return torguapi_http_error(
             HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error"
         )
 
-    status_code, status_message, params = process_municipality_params(event)
-    if status_code != HTTPStatus.OK:
-        return torguapi_http_error(status_code, status_message)
+    rendered = indexes["rendered"].get(make_render_key(event), None)
+    if rendered is not None:
+        return copy_response(rendered)
 
     try:
-        if "GEOID" not in params:
-            result_set, aux = handle_get_municipalities(municipalities, params)
+        if "from" in params:
+            result_set, aux = handle_get_municipalities_range(
+                municipalities,
+                params,
+                indexes["interval"],
+                indexes["county"],
+                indexes["sort"],
+            )
+            if params.get("meta_only", False):
+                return return_municipalities_meta(
+                    aux, indexes["version"], is_head_request(event)
+                )
+        elif "GEOID" not in params:
+            result_set, aux = handle_get_municipalities(
+                municipalities,
+                params,
+                indexes["county"],
+                indexes["sort"],
+                indexes["year_counts"],
+            )
+            if params.get("meta_only", False):
+                return return_municipalities_meta(
+                    aux, indexes["version"], is_head_request(event)
+                )
         else:
-            result_set, aux = handle_get_municipality(municipalities, params)
-        return return_municipalities_table(result_set, aux)
+            result_set, aux = handle_get_municipality(
+                municipalities, params, indexes["GEOID"]
+            )
+        return return_municipalities_table(
+            result_set, aux, negotiate_content_type(event)
+        )
     except MunicipalitiesNotFoundError as e:
         return torguapi_http_error(HTTPStatus.NOT_FOUND, str(e))
     except Exception:
@@ -155,6 +479,15 @@ def municipalities_handler(event, context):
         )
 
 
+# Key of the response to an event, from its processed params
+make_xref_key = functools.partial(make_params_key, process_xref_params)
+
+
+@profile_sampled("xref_handler")
+@memory_sampled("xref_handler")
+@traffic_captured("xref_handler")
+@request_coalesced("xref_handler", make_xref_key)
+@response_cached("xref_handler", get_municipalities_data_version, make_xref_key)
 def xref_handler(event, context):
     """
     Handles municipality XREFs API events
@@ -168,20 +501,136 @@ def xref_handler(event, context):
     Returns:
         A torguapi HTTP resultset response or error response
     """
+    status_code, status_message, params = process_params_once(
+        process_xref_params, event
+    )
+    if status_code != HTTPStatus.OK:
+        return torguapi_http_error(status_code, status_message)
+
     try:
-        municipalities = get_municipalities_table()
+        snapshot = get_municipalities_snapshot()
+        municipalities, indexes = snapshot["table"], snapshot["indexes"]
     except Exception:
         traceback.print_exc()
         return torguapi_http_error(
             HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error"
         )
 
-    status_code, status_message, params = process_xref_params(event)
+    try:
+        if "years" not in params:
+            result_set, aux = handle_get_xrefs(
+                municipalities,
+                params,
+                indexes["year_counts"],
+                indexes["integrity"],
+            )
+        else:
+            result_set, aux = handle_get_xref_panel(
+                municipalities,
+                params,
+                indexes["xref_panel"],
+                indexes["xref_panels"],
+            )
+        if params.get("meta_only", False):
+            return return_xref_meta(aux, indexes["version"], is_head_request(event))
+        return return_xref_table(result_set, aux, negotiate_content_type(event))
+    except MunicipalitiesNotFoundError as e:
+        return torguapi_http_error(HTTPStatus.NOT_FOUND, str(e))
+    except Exception:
+        traceback.print_exc()
+        return torguapi_http_error(
+            HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error"
+        )
+
+
+# Key of the response to an event, from its processed params
+make_history_key = functools.partial(make_params_key, process_history_params)
+
+
+@profile_sampled("history_handler")
+@memory_sampled("history_handler")
+@request_coalesced("history_handler", make_history_key)
+@response_cached("history_handler", get_municipalities_data_version, make_history_key)
+def history_handler(event, context):
+    """
+    Handles municipality history API events
+
+    Always returns a torguapi HTTP result
+
+    Args:
+        event: API Gateway event
+        context: API Gateway context
+
+    Returns:
+        A torguapi HTTP resultset response or error response
+    """
+    status_code, status_message, params = process_params_once(
+        process_history_params, event
+    )
     if status_code != HTTPStatus.OK:
         return torguapi_http_error(status_code, status_message)
+
     try:
-        result_set, aux = handle_get_xrefs(municipalities, params)
-        return return_xref_table(result_set, aux)
+        snapshot = get_municipalities_snapshot()
+        municipalities, indexes = snapshot["table"], snapshot["indexes"]
+    except Exception:
+        traceback.print_exc()
+        return torguapi_http_error(
+            HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error"
+        )
+
+    try:
+        result_set, aux = handle_get_history(municipalities, params, indexes["lineage"])
+        if is_head_request(event):
+            aux = dict(aux, record_count=len(result_set))
+            return return_history_meta(aux, indexes["version"], True)
+        return return_history_table(result_set, aux, negotiate_content_type(event))
+    except MunicipalitiesNotFoundError as e:
+        return torguapi_http_error(HTTPStatus.NOT_FOUND, str(e))
+    except Exception:
+        traceback.print_exc()
+        return torguapi_http_error(
+            HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error"
+        )
+
+
+@profile_sampled("changes_handler")
+@memory_sampled("changes_handler")
+@request_coalesced("changes_handler", make_xref_key)
+@response_cached("changes_handler", get_municipalities_data_version, make_xref_key)
+def changes_handler(event, context):
+    """
+    Handles municipality changes API events
+
+    Always returns a torguapi HTTP result
+
+    Args:
+        event: API Gateway event
+        context: API Gateway context
+
+    Returns:
+        A torguapi HTTP resultset response or error response
+    """
+    status_code, status_message, params = process_params_once(
+        process_xref_params, event
+    )
+    if status_code != HTTPStatus.OK:
+        return torguapi_http_error(status_code, status_message)
+
+    try:
+        snapshot = get_municipalities_snapshot()
+        municipalities, indexes = snapshot["table"], snapshot["indexes"]
+    except Exception:
+        traceback.print_exc()
+        return torguapi_http_error(
+            HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error"
+        )
+
+    try:
+        result_set, aux = handle_get_changes(municipalities, params, indexes["changes"])
+        if params.get("meta_only", False):
+            return return_changes_meta(aux, indexes["version"], is_head_request(event))
+        return return_changes_table(result_set, aux, negotiate_content_type(event))
     except MunicipalitiesNotFoundError as e:
         return torguapi_http_error(HTTPStatus.NOT_FOUND, str(e))
     except Exception:
@@ -189,3 +638,40 @@ def xref_handler(event, context):
         return torguapi_http_error(
             HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error"
         )
+
+
+def prewarm_municipalities():
+    """
+    Loads the municipalities table and indexes, fills the changes cache for
+    consecutive years, and prerenders popular responses
+
+    Prerendered responses are stored with the indexes, so they are dropped
+    when the table is refreshed.
+    """
+    snapshot = get_municipalities_snapshot()
+    municipalities, indexes = snapshot["table"], snapshot["indexes"]
+    for year in indexes["year_counts"]:
+        if year - 1 in indexes["year_counts"]:
+            indexes["changes"][(year - 1, year)] = build_changes_table(
+                municipalities, year - 1, year
+            )
+    events = [
+        make_prewarm_event("/nj/municipalities"),
+        make_prewarm_event(
+            f"/nj/municipalities/{DEFAULT_YEAR}", {"year": str(DEFAULT_YEAR)}
+        ),
+    ]
+    for event in events:
+        response = municipalities_handler(event, None)
+        if response["statusCode"] == HTTPStatus.OK:
+            indexes["rendered"][make_render_key(event)] = response
+
+
+# With PREWARM set, do the loading during the Lambda init phase, which is off
+# the request path with provisioned concurrency.  On failure, fall back to
+# loading on the first request.
+if env_flag("PREWARM"):
+    try:
+        prewarm_municipalities()
+    except Exception:
+        traceback.print_exc()
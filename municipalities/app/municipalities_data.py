@@ -1,29 +1,421 @@
+import json
 import os
 
 import boto3
-from ddblib import ddb_itemlist_to_pd
+import pandas as pd
+from cachelib import LRUCache, TableCache
+from ddblib import (
+    ddb_get_version,
+    ddb_itemlist_to_pd,
+    ddb_scan_items,
+    ddb_stream_records_to_changes,
+)
+from memlib import memory_sampled
+from responselib import table_version
+from shmlib import attach_table, publish_table, published_version
+from tablelib import compact_table, table_footprint
 
-# Cached result of build
-municipalities_table = None
+from .municipalities_lib import (
+    build_county_index,
+    build_GEOID_index,
+    build_interval_index,
+    build_lineage_index,
+    build_sort_index,
+    build_xref_panel,
+    build_year_counts,
+    check_municipalities_integrity,
+    update_xref_panel,
+    update_year_counts,
+)
+
+# Cache of the municipalities table and the indexes derived from it, which are
+# stored together under TABLE_KEY as {"table": ..., "indexes": ...,
+# "data_version": ...}, so that a refresh swaps them all at once
+municipalities_cache = TableCache()
+TABLE_KEY = "municipalities"
+
+# Maximum number of XREF panels memoized per table version.  Panels are keyed
+# by the set of years in the request, so the number of keys is unbounded.
+XREF_PANEL_CACHE_ENTRIES = 64
+
+# Compact column types of the municipalities table
+MUNICIPALITIES_DTYPES = {
+    "row_number": "int32",
+    "first_year": "int16",
+    "final_year": "int16",
+    "county": "category",
+}
+
+# String columns of the municipalities table whose values are interned
+MUNICIPALITIES_INTERNED_KEYS = ["GEOID", "GEOID_Y2K", "municipality"]
 
 
 def get_municipalities_table():
     """Return cached result, or build from DynamoDB"""
-    global municipalities_table
-    if municipalities_table is None:
+    return get_municipalities_snapshot()["table"]
+
+
+def get_municipalities_snapshot():
+    """
+    Return the cached snapshot, building it from DynamoDB if required
+
+    The snapshot is a dict with the "table", the "indexes" built from it and
+    the "data_version".  Handlers read the table and the indexes from one
+    snapshot, so a refresh between two separate reads cannot pair a table
+    with the row positions of another version.
+    """
+    refresh_municipalities_table_if_stale()
+    return municipalities_cache.get(TABLE_KEY, load_municipalities_snapshot)
+
+
+async def get_municipalities_table_async(executor=None):
+    """Return cached result, or build from DynamoDB in executor"""
+    snapshot = await municipalities_cache.get_async(
+        TABLE_KEY, load_municipalities_snapshot, executor
+    )
+    return snapshot["table"]
+
+
+def get_municipalities_indexes():
+    """Return cached indexes, building the table and indexes if required"""
+    return municipalities_cache.get(TABLE_KEY, load_municipalities_snapshot)["indexes"]
+
+
+def refresh_municipalities_table():
+    """Rebuild the table and indexes from DynamoDB, and swap them in together"""
+    return municipalities_cache.refresh(TABLE_KEY, load_municipalities_snapshot)[
+        "table"
+    ]
+
+
+def refresh_municipalities_table_if_stale():
+    """
+    Rebuild the table and indexes if the version marker has changed
+
+    The marker in TABLE_VERSIONS, or the published version in
+    SHARED_TABLE_DIR, is checked at most once every VERSION_CHECK_SECONDS
+    seconds.  If neither is set, or the interval is 0, the cached table is
+    kept until the process is recycled.
+
+    Returns:
+        True if the table was rebuilt
+    """
+    interval = float(os.environ.get("VERSION_CHECK_SECONDS", 0))
+    if interval <= 0:
+        return False
+    if not (os.environ.get("TABLE_VERSIONS") or os.environ.get("SHARED_TABLE_DIR")):
+        return False
+    return municipalities_cache.refresh_if_stale(
+        TABLE_KEY, load_municipalities_snapshot, get_municipalities_version, interval
+    )
+
+
+def get_municipalities_version():
+    """Return the version marker of the municipalities table, or None if not tracked"""
+    shared_dir = os.environ.get("SHARED_TABLE_DIR")
+    if shared_dir:
+        return published_version(shared_dir, TABLE_KEY)
+    versions_table = os.environ.get("TABLE_VERSIONS")
+    if not versions_table:
+        return None
+    client = boto3.client("dynamodb")
+    return ddb_get_version(
+        client, versions_table, os.environ.get("TABLE_MUNICIPALITIES")
+    )
+
+
+def get_municipalities_data_version():
+    """
+    Return the version of the municipalities data being served, or None if not tracked
+
+    This is the version of the cached table, if there is one, and otherwise
+    the current version marker, so it is available without a scan.
+    """
+    snapshot = municipalities_cache.peek(TABLE_KEY)
+    if snapshot is not None:
+        return snapshot["data_version"]
+    return get_municipalities_version()
+
+
+def invalidate_municipalities_table():
+    """Drop the cached table and indexes, so the next request rebuilds them"""
+    municipalities_cache.invalidate(TABLE_KEY)
+
+
+def load_municipalities_snapshot():
+    """Build the table and its indexes from DynamoDB, or from SHARED_TABLE_DIR if set"""
+    shared_dir = os.environ.get("SHARED_TABLE_DIR")
+    if shared_dir:
+        data_version, tbl = attach_table(shared_dir, TABLE_KEY)
+    else:
         table_name = os.environ.get("TABLE_MUNICIPALITIES")
-        municipalities_table = build_municipalities_table(table_name)
-    return municipalities_table
+        total_segments = int(os.environ.get("SCAN_SEGMENTS", 1))
+        # Read the version before the scan, so that an update during the scan
+        # is picked up by the next check rather than missed
+        data_version = get_municipalities_version()
+        tbl = build_municipalities_table(table_name, total_segments)
+    return {
+        "table": tbl,
+        "indexes": build_municipalities_indexes(tbl),
+        "data_version": data_version,
+    }
+
+
+def publish_municipalities_table(directory):
+    """
+    Scan the municipalities table and publish it to directory, for attach_table
+
+    This is for hosts that run several worker processes: the parent process
+    publishes the table, and workers with SHARED_TABLE_DIR set to directory
+    map it read-only, and switch to a newly published version on the next
+    version check.
+
+    Returns:
+        name of the published version
+    """
+    table_name = os.environ.get("TABLE_MUNICIPALITIES")
+    total_segments = int(os.environ.get("SCAN_SEGMENTS", 1))
+    tbl = build_municipalities_table(table_name, total_segments)
+    return publish_table(tbl, directory, TABLE_KEY)
 
 
-def build_municipalities_table(table_name):
-    """Scan municipalities table and convert to dataframe"""
+def publish_municipalities_changes(directory, records):
+    """
+    Apply change records to the municipalities table and publish it to directory
+
+    This is the change feed of hosts that run several worker processes: the
+    parent process patches its table with apply_municipalities_changes,
+    rather than scanning DynamoDB, and publishes the patched table for the
+    workers, as in publish_municipalities_table.  Each worker then attaches
+    the new version and builds its indexes, as on any version change.  The
+    table is loaded first if nothing is cached, from SHARED_TABLE_DIR if
+    set, so the records should be the changes made since the version it
+    loads.  The published version becomes the data_version of the patched
+    snapshot, as it is for the workers.
+
+    Args:
+        directory: directory for published tables
+        records: list of change records, as for apply_municipalities_changes
+
+    Returns:
+        number of changed rows
+        name of the published version
+    """
+    get_municipalities_snapshot()
+    count = apply_municipalities_changes(records)
+    snapshot = municipalities_cache.peek(TABLE_KEY)
+    version = publish_table(snapshot["table"], directory, TABLE_KEY)
+    municipalities_cache.refresh(
+        TABLE_KEY, lambda: dict(snapshot, data_version=version)
+    )
+    return count, version
+
+
+@memory_sampled("build_municipalities_table")
+def build_municipalities_table(table_name, total_segments=1):
+    """Scan municipalities table, in total_segments concurrent segments, and convert to dataframe"""
     client = boto3.client("dynamodb")
-    data = client.scan(TableName=table_name)
+    items = ddb_scan_items(client, table_name, total_segments)
+    return municipalities_items_to_pd(items)
+
+
+def municipalities_items_to_pd(items):
+    """Convert municipalities 'Item' list to a compact dataframe, sorted by GEOID_Y2K and row_number"""
     municipalities = (
-        ddb_itemlist_to_pd(data["Items"], ["row_number"])
+        ddb_itemlist_to_pd(items, ["row_number"])
         .assign(first_year=lambda df: df["first_year"].map(lambda year: int(year)))
         .assign(final_year=lambda df: df["final_year"].map(lambda year: int(year)))
-        .sort_values("GEOID_Y2K")
+        .sort_values(["GEOID_Y2K", "row_number"])
+    )
+    return compact_table(
+        municipalities, MUNICIPALITIES_DTYPES, MUNICIPALITIES_INTERNED_KEYS
     )
-    return municipalities
+
+
+def apply_municipalities_changes(records, data_version=None):
+    """
+    Apply change records to the cached table and indexes, without a DynamoDB scan
+
+    The records are in DynamoDB Streams format, as from a stream or a replay
+    file read with ddb_read_stream_records, keyed by row_number.  The updated
+    table and indexes are built from the cached ones, as described in
+    update_municipalities_indexes, and swapped in together, as in
+    refresh_municipalities_table.  If nothing is cached, the records are
+    ignored, since the next load scans the current table.
+
+    The patched snapshot gets a new data_version, so responses cached under
+    the old one miss.  Pass the version marker of the changed data, such as
+    the one bumped by tools/bulk_load.py, so that the next version check
+    does not rescan the table; by default, the table_version of the patched
+    table is used.
+
+    Args:
+        records: list of change records
+        data_version: Optional version of the data after the change
+
+    Returns:
+        number of changed rows, or None if nothing is cached
+    """
+    changes = ddb_stream_records_to_changes(records)
+    if municipalities_cache.peek(TABLE_KEY) is None:
+        return None
+
+    def builder():
+        snapshot = municipalities_cache.peek(TABLE_KEY)
+        if snapshot is None:
+            return load_municipalities_snapshot()
+        return update_municipalities_snapshot(snapshot, changes, data_version)
+
+    municipalities_cache.refresh(TABLE_KEY, builder)
+    return len(changes)
+
+
+@memory_sampled("update_municipalities_snapshot")
+def update_municipalities_snapshot(snapshot, changes, data_version=None):
+    """
+    Build the table and indexes of a snapshot updated with changes
+
+    Args:
+        snapshot: dict with "table", "indexes" and "data_version"
+        changes: dict mapping row_number to new 'Item', or to None for removed
+            rows, from ddb_stream_records_to_changes
+        data_version: Optional version of the data after the change, or None
+            for the table_version of the updated table
+
+    Returns:
+        updated snapshot
+    """
+    old_tbl = snapshot["table"]
+    changed = old_tbl["row_number"].isin(list(changes))
+    removed = old_tbl[changed]
+    items = [item for item in changes.values() if item is not None]
+    added = municipalities_items_to_pd(items) if items else old_tbl.iloc[:0]
+    tbl = compact_table(
+        pd.concat([old_tbl[~changed], added], ignore_index=True).sort_values(
+            ["GEOID_Y2K", "row_number"]
+        ),
+        MUNICIPALITIES_DTYPES,
+        MUNICIPALITIES_INTERNED_KEYS,
+    )
+    indexes = update_municipalities_indexes(snapshot["indexes"], tbl, removed, added)
+    return {
+        "table": tbl,
+        "indexes": indexes,
+        "data_version": indexes["version"] if data_version is None else data_version,
+    }
+
+
+def update_municipalities_indexes(indexes, municipalities, removed, added):
+    """
+    Update the indexes derived from the municipalities table after a change
+
+    Only the year counts and the rows of the XREF panel are updated from the
+    changed rows, and memoized changes tables and panels are kept unless a
+    changed row exists in one of their years.  Prerendered responses are
+    dropped.  Everything else is rebuilt from the whole table: the GEOID,
+    county, sort, interval and lineage indexes hold row positions, which
+    shift when rows are added or removed, and the version, footprint and
+    integrity checks cover every row.  So an update saves the DynamoDB scan
+    and the panel and memo rebuilds, but its cost still grows with the size
+    of the table.
+
+    Args:
+        indexes: indexes of the table before the change
+        municipalities: municipalities table, after the change
+        removed: rows removed or replaced by the change
+        added: rows added or replacing rows by the change
+
+    Returns:
+        dict of indexes, as from build_municipalities_indexes
+    """
+    years = {
+        year
+        for rows in (removed, added)
+        for first_year, final_year in zip(rows["first_year"], rows["final_year"])
+        for year in range(int(first_year), int(final_year) + 1)
+    }
+    GEOID_Y2Ks = set(removed["GEOID_Y2K"]) | set(added["GEOID_Y2K"])
+    integrity = check_municipalities_table(municipalities)
+    return {
+        "version": table_version(municipalities),
+        "footprint": table_footprint(municipalities),
+        "integrity": integrity,
+        "GEOID": (
+            build_GEOID_index(municipalities)
+            if integrity["unique_GEOID_year"]
+            else None
+        ),
+        "year_counts": update_year_counts(indexes["year_counts"], removed, added),
+        "county": build_county_index(municipalities),
+        "sort": build_sort_index(municipalities),
+        "interval": build_interval_index(municipalities),
+        "lineage": (
+            build_lineage_index(municipalities)
+            if integrity["complete_GEOID_Y2K"]
+            else None
+        ),
+        "changes": {
+            key: changes
+            for key, changes in indexes["changes"].items()
+            if years.isdisjoint(key)
+        },
+        "xref_panel": update_xref_panel(
+            indexes["xref_panel"], municipalities, GEOID_Y2Ks
+        ),
+        "xref_panels": LRUCache(
+            XREF_PANEL_CACHE_ENTRIES,
+            (
+                (key, panel)
+                for key, panel in indexes["xref_panels"].items()
+                if years.isdisjoint(key)
+            ),
+        ),
+        "rendered": {},
+    }
+
+
+def check_municipalities_table(municipalities):
+    """
+    Check the integrity of the municipalities table, logging any violations
+
+    The checks are run once per table version, when its indexes are built,
+    and the indexes that rely on them are only built if they pass: the GEOID
+    index needs unique_GEOID_year, and the lineage index complete_GEOID_Y2K.
+    Otherwise they are None, and the lib falls back to the pandas paths.
+
+    Returns:
+        dict of checks, from check_municipalities_integrity
+    """
+    integrity = check_municipalities_integrity(municipalities)
+    if not all(value for value in integrity.values() if isinstance(value, bool)):
+        print(json.dumps({"integrity": TABLE_KEY, **integrity}))
+    return integrity
+
+
+@memory_sampled("build_municipalities_indexes")
+def build_municipalities_indexes(municipalities):
+    """Build the indexes derived from the municipalities table"""
+    integrity = check_municipalities_table(municipalities)
+    return {
+        "version": table_version(municipalities),
+        "footprint": table_footprint(municipalities),
+        "integrity": integrity,
+        "GEOID": (
+            build_GEOID_index(municipalities)
+            if integrity["unique_GEOID_year"]
+            else None
+        ),
+        "year_counts": build_year_counts(municipalities),
+        "county": build_county_index(municipalities),
+        "sort": build_sort_index(municipalities),
+        "interval": build_interval_index(municipalities),
+        "lineage": (
+            build_lineage_index(municipalities)
+            if integrity["complete_GEOID_Y2K"]
+            else None
+        ),
+        "changes": {},
+        "xref_panel": build_xref_panel(municipalities),
+        "xref_panels": LRUCache(XREF_PANEL_CACHE_ENTRIES),
+        "rendered": {},
+    }
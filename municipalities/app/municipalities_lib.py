@@ -1,4 +1,9 @@
+import numpy as np
+import pandas as pd
+
 DEFAULT_YEAR = 2025
+FILTER_KEYS = ("county", "GEOID_prefix")
+SORT_KEYS = ("GEOID", "GEOID_Y2K", "county", "municipality")
 
 
 class MunicipalitiesError(Exception):
@@ -13,7 +18,9 @@ class MunicipalitiesNotFoundError(MunicipalitiesError):
     pass
 
 
-def handle_get_municipalities(tbl, params):
+def handle_get_municipalities(
+    tbl, params, county_index=None, sort_index=None, year_counts=None
+):
     """
     Returns a slice of the municipalities table for the appropriate year
 
@@ -21,41 +28,310 @@ def handle_get_municipalities(tbl, params):
     return the appropropriate slice of the municiaplities table and the
     year param (or default value) to select the year.
 
+    The optional "filter" param is a dict that may contain "county" (exact
+    county name) and "GEOID_prefix".  The optional "sort" param is one of
+    SORT_KEYS, prefixed with "-" for descending order.  Without a sort param,
+    rows are returned in table order.  The county and sort indexes are built
+    from the table if they are not supplied.
+
+    If the "meta_only" param is set, no result set is built and None is
+    returned in its place.  Without filters, the record count is then taken
+    from year_counts, if supplied, without scanning the table.
+
     This table will include these columns: "year", "GEOID", "county", "municipality"
 
     If the results are emtpy, this function will throw a MunicipalitiesNotFound exception.
 
     Args:
         municipalities: municipalies table
-        params: dict of params, possibly including pagination params and year param
+        params: dict of params, possibly including pagination, year, filter, sort
+            and meta_only params
+        county_index: Optional county index from build_county_index
+        sort_index: Optional sort index from build_sort_index
+        year_counts: Optional per-year record counts from build_year_counts
 
     Returns:
-        subset of municipalitities table for the appropriate year
-        dict of pagination-related params and year param
+        subset of municipalitities table for the appropriate year, or None
+        dict of pagination-related params, year param, and filter and sort params
     """
     year = params.get("year", DEFAULT_YEAR)
     page_size = params.get("page_size", 100)
     page_number = params.get("page_number", 1)
+    filters = params.get("filter", {})
+    sort = params.get("sort", None)
     aux = {"year": year, "page_size": page_size, "page_number": page_number}
+    if filters:
+        aux["filter"] = filters
+    if sort is not None:
+        aux["sort"] = sort
+
+    meta_only = params.get("meta_only", False)
+    if meta_only and not filters and year_counts is not None:
+        record_count = year_counts.get(year, 0)
+        if record_count == 0:
+            status_msg = f"Year {year} not found"
+            raise MunicipalitiesNotFoundError(status_msg)
+    else:
+        mask = ((tbl["first_year"] <= year) & (tbl["final_year"] >= year)).to_numpy()
+        if not mask.any():
+            status_msg = f"Year {year} not found"
+            raise MunicipalitiesNotFoundError(status_msg)
+        if filters or sort is not None:
+            if county_index is None:
+                county_index = build_county_index(tbl)
+            if sort_index is None:
+                sort_index = build_sort_index(tbl)
+            positions = select_positions(mask, filters, sort, county_index, sort_index)
+        else:
+            positions = np.flatnonzero(mask)
+        record_count = len(positions)
+    if record_count == 0:
+        status_msg = f"No municipalities found for year {year} matching filter"
+        raise MunicipalitiesNotFoundError(status_msg)
+    page_count = (record_count - 1) // page_size + 1
+    if page_number < 1 or page_number > page_count:
+        status_msg = f"Page number {page_number} not found"
+        raise MunicipalitiesNotFoundError(status_msg)
+    aux["record_count"] = record_count
+    if meta_only:
+        return None, aux
 
-    filtered = tbl[(tbl["first_year"] <= year) & (tbl["final_year"] >= year)]
-    if filtered.empty:
-        status_msg = f"Year {year} not found"
+    offset = (page_number - 1) * page_size
+    result_set = tbl.iloc[
+        positions[offset : offset + page_size],
+        tbl.columns.get_indexer(["GEOID", "county", "municipality"]),
+    ]
+    result_set.insert(0, "year", year)
+    return result_set, aux
+
+
+def handle_get_municipalities_range(
+    tbl, params, interval_index=None, county_index=None, sort_index=None
+):
+    """
+    Returns a slice of the municipalities that exist in a range of years
+
+    Each row of the table that overlaps the range is returned once, with its
+    first_year and final_year clipped to the range, so a client can rebuild
+    the listing for any year in the range from a single response.  The "from"
+    and "to" params, the first and last year of the range, must be included
+    in the params dict.  The filter, sort and meta_only params, and the
+    county and sort indexes, are used as in handle_get_municipalities.  The
+    interval index is built from the table if it is not supplied.
+
+    This table will include these columns: "first_year", "final_year", "GEOID",
+    "county", "municipality"
+
+    If the results are emtpy, this function will throw a MunicipalitiesNotFound exception.
+
+    Args:
+        municipalities: municipalies table
+        params: dict of params, including "from" and "to", and possibly
+            pagination, filter, sort and meta_only params
+        interval_index: Optional interval index from build_interval_index
+        county_index: Optional county index from build_county_index
+        sort_index: Optional sort index from build_sort_index
+
+    Returns:
+        subset of municipalitities table for the range of years, or None
+        dict of pagination-related params, range params, and filter and sort params
+    """
+    year_from = params["from"]
+    year_to = params["to"]
+    page_size = params.get("page_size", 100)
+    page_number = params.get("page_number", 1)
+    filters = params.get("filter", {})
+    sort = params.get("sort", None)
+    aux = {
+        "from": year_from,
+        "to": year_to,
+        "page_size": page_size,
+        "page_number": page_number,
+    }
+    if filters:
+        aux["filter"] = filters
+    if sort is not None:
+        aux["sort"] = sort
+
+    if interval_index is None:
+        interval_index = build_interval_index(tbl)
+    positions = find_overlapping_positions(tbl, interval_index, year_from, year_to)
+    if len(positions) == 0:
+        status_msg = f"No municipalities found between {year_from} and {year_to}"
         raise MunicipalitiesNotFoundError(status_msg)
-    page_count = (len(filtered) - 1) // page_size + 1
+    if filters or sort is not None:
+        if county_index is None:
+            county_index = build_county_index(tbl)
+        if sort_index is None:
+            sort_index = build_sort_index(tbl)
+        mask = np.zeros(len(tbl), dtype=bool)
+        mask[positions] = True
+        positions = select_positions(mask, filters, sort, county_index, sort_index)
+    record_count = len(positions)
+    if record_count == 0:
+        status_msg = (
+            f"No municipalities found between {year_from} and {year_to} matching filter"
+        )
+        raise MunicipalitiesNotFoundError(status_msg)
+    page_count = (record_count - 1) // page_size + 1
     if page_number < 1 or page_number > page_count:
         status_msg = f"Page number {page_number} not found"
         raise MunicipalitiesNotFoundError(status_msg)
+    aux["record_count"] = record_count
+    if params.get("meta_only", False):
+        return None, aux
 
     offset = (page_number - 1) * page_size
-    page = filtered.iloc[offset : offset + page_size].copy()
-    page["year"] = year
-    result_set = page[["year", "GEOID", "county", "municipality"]]
-    aux["record_count"] = len(filtered)
+    page = positions[offset : offset + page_size]
+    result_set = tbl.iloc[
+        page, tbl.columns.get_indexer(["GEOID", "county", "municipality"])
+    ]
+    result_set.insert(
+        0, "final_year", tbl["final_year"].to_numpy()[page].clip(max=year_to)
+    )
+    result_set.insert(
+        0, "first_year", tbl["first_year"].to_numpy()[page].clip(min=year_from)
+    )
     return result_set, aux
 
 
-def handle_get_municipality(tbl, params):
+def build_interval_index(tbl):
+    """
+    Builds the interval index used to find municipalities in a range of years
+
+    Row positions are ordered by first_year, so the rows that start no later
+    than the end of a range are a prefix of the order, found by binary search,
+    and only those rows are checked against the start of the range.
+
+    Args:
+        municipalities: municipalities table
+
+    Returns:
+        dict with "order", the row positions sorted by first_year, and
+        "first_year", the sorted first_year values
+    """
+    first_year = tbl["first_year"].to_numpy()
+    order = np.argsort(first_year, kind="stable").astype(np.int32)
+    return {"order": order, "first_year": first_year[order]}
+
+
+def find_overlapping_positions(tbl, interval_index, year_from, year_to):
+    """
+    Finds the rows whose first_year..final_year interval overlaps a range
+
+    Args:
+        municipalities: municipalities table
+        interval_index: interval index from build_interval_index
+        year_from: first year of the range
+        year_to: last year of the range
+
+    Returns:
+        array of row positions, in table order
+    """
+    stop = np.searchsorted(interval_index["first_year"], year_to, side="right")
+    candidates = interval_index["order"][:stop]
+    first_year = interval_index["first_year"][:stop]
+    final_year = tbl["final_year"].to_numpy()[candidates]
+    return np.sort(candidates[(final_year >= year_from) & (final_year >= first_year)])
+
+
+def select_positions(mask, filters, sort, county_index, sort_index):
+    """
+    Applies filter and sort params to a mask of candidate rows
+
+    Args:
+        mask: boolean array of candidate rows
+        filters: dict of filters, possibly including "county" and "GEOID_prefix"
+        sort: sort key, optionally prefixed with "-", or None for table order
+        county_index: county index from build_county_index
+        sort_index: sort index from build_sort_index
+
+    Returns:
+        array of row positions, in sort order
+    """
+    if "county" in filters:
+        county_mask = np.zeros(len(mask), dtype=bool)
+        county_mask[county_index.get(filters["county"], [])] = True
+        mask = mask & county_mask
+    if "GEOID_prefix" in filters:
+        prefix = filters["GEOID_prefix"]
+        GEOIDs = sort_index["GEOID_values"]
+        start = np.searchsorted(GEOIDs, prefix, side="left")
+        stop = np.searchsorted(GEOIDs, prefix + "\uffff", side="left")
+        prefix_mask = np.zeros(len(mask), dtype=bool)
+        prefix_mask[sort_index["GEOID"][start:stop]] = True
+        mask = mask & prefix_mask
+    if sort is None:
+        return np.flatnonzero(mask)
+    order = sort_index[sort]
+    return order[mask[order]]
+
+
+def build_county_index(tbl):
+    """
+    Builds the county index used to filter municipalities by county
+
+    Args:
+        municipalities: municipalities table
+
+    Returns:
+        dict mapping county name to array of row positions
+    """
+    return {
+        county: positions.astype(np.int32)
+        for county, positions in tbl.groupby(
+            "county", observed=True, sort=False
+        ).indices.items()
+    }
+
+
+def build_sort_index(tbl):
+    """
+    Builds the sort index used to order municipalities
+
+    For each of SORT_KEYS, the index holds the permutations of row positions
+    that sort the table by that column, ascending under the key and
+    descending under the key prefixed with "-".  Either way, ties are broken
+    by ascending GEOID, and rows missing the value sort last.  It also holds
+    the sorted GEOID values, without missing values, for GEOID prefix
+    searches.
+
+    Args:
+        municipalities: municipalities table
+
+    Returns:
+        dict mapping sort key to array of row positions, plus "GEOID_values"
+    """
+    GEOID_codes = sort_codes(tbl["GEOID"])
+    sort_index = {}
+    for key in SORT_KEYS:
+        codes = sort_codes(tbl[key])
+        sort_index[key] = np.lexsort((GEOID_codes, codes)).astype(np.int32)
+        descending = np.where(tbl[key].isna().to_numpy(), codes, -codes)
+        sort_index["-" + key] = np.lexsort((GEOID_codes, descending)).astype(np.int32)
+    GEOIDs = tbl["GEOID"].to_numpy(dtype=object)[sort_index["GEOID"]]
+    sort_index["GEOID_values"] = GEOIDs[: tbl["GEOID"].notna().sum()]
+    return sort_index
+
+
+def sort_codes(values):
+    """
+    Returns integer codes in the sort order of values
+
+    Missing values, which cannot be compared with strings, get the largest
+    code, so they sort last.
+
+    Args:
+        values: pd.Series
+
+    Returns:
+        array of codes, one per value
+    """
+    codes, uniques = pd.factorize(values.to_numpy(dtype=object), sort=True)
+    return np.where(codes < 0, len(uniques), codes)
+
+
+def handle_get_municipality(tbl, params, GEOID_index=None):
     """
     Returns the specified municipality for the specified year.
 
@@ -65,9 +341,13 @@ def handle_get_municipality(tbl, params):
 
     The single row will include these columns: "year", "GEOID", "county", "municipality"
 
+    With a GEOID index, which is only built when each GEOID is in at most one
+    row per year, the row is found with a dict lookup instead of a scan.
+
     Args:
         municipalities: municipalities table
         params: dict of params, including "GEOID" and "year"
+        GEOID_index: Optional GEOID index from build_GEOID_index
 
     Returns:
         Single row municipalities table
@@ -77,6 +357,18 @@ def handle_get_municipality(tbl, params):
     GEOID = params["GEOID"]
     aux = {"year": year, "GEOID": GEOID}
 
+    if GEOID_index is not None:
+        first_year = tbl["first_year"].to_numpy()
+        final_year = tbl["final_year"].to_numpy()
+        for position in GEOID_index.get(GEOID, ()):
+            if first_year[position] <= year <= final_year[position]:
+                columns = tbl.columns.get_indexer(["GEOID", "county", "municipality"])
+                result_set = tbl.iloc[[position], columns].copy()
+                result_set.insert(0, "year", year)
+                return result_set, aux
+        status_msg = f"Year {year} not found for GEOID {GEOID}"
+        raise MunicipalitiesNotFoundError(status_msg)
+
     filtered = tbl[
         (tbl["GEOID"] == GEOID)
         & (tbl["first_year"] <= year)
@@ -91,7 +383,7 @@ def handle_get_municipality(tbl, params):
     return result_set, aux
 
 
-def handle_get_xrefs(tbl, params):
+def handle_get_xrefs(tbl, params, year_counts=None, integrity=None):
     """
     Returns a slice of the XREFs table generated for a pair of years
 
@@ -99,16 +391,26 @@ def handle_get_xrefs(tbl, params):
     return the appropropriate slice of the XREF table for year and year_ref.
     The year and year_ref params must be included in the params dict.
 
+    If the "meta_only" param is set, no result set is built and None is
+    returned in its place.  The record count is then taken from year_counts,
+    if supplied, without scanning the table.
+
+    If integrity shows that every row has a GEOID_Y2K, and that each
+    GEOID_Y2K is in at most one row per year, the reference GEOIDs are
+    gathered by position from a hash lookup, rather than with a join.
+
     This table will include these columns: "year", "GEOID", "year_ref", "GEOID_ref"
 
     If the results are emtpy, this function will throw a MunicipalitiesNotFound exception.
 
     Args:
         municipalities: municipalities table
-        params: dict of params, possibly including pagination params and year params
+        params: dict of params, possibly including pagination, year and meta_only params
+        year_counts: Optional per-year record counts from build_year_counts
+        integrity: Optional integrity checks from check_municipalities_integrity
 
     Returns:
-        subset of XREF table for the appropriate years
+        subset of XREF table for the appropriate years, or None
         dict of pagination-related params and year params
     """
     page_size = params.get("page_size", 100)
@@ -122,29 +424,540 @@ def handle_get_xrefs(tbl, params):
         "page_number": page_number,
     }
 
-    cur_tbl = tbl[(tbl["first_year"] <= year) & (tbl["final_year"] >= year)]
-    if cur_tbl.empty:
+    if params.get("meta_only", False) and year_counts is not None:
+        record_count = year_counts.get(year, 0)
+        if record_count == 0:
+            status_msg = f"Year {year} not found"
+            raise MunicipalitiesNotFoundError(status_msg)
+        page_count = (record_count - 1) // page_size + 1
+        if page_number < 1 or page_number > page_count:
+            status_msg = f"Page number {page_number} not found"
+            raise MunicipalitiesNotFoundError(status_msg)
+        if year_counts.get(year_ref, 0) == 0:
+            status_msg = f"Reference year {year_ref} not found"
+            raise MunicipalitiesNotFoundError(status_msg)
+        aux["record_count"] = record_count
+        return None, aux
+
+    cur_positions = np.flatnonzero(
+        ((tbl["first_year"] <= year) & (tbl["final_year"] >= year)).to_numpy()
+    )
+    if len(cur_positions) == 0:
         status_msg = f"Year {year} not found"
         raise MunicipalitiesNotFoundError(status_msg)
 
-    page_count = (len(cur_tbl) - 1) // page_size + 1
+    page_count = (len(cur_positions) - 1) // page_size + 1
     if page_number < 1 or page_number > page_count:
         status_msg = f"Page number {page_number} not found"
         raise MunicipalitiesNotFoundError(status_msg)
     offset = (page_number - 1) * page_size
-    page = cur_tbl.iloc[offset : offset + page_size]
+    columns = tbl.columns.get_indexer(["GEOID_Y2K", "GEOID"])
+    page = tbl.iloc[cur_positions[offset : offset + page_size], columns]
+
+    ref_tbl = tbl.iloc[
+        np.flatnonzero(
+            (
+                (tbl["first_year"] <= year_ref) & (tbl["final_year"] >= year_ref)
+            ).to_numpy()
+        ),
+        columns,
+    ]
+    if ref_tbl.empty:
+        status_msg = f"Reference year {year_ref} not found"
+        raise MunicipalitiesNotFoundError(status_msg)
+    aux["record_count"] = len(cur_positions)
+    if params.get("meta_only", False):
+        return None, aux
+
+    if is_GEOID_Y2K_unique(integrity):
+        ref_positions = pd.Index(ref_tbl["GEOID_Y2K"]).get_indexer(page["GEOID_Y2K"])
+        found = ref_positions >= 0
+        GEOID_ref = np.full(len(page), np.nan, dtype=object)
+        GEOID_ref[found] = ref_tbl["GEOID"].to_numpy()[ref_positions[found]]
+        result_set = pd.DataFrame(
+            {"GEOID_ref": GEOID_ref, "GEOID": page["GEOID"].to_numpy()}
+        )
+    else:
+        result_set = page.merge(
+            ref_tbl, how="left", on="GEOID_Y2K", suffixes=("", "_ref")
+        )
+        result_set = result_set[["GEOID_ref", "GEOID"]]
+    result_set.insert(0, "year", year)
+    result_set.insert(0, "year_ref", year_ref)
+    return result_set, aux
+
+
+def find_overlapping_intervals(tbl, key):
+    """
+    Finds the values of a key column that are in two rows in the same year
+
+    Rows are sorted by key and first_year, and a row overlaps an earlier row
+    of its key if it starts no later than the latest final_year before it.
+    Rows with a missing key, or with first_year after final_year (which are
+    in no year), are ignored.
+
+    Args:
+        municipalities: municipalities table
+        key: "GEOID" or "GEOID_Y2K"
+
+    Returns:
+        sorted list of key values with overlapping intervals
+    """
+    rows = pd.DataFrame(
+        {
+            "key": tbl[key].to_numpy(),
+            "first_year": tbl["first_year"].to_numpy(),
+            "final_year": tbl["final_year"].to_numpy(),
+        }
+    )
+    rows = rows[
+        rows["key"].notna() & (rows["first_year"] <= rows["final_year"])
+    ].sort_values(["key", "first_year"], kind="stable")
+    groups = rows.groupby("key", sort=False)["final_year"]
+    latest = groups.cummax().groupby(rows["key"], sort=False).shift()
+    return sorted(set(rows["key"][rows["first_year"] <= latest]))
+
+
+def check_municipalities_integrity(tbl):
+    """
+    Checks the municipalities table for the invariants that fast paths rely on
+
+    Args:
+        municipalities: municipalities table
+
+    Returns:
+        dict with
+            "valid_intervals": True if first_year <= final_year in every row
+            "complete_GEOID_Y2K": True if no row is missing its GEOID_Y2K
+            "unique_GEOID_year", "unique_GEOID_Y2K_year": True if no GEOID
+                (or GEOID_Y2K) is in two rows in any year
+            "overlapping_GEOIDs", "overlapping_GEOID_Y2Ks": the values that
+                are, for logging
+    """
+    overlapping_GEOIDs = find_overlapping_intervals(tbl, "GEOID")
+    overlapping_GEOID_Y2Ks = find_overlapping_intervals(tbl, "GEOID_Y2K")
+    return {
+        "valid_intervals": bool((tbl["first_year"] <= tbl["final_year"]).all()),
+        "complete_GEOID_Y2K": bool(tbl["GEOID_Y2K"].notna().all()),
+        "unique_GEOID_year": not overlapping_GEOIDs,
+        "unique_GEOID_Y2K_year": not overlapping_GEOID_Y2Ks,
+        "overlapping_GEOIDs": overlapping_GEOIDs,
+        "overlapping_GEOID_Y2Ks": overlapping_GEOID_Y2Ks,
+    }
+
+
+def is_GEOID_Y2K_unique(integrity):
+    """Returns True if integrity shows that GEOID_Y2K keys at most one row per year"""
+    return (
+        integrity is not None
+        and integrity["complete_GEOID_Y2K"]
+        and integrity["unique_GEOID_Y2K_year"]
+    )
+
+
+def build_GEOID_index(tbl):
+    """
+    Builds the GEOID index used by handle_get_municipality
+
+    The index is only valid if each GEOID is in at most one row per year,
+    as checked by check_municipalities_integrity.
+
+    Args:
+        municipalities: municipalities table
+
+    Returns:
+        dict mapping GEOID to an array of its row positions
+    """
+    codes, uniques = pd.factorize(tbl["GEOID"])
+    order = np.argsort(codes, kind="stable").astype(np.int32)
+    order = order[codes[order] >= 0]
+    boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+    return {
+        uniques[codes[positions[0]]]: positions
+        for positions in np.split(order, boundaries)
+        if len(positions)
+    }
+
+
+def build_lineage_index(tbl):
+    """
+    Builds the lineage index used by handle_get_history
+
+    Every row sharing a GEOID_Y2K belongs to the same lineage.  The index maps
+    each GEOID_Y2K to the row positions of its lineage, ordered by first_year,
+    and each GEOID to the GEOID_Y2K values it has appeared under.
+
+    Args:
+        municipalities: municipalities table
+
+    Returns:
+        dict with keys "GEOID_Y2K" and "GEOID"
+    """
+    first_year = tbl["first_year"].to_numpy()
+    by_y2k = {
+        GEOID_Y2K: positions[np.argsort(first_year[positions], kind="stable")]
+        for GEOID_Y2K, positions in tbl.groupby("GEOID_Y2K", sort=False).indices.items()
+    }
+    by_geoid = {
+        GEOID: tuple(GEOID_Y2Ks)
+        for GEOID, GEOID_Y2Ks in tbl.groupby("GEOID", sort=False)["GEOID_Y2K"]
+        .unique()
+        .items()
+    }
+    return {"GEOID_Y2K": by_y2k, "GEOID": by_geoid}
+
+
+def handle_get_history(tbl, params, lineage=None):
+    """
+    Returns every name, GEOID and validity interval in the lineage of a GEOID
+
+    The GEOID should be in the params dict.  It may be either a GEOID from any
+    year or a GEOID_Y2K.  Without a lineage index, which is only built when
+    every row has a GEOID_Y2K, the table is scanned, and rows of the GEOID
+    that are missing their GEOID_Y2K are returned after its lineages.
+
+    If no lineage is found, MunicipalitiesNotFoundError will be thrown.
+
+    This table will include these columns: "GEOID_Y2K", "GEOID", "county",
+    "municipality", "first_year", "final_year"
+
+    Args:
+        municipalities: municipalities table
+        params: dict of params, including "GEOID"
+        lineage: Optional lineage index from build_lineage_index
+
+    Returns:
+        rows of municipalities table in the lineage, ordered by GEOID_Y2K and first_year
+        dict containing GEOID param
+    """
+    GEOID = params["GEOID"]
+    aux = {"GEOID": GEOID}
+    columns = [
+        "GEOID_Y2K",
+        "GEOID",
+        "county",
+        "municipality",
+        "first_year",
+        "final_year",
+    ]
+
+    if lineage is None:
+        matched = (tbl["GEOID"] == GEOID) | (tbl["GEOID_Y2K"] == GEOID)
+        if not matched.any():
+            status_msg = f"GEOID {GEOID} not found"
+            raise MunicipalitiesNotFoundError(status_msg)
+        GEOID_Y2Ks = tbl.loc[matched, "GEOID_Y2K"].dropna().unique()
+        in_lineage = tbl["GEOID_Y2K"].isin(GEOID_Y2Ks) | (
+            matched & tbl["GEOID_Y2K"].isna()
+        )
+        result_set = tbl.loc[in_lineage, columns].sort_values(
+            ["GEOID_Y2K", "first_year"], kind="stable", na_position="last"
+        )
+        return result_set, aux
+
+    GEOID_Y2Ks = set(lineage["GEOID"].get(GEOID, ()))
+    if GEOID in lineage["GEOID_Y2K"]:
+        GEOID_Y2Ks.add(GEOID)
+    if not GEOID_Y2Ks:
+        status_msg = f"GEOID {GEOID} not found"
+        raise MunicipalitiesNotFoundError(status_msg)
+
+    positions = np.concatenate(
+        [lineage["GEOID_Y2K"][GEOID_Y2K] for GEOID_Y2K in sorted(GEOID_Y2Ks)]
+    )
+    result_set = tbl.iloc[positions][columns]
+    return result_set, aux
+
+
+def build_changes_table(tbl, year_ref, year):
+    """
+    Builds the table of municipalities that differ between year_ref and year
+
+    Rows for the two years are joined on GEOID_Y2K, as in handle_get_xrefs, and
+    only rows that differ are kept.  The change_type column is one of
+    "added" (no match in year_ref), "removed" (no match in year), "recoded"
+    (GEOID differs) or "renamed" (GEOID matches but municipality name differs).
+
+    If either year has no rows, MunicipalitiesNotFoundError will be thrown.
+
+    Args:
+        municipalities: municipalities table
+        year_ref: reference year
+        year: year
 
-    ref_tbl = tbl[(tbl["first_year"] <= year_ref) & (tbl["final_year"] >= year_ref)]
+    Returns:
+        Table with columns "year_ref", "year", "GEOID_ref", "GEOID",
+        "municipality_ref", "municipality", "change_type"
+    """
+    columns = ["GEOID_Y2K", "GEOID", "municipality"]
+    cur_tbl = tbl.loc[
+        (tbl["first_year"] <= year) & (tbl["final_year"] >= year), columns
+    ]
+    if cur_tbl.empty:
+        status_msg = f"Year {year} not found"
+        raise MunicipalitiesNotFoundError(status_msg)
+    ref_tbl = tbl.loc[
+        (tbl["first_year"] <= year_ref) & (tbl["final_year"] >= year_ref), columns
+    ]
     if ref_tbl.empty:
         status_msg = f"Reference year {year_ref} not found"
         raise MunicipalitiesNotFoundError(status_msg)
 
-    result_set = page.set_index("GEOID_Y2K").join(
-        ref_tbl.set_index("GEOID_Y2K"),
-        rsuffix="_ref",
-    )[["GEOID_ref", "GEOID"]]
-    result_set["year"] = year
-    result_set["year_ref"] = year_ref
-    result_set = result_set[["year_ref", "year", "GEOID_ref", "GEOID"]]
-    aux["record_count"] = len(cur_tbl)
+    merged = cur_tbl.merge(
+        ref_tbl,
+        how="outer",
+        on="GEOID_Y2K",
+        suffixes=("", "_ref"),
+        sort=True,
+        indicator=True,
+    )
+    change_type = np.select(
+        [
+            merged["_merge"] == "left_only",
+            merged["_merge"] == "right_only",
+            merged["GEOID"] != merged["GEOID_ref"],
+            merged["municipality"] != merged["municipality_ref"],
+        ],
+        ["added", "removed", "recoded", "renamed"],
+        default="",
+    )
+    changes = merged[change_type != ""].assign(
+        year_ref=year_ref, year=year, change_type=change_type[change_type != ""]
+    )
+    return changes[
+        [
+            "year_ref",
+            "year",
+            "GEOID_ref",
+            "GEOID",
+            "municipality_ref",
+            "municipality",
+            "change_type",
+        ]
+    ].reset_index(drop=True)
+
+
+def handle_get_changes(tbl, params, changes_cache=None):
+    """
+    Returns a slice of the changes table generated for a pair of years
+
+    This function will use the pagination params (or default values) to
+    return the appropropriate slice of the changes table for year and year_ref.
+    The year and year_ref params must be included in the params dict.
+
+    The full changes table for each pair of years is memoized in changes_cache,
+    if supplied.  If the "meta_only" param is set, no result set is built and
+    None is returned in its place.
+
+    If the results are emtpy, this function will throw a MunicipalitiesNotFound exception.
+
+    Args:
+        municipalities: municipalities table
+        params: dict of params, possibly including pagination, year and meta_only params
+        changes_cache: Optional dict of changes tables keyed by (year_ref, year)
+
+    Returns:
+        subset of changes table for the appropriate years, or None
+        dict of pagination-related params and year params
+    """
+    page_size = params.get("page_size", 100)
+    page_number = params.get("page_number", 1)
+    year = params["year"]
+    year_ref = params["year_ref"]
+    aux = {
+        "year": year,
+        "year_ref": year_ref,
+        "page_size": page_size,
+        "page_number": page_number,
+    }
+
+    key = (year_ref, year)
+    if changes_cache is not None and key in changes_cache:
+        changes = changes_cache[key]
+    else:
+        changes = build_changes_table(tbl, year_ref, year)
+        if changes_cache is not None:
+            changes_cache[key] = changes
+    if changes.empty:
+        status_msg = f"No changes found between {year_ref} and {year}"
+        raise MunicipalitiesNotFoundError(status_msg)
+
+    page_count = (len(changes) - 1) // page_size + 1
+    if page_number < 1 or page_number > page_count:
+        status_msg = f"Page number {page_number} not found"
+        raise MunicipalitiesNotFoundError(status_msg)
+    aux["record_count"] = len(changes)
+    if params.get("meta_only", False):
+        return None, aux
+    offset = (page_number - 1) * page_size
+    result_set = changes.iloc[offset : offset + page_size]
     return result_set, aux
+
+
+def build_xref_panel(tbl):
+    """
+    Builds the GEOID cross reference panel for every year in the table
+
+    Each row is expanded over its first_year..final_year interval and the
+    result is pivoted in one step, giving one row per GEOID_Y2K and one GEOID
+    column per year.  Years in which a GEOID_Y2K has no municipality are NaN.
+
+    Args:
+        municipalities: municipalities table
+
+    Returns:
+        Table indexed by GEOID_Y2K, with one column per year
+    """
+    first_year = tbl["first_year"].to_numpy()
+    lengths = tbl["final_year"].to_numpy() - first_year + 1
+    lengths = lengths.clip(min=0)
+    positions = np.repeat(np.arange(len(tbl)), lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    years = first_year[positions] + np.arange(len(positions)) - starts
+    expanded = pd.DataFrame(
+        {
+            "GEOID_Y2K": tbl["GEOID_Y2K"].to_numpy()[positions],
+            "year": years,
+            "GEOID": tbl["GEOID"].to_numpy()[positions],
+        }
+    ).drop_duplicates(["GEOID_Y2K", "year"])
+    return expanded.pivot(index="GEOID_Y2K", columns="year", values="GEOID")
+
+
+def update_xref_panel(panel, tbl, GEOID_Y2Ks):
+    """
+    Updates the GEOID cross reference panel for changed lineages
+
+    Only the panel rows of the given GEOID_Y2K values are rebuilt, from their
+    rows in the updated table, and the other rows are copied, rather than
+    expanding and pivoting every row of the table.  The result is the same
+    as build_xref_panel(tbl).
+
+    Args:
+        panel: panel from build_xref_panel, for the table before the change
+        tbl: municipalities table, after the change
+        GEOID_Y2Ks: GEOID_Y2K values of every changed row, before or after the
+            change
+
+    Returns:
+        Table indexed by GEOID_Y2K, with one column per year
+    """
+    GEOID_Y2Ks = list(GEOID_Y2Ks)
+    patch = build_xref_panel(tbl[tbl["GEOID_Y2K"].isin(GEOID_Y2Ks)])
+    kept = panel.drop(index=GEOID_Y2Ks, errors="ignore")
+    updated = pd.concat([kept, patch]).sort_index().sort_index(axis=1)
+    return updated.dropna(axis=1, how="all")
+
+
+def handle_get_xref_panel(tbl, params, panel=None, panel_cache=None):
+    """
+    Returns a slice of the XREF panel generated for a set of years
+
+    This function will use the pagination params (or default values) to
+    return the appropropriate slice of the XREF panel for the years param,
+    which must be included in the params dict as a sorted list of years.
+
+    This table will include the column "GEOID_Y2K" and one "GEOID_<year>"
+    column per year.  Only rows with a municipality in at least one of the
+    years are included.
+
+    The full panel is built from the table if it is not supplied, and the
+    panel for each set of years is memoized in panel_cache, if supplied.  If
+    the "meta_only" param is set, no result set is built and None is returned
+    in its place.
+
+    If the results are emtpy, this function will throw a MunicipalitiesNotFound exception.
+
+    Args:
+        municipalities: municipalities table
+        params: dict of params, including "years" and possibly pagination and
+            meta_only params
+        panel: Optional full panel from build_xref_panel
+        panel_cache: Optional mapping of panels keyed by tuple of years, such
+            as a cachelib.LRUCache
+
+    Returns:
+        subset of XREF panel for the appropriate years, or None
+        dict of pagination-related params and years param
+    """
+    page_size = params.get("page_size", 100)
+    page_number = params.get("page_number", 1)
+    years = params["years"]
+    aux = {"years": years, "page_size": page_size, "page_number": page_number}
+
+    key = tuple(years)
+    selected = None if panel_cache is None else panel_cache.get(key)
+    if selected is None:
+        if panel is None:
+            panel = build_xref_panel(tbl)
+        for year in years:
+            if year not in panel.columns:
+                status_msg = f"Year {year} not found"
+                raise MunicipalitiesNotFoundError(status_msg)
+        selected = (
+            panel[years]
+            .dropna(how="all")
+            .rename(columns=lambda year: f"GEOID_{year}")
+            .rename_axis(columns=None)
+            .reset_index()
+        )
+        if panel_cache is not None:
+            panel_cache[key] = selected
+
+    page_count = (len(selected) - 1) // page_size + 1
+    if page_number < 1 or page_number > page_count:
+        status_msg = f"Page number {page_number} not found"
+        raise MunicipalitiesNotFoundError(status_msg)
+    aux["record_count"] = len(selected)
+    if params.get("meta_only", False):
+        return None, aux
+    offset = (page_number - 1) * page_size
+    result_set = selected.iloc[offset : offset + page_size]
+    return result_set, aux
+
+
+def build_year_counts(tbl):
+    """
+    Builds the number of municipalities in each year of the table
+
+    Args:
+        municipalities: municipalities table
+
+    Returns:
+        dict mapping year to record count, for years with at least one record
+    """
+    if tbl.empty:
+        return {}
+    first_year = tbl["first_year"].to_numpy()
+    final_year = tbl["final_year"].to_numpy()
+    valid = first_year <= final_year
+    base = first_year.min()
+    deltas = np.zeros(final_year.max() - base + 2, dtype=np.int64)
+    np.add.at(deltas, first_year[valid] - base, 1)
+    np.add.at(deltas, final_year[valid] - base + 1, -1)
+    counts = np.cumsum(deltas[:-1])
+    return {
+        int(base + offset): int(count)
+        for offset, count in enumerate(counts)
+        if count > 0
+    }
+
+
+def update_year_counts(year_counts, removed, added):
+    """
+    Updates the number of municipalities in each year for changed rows
+
+    Args:
+        year_counts: counts from build_year_counts, before the change
+        removed: table of rows removed or replaced by the change
+        added: table of rows added or replacing rows by the change
+
+    Returns:
+        dict mapping year to record count, as from build_year_counts
+    """
+    counts = dict(year_counts)
+    for rows, sign in ((removed, -1), (added, 1)):
+        for first_year, final_year in zip(rows["first_year"], rows["final_year"]):
+            for year in range(int(first_year), int(final_year) + 1):
+                counts[year] = counts.get(year, 0) + sign
+    return {year: count for year, count in sorted(counts.items()) if count > 0}
@@ -0,0 +1,180 @@
+"""
+Measures the memory allocated per request by the handle_* functions, before
+and after the redundant DataFrame copies were removed
+
+Each handler is run against a synthetic table the size of the NJ dataset, and
+the peak memory traced by tracemalloc above the steady state is reported, per
+request.  numpy and pandas buffers are included, since numpy reports its
+allocations to tracemalloc.
+
+The old columns run the result-building code the handlers used before: a
+copy of the page followed by a column projection, and for the xrefs a
+set_index/join of full rows.  They reproduce only the paths exercised here,
+that is without filters, sort or meta_only.  handle_get_municipality kept its
+copy, so it is run as it is in both columns.
+
+Run with `make benchmark`, or `python -m tests.benchmark.bench_allocations`
+with common_layer on PYTHONPATH.
+"""
+
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from counties.app import counties_lib
+from municipalities.app import municipalities_lib
+
+REPEAT = 20
+
+
+def make_counties_table(size=21):
+    """Returns a synthetic counties table"""
+    rows = np.arange(1, size + 1)
+    return pd.DataFrame(
+        {
+            "row_number": rows,
+            "GEOID": [f"34{2 * row - 1:03d}" for row in rows],
+            "county": [f"County {row}" for row in rows],
+        }
+    )
+
+
+def make_municipalities_table(size=600, changed=40):
+    """Returns a synthetic municipalities table with some GEOID changes"""
+    rng = np.random.default_rng(0)
+    GEOID_Y2K = [f"34{1 + 2 * (row % 21):03d}{row:05d}" for row in range(size)]
+    tbl = pd.DataFrame(
+        {
+            "GEOID_Y2K": GEOID_Y2K,
+            "GEOID": GEOID_Y2K,
+            "first_year": 2000,
+            "final_year": 2025,
+            "county": [f"County {1 + row % 21}" for row in range(size)],
+            "municipality": [f"Town {row}" for row in range(size)],
+        }
+    )
+    changes = tbl.iloc[rng.choice(size, changed, replace=False)].copy()
+    change_years = rng.integers(2001, 2025, changed)
+    tbl.loc[changes.index, "final_year"] = change_years - 1
+    changes["first_year"] = change_years
+    changes["GEOID"] = [f"{GEOID[:5]}9{GEOID[6:]}" for GEOID in changes["GEOID"]]
+    tbl = pd.concat([tbl, changes], ignore_index=True).sort_values("GEOID_Y2K")
+    tbl.insert(0, "row_number", np.arange(1, len(tbl) + 1))
+    return tbl.astype({"county": "category"})
+
+
+def old_handle_get_counties(counties, params):
+    """The old path of handle_get_counties: copy the page, then project it"""
+    page_size = params.get("page_size", 100)
+    page_number = params.get("page_number", 1)
+    offset = (page_number - 1) * page_size
+    page = counties[offset : offset + page_size].copy()
+    return page[["GEOID", "county"]], {"record_count": len(counties)}
+
+
+def old_handle_get_county(counties, params):
+    """The old path of handle_get_county: filter full rows, then project them"""
+    GEOID = params["GEOID"]
+    return counties[counties["GEOID"] == GEOID][["GEOID", "county"]], {"GEOID": GEOID}
+
+
+def old_handle_get_municipalities(tbl, params):
+    """The old path of handle_get_municipalities: copy the page, add the year"""
+    year = params.get("year", municipalities_lib.DEFAULT_YEAR)
+    page_size = params.get("page_size", 100)
+    page_number = params.get("page_number", 1)
+    mask = ((tbl["first_year"] <= year) & (tbl["final_year"] >= year)).to_numpy()
+    positions = np.flatnonzero(mask)
+    offset = (page_number - 1) * page_size
+    page = tbl.iloc[positions[offset : offset + page_size]].copy()
+    page["year"] = year
+    result_set = page[["year", "GEOID", "county", "municipality"]]
+    return result_set, {"year": year, "record_count": len(positions)}
+
+
+def old_handle_get_xrefs(tbl, params):
+    """The old path of handle_get_xrefs: join full rows of both years"""
+    page_size = params.get("page_size", 100)
+    page_number = params.get("page_number", 1)
+    year = params["year"]
+    year_ref = params["year_ref"]
+    cur_tbl = tbl[(tbl["first_year"] <= year) & (tbl["final_year"] >= year)]
+    offset = (page_number - 1) * page_size
+    page = cur_tbl.iloc[offset : offset + page_size]
+    ref_tbl = tbl[(tbl["first_year"] <= year_ref) & (tbl["final_year"] >= year_ref)]
+    result_set = page.set_index("GEOID_Y2K").join(
+        ref_tbl.set_index("GEOID_Y2K"),
+        rsuffix="_ref",
+    )[["GEOID_ref", "GEOID"]]
+    result_set["year"] = year
+    result_set["year_ref"] = year_ref
+    result_set = result_set[["year_ref", "year", "GEOID_ref", "GEOID"]]
+    return result_set, {"year": year, "record_count": len(cur_tbl)}
+
+
+def measure(handler, tbl, params):
+    """Returns the peak bytes allocated per call of handler(tbl, params)"""
+    handler(tbl, params)
+    peaks = []
+    tracemalloc.start()
+    for _ in range(REPEAT):
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        handler(tbl, params)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - baseline)
+    tracemalloc.stop()
+    return int(np.median(peaks))
+
+
+def main():
+    counties = make_counties_table()
+    municipalities = make_municipalities_table()
+    cases = [
+        (
+            "handle_get_counties",
+            old_handle_get_counties,
+            counties_lib.handle_get_counties,
+            counties,
+            {},
+        ),
+        (
+            "handle_get_county",
+            old_handle_get_county,
+            counties_lib.handle_get_county,
+            counties,
+            {"GEOID": "34003"},
+        ),
+        (
+            "handle_get_municipalities",
+            old_handle_get_municipalities,
+            municipalities_lib.handle_get_municipalities,
+            municipalities,
+            {"year": 2010},
+        ),
+        (
+            "handle_get_municipality",
+            municipalities_lib.handle_get_municipality,
+            municipalities_lib.handle_get_municipality,
+            municipalities,
+            {"year": 2010, "GEOID": municipalities["GEOID"].iloc[0]},
+        ),
+        (
+            "handle_get_xrefs",
+            old_handle_get_xrefs,
+            municipalities_lib.handle_get_xrefs,
+            municipalities,
+            {"year": 2025, "year_ref": 2000},
+        ),
+    ]
+    print(f"{'handler':<28}{'old bytes':>12}{'new bytes':>12}")
+    for name, old, new, tbl, params in cases:
+        print(
+            f"{name:<28}{measure(old, tbl, params):>12,}"
+            f"{measure(new, tbl, params):>12,}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Reports the memory footprint of the municipalities table before and after
+compaction
+
+A national-scale synthetic table is built as ddb_itemlist_to_pd would build
+it, with int64 columns and a separate string object in every cell, and then
+compacted with the dtypes and interned columns used by
+build_municipalities_table.
+
+Run with `make benchmark`, or `python -m tests.benchmark.bench_footprint`
+with common_layer on PYTHONPATH.
+"""
+
+from tablelib import compact_table, table_footprint
+
+from municipalities.app.municipalities_data import (
+    MUNICIPALITIES_DTYPES,
+    MUNICIPALITIES_INTERNED_KEYS,
+)
+from tools.synthetic_data import generate_municipalities_table
+
+
+def uninterned(tbl):
+    """Returns a copy of tbl with a distinct object in every string cell"""
+    return tbl.astype({"county": object}).map(
+        lambda value: "".join(value) if isinstance(value, str) else value
+    )
+
+
+def main():
+    loose = uninterned(
+        generate_municipalities_table().astype({"first_year": int, "final_year": int})
+    )
+    compact = compact_table(loose, MUNICIPALITIES_DTYPES, MUNICIPALITIES_INTERNED_KEYS)
+    loose_footprint = table_footprint(loose)
+    compact_footprint = table_footprint(compact)
+    print(f"{'column':<16}{'loose bytes':>16}{'compact bytes':>16}")
+    for key in loose.columns:
+        print(
+            f"{key:<16}{loose_footprint['columns'][key]:>16,}"
+            f"{compact_footprint['columns'][key]:>16,}"
+        )
+    print(
+        f"{'total':<16}{loose_footprint['total']:>16,}{compact_footprint['total']:>16,}"
+    )
+
+
+if __name__ == "__main__":
+    main()
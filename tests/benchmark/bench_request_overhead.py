@@ -0,0 +1,103 @@
+"""
+Measures the per-request time spent outside the data layer, before and after
+the compiled route table and the links/meta memo
+
+Each case is timed on the old path and on the new one:
+    links and meta: parameter processing and link/meta generation for a
+        typical municipalities request, with torguapi_make_links_and_meta
+        called directly (old) and through the memoized make_links_and_meta
+        (new)
+    reject malformed year: a five-digit year, which used to pass the
+        isnumeric() check and was only rejected, as a 404, after the year
+        scan of the table (old), and is now rejected with a 400 by the route
+        table before the table is touched (new).  The old path is timed
+        against a synthetic table of the size of New Jersey.
+
+Requires the torguapi layer on PYTHONPATH.
+
+Run with `make benchmark`, or `python -m tests.benchmark.bench_request_overhead`
+with common_layer and the torguapi layer on PYTHONPATH.
+"""
+
+import timeit
+from http import HTTPStatus
+
+from torguapi import torguapi_http_error, torguapi_make_links_and_meta
+
+from municipalities.app import municipalities_api, municipalities_data
+from municipalities.app.municipalities_lib import (
+    MunicipalitiesNotFoundError,
+    handle_get_municipalities,
+)
+from tools import synthetic_data
+
+REPEAT = 10000
+
+
+def make_event(path_parameters, query_parameters=None):
+    """Returns an API Gateway event for the municipalities API"""
+    return {
+        "httpMethod": "GET",
+        "resource": "/nj/municipalities/{year}",
+        "path": "/nj/municipalities/2010",
+        "pathParameters": path_parameters,
+        "queryStringParameters": query_parameters,
+        "headers": {},
+    }
+
+
+def links_and_meta(make_links_and_meta, event):
+    """Processes the params of event, and generates its links and meta"""
+    _, _, params = municipalities_api.process_municipality_params(event)
+    aux = dict(params, page_number=params.get("page_number", 1), record_count=564)
+    path = municipalities_api.make_municipalities_path(aux)
+    return make_links_and_meta(aux, path)
+
+
+def reject_after_scan(municipalities, event):
+    """The old path of a malformed year: the year reaches the table scan"""
+    params = {"year": int(event["pathParameters"]["year"])}
+    try:
+        handle_get_municipalities(municipalities, params)
+    except MunicipalitiesNotFoundError as e:
+        return torguapi_http_error(HTTPStatus.NOT_FOUND, str(e))
+
+
+def time_per_request(function):
+    """Returns the mean time of function(), in microseconds"""
+    return timeit.timeit(function, number=REPEAT) / REPEAT * 1e6
+
+
+def main():
+    event = make_event({"year": "2010"}, {"page_size": "50", "page_number": "2"})
+    bad_event = make_event({"year": "20100"})
+    counties = synthetic_data.generate_counties_table(counties=21, states=1)
+    municipalities = municipalities_data.municipalities_items_to_pd(
+        synthetic_data.pd_to_ddb_itemlist(
+            synthetic_data.generate_municipalities_table(600, counties)
+        )
+    )
+    cases = [
+        (
+            "links and meta",
+            lambda: links_and_meta(torguapi_make_links_and_meta, event),
+            lambda: links_and_meta(municipalities_api.make_links_and_meta, event),
+        ),
+        (
+            "reject malformed year",
+            lambda: reject_after_scan(municipalities, bad_event),
+            lambda: municipalities_api.municipalities_handler(bad_event, None),
+        ),
+    ]
+    print(f"{'case':<24}{'old us':>10}{'new us':>10}{'speedup':>10}")
+    for name, old, new in cases:
+        old_time = time_per_request(old)
+        new_time = time_per_request(new)
+        print(
+            f"{name:<24}{old_time:>10.1f}{new_time:>10.1f}"
+            f"{old_time / new_time:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
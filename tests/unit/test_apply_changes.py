@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from tools import apply_changes
+
+
+def test_main_1(monkeypatch, tmp_path, capsys):
+    """main publishes the changes in the replay file to the shared directory"""
+    calls = []
+
+    def publish_municipalities_changes(directory, records):
+        calls.append((directory, records))
+        return len(records), "municipalities-1"
+
+    monkeypatch.setattr(
+        "municipalities.app.municipalities_data.publish_municipalities_changes",
+        publish_municipalities_changes,
+    )
+    record = {"eventName": "REMOVE", "dynamodb": {"Keys": {"row_number": {"N": "1"}}}}
+    path = tmp_path / "changes.jsonl"
+    path.write_text(json.dumps(record) + "\n")
+    apply_changes.main([str(path), "--shared-dir", str(tmp_path / "shm")])
+    assert [(str(tmp_path / "shm"), [record])] == calls
+    assert "1 changed rows, published municipalities-1" in capsys.readouterr().out
+
+
+def test_main_2(monkeypatch, tmp_path):
+    """main requires a shared directory"""
+    monkeypatch.delenv("SHARED_TABLE_DIR", raising=False)
+    with pytest.raises(SystemExit):
+        apply_changes.main([str(tmp_path / "changes.jsonl")])
@@ -0,0 +1,99 @@
+import base64
+import json
+from http import HTTPStatus
+
+import pytest
+
+from batch.app import batch_api
+
+
+def make_batch_event(body):
+    return {
+        "httpMethod": "POST",
+        "resource": "/nj/batch",
+        "path": "/nj/batch",
+        "pathParameters": None,
+        "queryStringParameters": None,
+        "headers": {"Content-Type": "application/json"},
+        "body": body if isinstance(body, str) else json.dumps(body),
+    }
+
+
+def test_parse_batch_paths_1():
+    """parse_batch_paths reads the paths list"""
+    paths = ["/nj/counties/34001", "/nj/municipalities/2010?page_size=5"]
+    assert paths == batch_api.parse_batch_paths(make_batch_event({"paths": paths}))
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "",
+        "[",
+        {"path": ["/nj/counties"]},
+        {"paths": "/nj/counties"},
+        {"paths": []},
+        {"paths": [1]},
+        {"paths": ["/nj/counties"] * (batch_api.MAX_BATCH_PATHS + 1)},
+    ],
+)
+def test_parse_batch_paths_2(body):
+    """parse_batch_paths rejects invalid bodies"""
+    assert batch_api.parse_batch_paths(make_batch_event(body)) is None
+
+
+@pytest.mark.parametrize(
+    "body", ["not base64!", base64.b64encode(b"\xff\xfe").decode()]
+)
+def test_parse_batch_paths_3(body):
+    """parse_batch_paths rejects base64 bodies that do not decode"""
+    event = dict(make_batch_event(body), isBase64Encoded=True)
+    assert batch_api.parse_batch_paths(event) is None
+
+
+def test_make_sub_event_1():
+    """make_sub_event finds the handler and the path and query params"""
+    handler, event = batch_api.make_sub_event("nj/municipalities/2010?page_size=5")
+    assert batch_api.municipalities_handler is handler
+    assert "/nj/municipalities/{year}" == event["resource"]
+    assert "/nj/municipalities/2010" == event["path"]
+    assert {"year": "2010"} == event["pathParameters"]
+    assert {"page_size": "5"} == event["queryStringParameters"]
+    handler, event = batch_api.make_sub_event("/nj/municipalities/history/3400100100")
+    assert batch_api.history_handler is handler
+    assert (None, None) == batch_api.make_sub_event("/nj/unknown")
+
+
+def test_batch_handler_1(monkeypatch):
+    """batch_handler returns each result with its own status"""
+
+    def counties_handler(event, context):
+        return {"statusCode": 200, "headers": {}, "body": json.dumps({"data": []})}
+
+    def xref_handler(event, context):
+        return {"statusCode": 404, "headers": {}, "body": json.dumps({"errors": []})}
+
+    routes = dict(batch_api.BATCH_ROUTES)
+    routes["/nj/counties/{GEOID}"] = counties_handler
+    routes["/nj/municipality_xrefs/{year_ref}/{year}"] = xref_handler
+    monkeypatch.setattr(batch_api, "BATCH_ROUTES", routes)
+    paths = ["/nj/counties/34001", "/nj/municipality_xrefs/1999/2010", "/nj/x"]
+    response = batch_api.batch_handler(make_batch_event({"paths": paths}), None)
+    assert HTTPStatus.OK == response["statusCode"]
+    results = json.loads(response["body"])["responses"]
+    assert paths == [result["path"] for result in results]
+    assert [200, 404, 404] == [result["status"] for result in results]
+    assert {"data": []} == results[0]["body"]
+
+
+def test_batch_handler_2():
+    """batch_handler rejects an invalid body"""
+    response = batch_api.batch_handler(make_batch_event("["), None)
+    assert HTTPStatus.BAD_REQUEST == response["statusCode"]
+
+
+def test_batch_handler_3():
+    """batch_handler rejects a body that is not base64"""
+    event = dict(make_batch_event("not base64!"), isBase64Encoded=True)
+    response = batch_api.batch_handler(event, None)
+    assert HTTPStatus.BAD_REQUEST == response["statusCode"]
@@ -0,0 +1,245 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from common_layer.ddblib import ddb_read_stream_records, ddb_stream_records_to_changes
+from tools import bulk_load
+
+
+class FakeDynamoDB:
+    """
+    In-memory stand-in for the DynamoDB client calls used by bulk_load
+
+    Tables are dicts mapping the key value to the item.  The first
+    unprocessed_calls BatchWriteItem calls leave their last request
+    unprocessed, and the first throttled_calls calls fail with a throttling
+    error.
+    """
+
+    def __init__(
+        self, tables, key="row_number", unprocessed_calls=0, throttled_calls=0
+    ):
+        self.tables = tables
+        self.key = key
+        self.unprocessed_calls = unprocessed_calls
+        self.throttled_calls = throttled_calls
+        self.batch_sizes = []
+
+    def scan(self, TableName, Segment=0, TotalSegments=1):
+        items = list(self.tables[TableName].values())
+        return {"Items": items[Segment::TotalSegments]}
+
+    def batch_write_item(self, RequestItems):
+        ((table_name, requests),) = RequestItems.items()
+        self.batch_sizes.append(len(requests))
+        if self.throttled_calls > 0:
+            self.throttled_calls -= 1
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException"}}, "BatchWriteItem"
+            )
+        unprocessed = []
+        if self.unprocessed_calls > 0:
+            self.unprocessed_calls -= 1
+            requests, unprocessed = requests[:-1], requests[-1:]
+        table = self.tables[table_name]
+        for request in requests:
+            if "PutRequest" in request:
+                item = request["PutRequest"]["Item"]
+                table[item[self.key]["N"]] = item
+            else:
+                del table[request["DeleteRequest"]["Key"][self.key]["N"]]
+        return {"UnprocessedItems": {table_name: unprocessed} if unprocessed else {}}
+
+    def update_item(self, TableName, Key, ExpressionAttributeValues, **kwargs):
+        versions = self.tables.setdefault(TableName, {})
+        version = int(versions.get(Key["table_name"]["S"], "0"))
+        version += int(ExpressionAttributeValues[":one"]["N"])
+        versions[Key["table_name"]["S"]] = str(version)
+        return {"Attributes": {"version": {"N": str(version)}}}
+
+
+def item(row_number, GEOID, county):
+    return {
+        "row_number": {"N": str(row_number)},
+        "GEOID": {"S": GEOID},
+        "county": {"S": county},
+    }
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "counties.csv"
+    path.write_text(
+        "row_number,GEOID,county\n"
+        "1,34001,Atlantic County\n"
+        "2,34003,Bergen County\n"
+        "3,34005,Burlington County\n"
+    )
+    return path
+
+
+def test_read_csv_items_1(csv_path):
+    """read_csv_items reads the key as a number and the rest as strings"""
+    items = bulk_load.read_csv_items(csv_path)
+    assert item(1, "34001", "Atlantic County") == items[0]
+    assert 3 == len(items)
+
+
+def test_diff_items_1():
+    """diff_items finds new, changed and removed items"""
+    current = [
+        item(1, "34001", "Atlantic"),
+        item(2, "34003", "Bergen"),
+        item(4, "x", ""),
+    ]
+    new = [
+        item(1, "34001", "Atlantic"),
+        item(2, "34003", "Bergen County"),
+        item(3, "34005", "Burlington"),
+    ]
+    puts, deletes = bulk_load.diff_items(current, new)
+    assert [item(2, "34003", "Bergen County"), item(3, "34005", "Burlington")] == puts
+    assert [{"row_number": {"N": "4"}}] == deletes
+
+
+def test_write_batch_1():
+    """write_batch retries unprocessed items and throttled calls"""
+    delays = []
+    client = FakeDynamoDB({"foo": {}}, unprocessed_calls=2, throttled_calls=1)
+    requests = bulk_load.make_write_requests(
+        [item(1, "a", "A"), item(2, "b", "B"), item(3, "c", "C")], []
+    )
+    assert 4 == bulk_load.write_batch(client, "foo", requests, sleep=delays.append)
+    assert {"1", "2", "3"} == set(client.tables["foo"])
+    assert [3, 3, 1, 1] == client.batch_sizes
+    assert 3 == len(delays)
+
+
+def test_write_batch_2():
+    """write_batch raises RuntimeError when requests remain unprocessed"""
+    delays = []
+    client = FakeDynamoDB({"foo": {}}, throttled_calls=10)
+    requests = bulk_load.make_write_requests([item(1, "a", "A")], [])
+    with pytest.raises(RuntimeError):
+        bulk_load.write_batch(
+            client, "foo", requests, max_attempts=3, sleep=delays.append
+        )
+    assert 3 == len(client.batch_sizes)
+
+
+def test_write_batch_3():
+    """write_batch does not retry other errors"""
+
+    class FailingClient:
+        @staticmethod
+        def batch_write_item(RequestItems):
+            raise ClientError({"Error": {"Code": "ValidationException"}}, "")
+
+    with pytest.raises(ClientError):
+        bulk_load.write_batch(FailingClient(), "foo", [{}], sleep=pytest.fail)
+
+
+def test_backoff_delay_1():
+    """backoff_delay is bounded by the exponential backoff and max_delay"""
+    for attempt in range(10):
+        delay = bulk_load.backoff_delay(attempt, base_delay=0.1, max_delay=1.0)
+        assert 0 <= delay <= min(1.0, 0.1 * 2**attempt)
+
+
+def test_write_requests_1():
+    """write_requests splits requests into batches of BATCH_SIZE"""
+    client = FakeDynamoDB({"foo": {}})
+    puts = [item(row_number, "a", "A") for row_number in range(60)]
+    requests = bulk_load.make_write_requests(puts, [])
+    assert 3 == bulk_load.write_requests(client, "foo", requests, max_workers=3)
+    assert [10, 25, 25] == sorted(client.batch_sizes)
+    assert 60 == len(client.tables["foo"])
+
+
+def test_bulk_load_1(csv_path):
+    """bulk_load writes only the diff, and bumps the version"""
+    client = FakeDynamoDB(
+        {
+            "counties": {
+                "1": item(1, "34001", "Atlantic County"),
+                "2": item(2, "34003", "Bergen"),
+                "9": item(9, "34099", "Nowhere County"),
+            },
+            "versions": {"counties": "4"},
+        },
+        unprocessed_calls=1,
+    )
+    summary = bulk_load.bulk_load(client, "counties", csv_path, "versions")
+    assert {"puts": 2, "deletes": 1, "version": 5} == summary
+    assert bulk_load.read_csv_items(csv_path) == sorted(
+        client.tables["counties"].values(), key=lambda it: int(it["row_number"]["N"])
+    )
+    assert [3, 1] == client.batch_sizes
+
+
+def test_bulk_load_2(csv_path):
+    """bulk_load does not write or bump the version if nothing changed"""
+    items = bulk_load.read_csv_items(csv_path)
+    client = FakeDynamoDB(
+        {
+            "counties": {it["row_number"]["N"]: it for it in items},
+            "versions": {"counties": "4"},
+        }
+    )
+    summary = bulk_load.bulk_load(client, "counties", csv_path, "versions")
+    assert {"puts": 0, "deletes": 0, "version": None} == summary
+    assert [] == client.batch_sizes
+    assert "4" == client.tables["versions"]["counties"]
+
+
+def test_bulk_load_3(csv_path):
+    """bulk_load with dry_run reports the diff without writing"""
+    client = FakeDynamoDB({"counties": {}})
+    summary = bulk_load.bulk_load(client, "counties", csv_path, dry_run=True)
+    assert {"puts": 3, "deletes": 0, "version": None} == summary
+    assert {} == client.tables["counties"]
+
+
+def test_bulk_load_4(tmp_path, csv_path):
+    """bulk_load with changes_path saves the changes written as stream records"""
+    client = FakeDynamoDB(
+        {
+            "counties": {
+                "1": item(1, "34001", "Atlantic County"),
+                "2": item(2, "34003", "Bergen"),
+                "9": item(9, "34099", "Nowhere County"),
+            },
+        }
+    )
+    changes_path = tmp_path / "changes.jsonl"
+    bulk_load.bulk_load(client, "counties", csv_path, changes_path=changes_path)
+    records = ddb_read_stream_records(changes_path)
+    assert ["MODIFY", "INSERT", "REMOVE"] == [record["eventName"] for record in records]
+    assert {
+        2: item(2, "34003", "Bergen County"),
+        3: item(3, "34005", "Burlington County"),
+        9: None,
+    } == ddb_stream_records_to_changes(records)
+
+
+def test_main_1(monkeypatch, csv_path, capsys):
+    """main loads into the client for the endpoint url"""
+    client = FakeDynamoDB({"counties": {}})
+    endpoints = []
+
+    def mock_client(service, endpoint_url=None):
+        endpoints.append(endpoint_url)
+        return client
+
+    monkeypatch.setattr(bulk_load.boto3, "client", mock_client)
+    bulk_load.main(
+        [
+            str(csv_path),
+            "--table",
+            "counties",
+            "--endpoint-url",
+            "http://localhost:8000",
+        ]
+    )
+    assert ["http://localhost:8000"] == endpoints
+    assert 3 == len(client.tables["counties"])
+    assert "counties: 3 puts, 0 deletes" in capsys.readouterr().out
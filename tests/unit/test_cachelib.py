@@ -0,0 +1,242 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from common_layer import cachelib
+
+
+def run_threads(target, count):
+    """Runs target in count threads at once, and returns their results"""
+    results = [None] * count
+    barrier = threading.Barrier(count, timeout=5)
+
+    def run(i):
+        barrier.wait()
+        results[i] = target()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_get_1():
+    """get builds once for concurrent callers"""
+    cache = cachelib.TableCache()
+    calls = []
+
+    def builder():
+        calls.append(1)
+        time.sleep(0.1)
+        return object()
+
+    results = run_threads(lambda: cache.get("a", builder), 8)
+    assert 1 == len(calls)
+    assert all(result is results[0] for result in results)
+    assert cache.get("a", builder) is results[0]
+    assert 1 == len(calls)
+
+
+def test_get_2():
+    """get does not block other keys while building"""
+    cache = cachelib.TableCache()
+    b_built = threading.Event()
+
+    def builder_a():
+        assert b_built.wait(timeout=5)
+        return "a"
+
+    def builder_b():
+        b_built.set()
+        return "b"
+
+    thread = threading.Thread(target=cache.get, args=("a", builder_a))
+    thread.start()
+    assert "b" == cache.get("b", builder_b)
+    thread.join()
+    assert "a" == cache.peek("a")
+
+
+def test_get_3():
+    """get raises builder exceptions, and does not cache them"""
+    cache = cachelib.TableCache()
+
+    def builder():
+        raise ValueError("scan failed")
+
+    with pytest.raises(ValueError):
+        cache.get("a", builder)
+    assert cache.peek("a") is None
+    assert "a" == cache.get("a", lambda: "a")
+
+
+def test_get_async_1():
+    """get_async builds once for concurrent tasks"""
+    cache = cachelib.TableCache()
+    calls = []
+
+    def builder():
+        calls.append(1)
+        time.sleep(0.1)
+        return "a"
+
+    async def main():
+        return await asyncio.gather(*(cache.get_async("a", builder) for _ in range(4)))
+
+    assert ["a"] * 4 == asyncio.run(main())
+    assert 1 == len(calls)
+
+
+def test_refresh_1():
+    """refresh serves the old value until the new one is swapped in"""
+    cache = cachelib.TableCache()
+    cache.set("a", "old")
+    building = threading.Event()
+    release = threading.Event()
+
+    def builder():
+        building.set()
+        assert release.wait(timeout=5)
+        return "new"
+
+    thread = threading.Thread(target=cache.refresh, args=("a", builder))
+    thread.start()
+    assert building.wait(timeout=5)
+    assert "old" == cache.get("a", lambda: "unused")
+    release.set()
+    thread.join()
+    assert "new" == cache.get("a", lambda: "unused")
+
+
+def test_refresh_2():
+    """refresh keeps the old value if the build fails"""
+    cache = cachelib.TableCache()
+    cache.set("a", "old")
+
+    def builder():
+        raise ValueError("scan failed")
+
+    with pytest.raises(ValueError):
+        cache.refresh("a", builder)
+    assert "old" == cache.peek("a")
+
+
+def test_invalidate_1():
+    """invalidate drops one key, or every key"""
+    cache = cachelib.TableCache()
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate("a")
+    assert cache.peek("a") is None
+    assert 2 == cache.peek("b")
+    cache.invalidate("missing")
+    cache.invalidate()
+    assert cache.peek("b") is None
+    assert 3 == cache.get("b", lambda: 3)
+
+
+def test_refresh_if_stale_1():
+    """refresh_if_stale rebuilds only when the version has changed"""
+    cache = cachelib.TableCache()
+    version = {"current": 1}
+    builds = []
+
+    def builder():
+        builds.append(version["current"])
+        return {"data_version": version["current"]}
+
+    assert not cache.refresh_if_stale("a", builder, lambda: version["current"], 0)
+    cache.get("a", builder)
+    assert not cache.refresh_if_stale("a", builder, lambda: version["current"], 0)
+    version["current"] = 2
+    assert cache.refresh_if_stale("a", builder, lambda: version["current"], 0)
+    assert {"data_version": 2} == cache.peek("a")
+    assert [1, 2] == builds
+
+
+def test_refresh_if_stale_2():
+    """refresh_if_stale checks at most once per interval"""
+    cache = cachelib.TableCache()
+    cache.set("a", {"data_version": 1})
+    checks = []
+
+    def get_version():
+        checks.append(time.monotonic())
+        return 1
+
+    assert not cache.refresh_if_stale("a", lambda: None, get_version, 60)
+    assert not cache.refresh_if_stale("a", lambda: None, get_version, 60)
+    assert 1 == len(checks)
+
+
+def test_request_coalescer_1():
+    """RequestCoalescer runs once for concurrent calls with the same key"""
+    coalescer = cachelib.RequestCoalescer()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.1)
+        return object()
+
+    results = run_threads(lambda: coalescer.run("a", fn), 8)
+    assert 1 == len(calls)
+    assert all(result is results[0][0] for result, _ in results)
+    assert 7 == sum(shared for _, shared in results)
+    assert {"leaders": 1, "followers": 7, "coalesced_share": 7 / 8} == (
+        coalescer.stats()
+    )
+    assert (results[0][0], False) != coalescer.run("a", fn)
+    assert 2 == len(calls)
+
+
+def test_request_coalescer_2():
+    """RequestCoalescer shares exceptions, and does not coalesce other keys"""
+    coalescer = cachelib.RequestCoalescer()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        assert release.wait(timeout=5)
+        raise ValueError("failed")
+
+    errors = []
+
+    def run():
+        try:
+            coalescer.run("a", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=run)
+    leader.start()
+    assert started.wait(timeout=5)
+    follower = threading.Thread(target=run)
+    follower.start()
+    assert ("b", False) == coalescer.run("b", lambda: "b")
+    while coalescer.stats()["followers"] < 1:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert 2 == len(errors)
+    assert {"leaders": 2, "followers": 1} == {
+        key: value
+        for key, value in coalescer.stats().items()
+        if key != "coalesced_share"
+    }
+
+
+def test_lru_cache_1():
+    """LRUCache evicts the least recently used values beyond max_entries"""
+    cache = cachelib.LRUCache(2, [("a", 1), ("b", 2)])
+    assert 1 == cache.get("a")
+    cache["c"] = 3
+    assert 2 == len(cache)
+    assert cache.get("b") is None
+    assert [("a", 1), ("c", 3)] == cache.items()
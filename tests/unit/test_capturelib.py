@@ -0,0 +1,77 @@
+import json
+
+from common_layer import capturelib
+
+
+def make_event():
+    return {
+        "httpMethod": "GET",
+        "resource": "/nj/municipalities/{year}",
+        "path": "/nj/municipalities/2010",
+        "pathParameters": {"year": "2010"},
+        "queryStringParameters": {
+            "page_size": "50",
+            "filter[county]": "Atlantic County",
+            "api_key": "secret",
+        },
+        "headers": {"Accept": "text/csv", "X-Forwarded-For": "10.0.0.1"},
+        "requestContext": {"identity": {"sourceIp": "10.0.0.1"}},
+    }
+
+
+def test_normalize_event_1():
+    """normalize_event keeps only known query params and the Accept header"""
+    assert {
+        "httpMethod": "GET",
+        "resource": "/nj/municipalities/{year}",
+        "path": "/nj/municipalities/2010",
+        "pathParameters": {"year": "2010"},
+        "queryStringParameters": {
+            "page_size": "50",
+            "filter[county]": "Atlantic County",
+        },
+        "headers": {"accept": "text/csv"},
+    } == capturelib.normalize_event(make_event())
+
+
+def test_normalize_event_2():
+    """normalize_event with no query params or headers"""
+    event = {"path": "/nj/counties", "queryStringParameters": {"api_key": "x"}}
+    normalized = capturelib.normalize_event(event)
+    assert normalized["queryStringParameters"] is None
+    assert {} == normalized["headers"]
+    assert "GET" == normalized["httpMethod"]
+
+
+def test_traffic_captured_1(monkeypatch, capsys):
+    """traffic_captured logs sampled invocations only"""
+
+    @capturelib.traffic_captured("foo_handler")
+    def foo_handler(event, context):
+        return {"statusCode": 404}
+
+    monkeypatch.setattr(capturelib, "_warm", False)
+    monkeypatch.delenv("CAPTURE_SAMPLE_RATE", raising=False)
+    assert {"statusCode": 404} == foo_handler(make_event(), None)
+    assert "" == capsys.readouterr().out
+    monkeypatch.setenv("CAPTURE_SAMPLE_RATE", "1")
+    assert {"statusCode": 404} == foo_handler(make_event(), None)
+    record = json.loads(capsys.readouterr().out)
+    assert "foo_handler" == record["capture"]
+    assert 404 == record["status"]
+    assert record["duration_ms"] >= 0
+    assert not record["cold"]
+    assert capturelib.normalize_event(make_event()) == record["event"]
+
+
+def test_read_captures_1():
+    """read_captures skips other log lines, and reads prefixed records"""
+    record = {"capture": "foo_handler", "event": {"path": "/nj/counties"}}
+    lines = [
+        "START RequestId: 1234",
+        json.dumps({"memory_profile": "foo_handler"}),
+        "2025-01-01T00:00:00Z\t" + json.dumps(record),
+        "{not json",
+        json.dumps(record) + "\n",
+    ]
+    assert [record, record] == capturelib.read_captures(lines)
@@ -4,7 +4,7 @@ from http import HTTPStatus
 import pandas as pd
 import pytest
 
-from counties.app import counties_api
+from counties.app import counties_api, counties_data
 
 
 # This is an API gateway event for the counties API. We will use variations
@@ -125,12 +125,13 @@ def counties_table():
 def counties_table_backend(monkeypatch, counties_table):
     """ "A counties table as a dataframe"""
 
-    def mock_build_counties_table(table_name):
+    def mock_build_counties_table(table_name, total_segments=1):
         return counties_table
 
     monkeypatch.setattr(
         "counties.app.counties_data.build_counties_table", mock_build_counties_table
     )
+    counties_data.invalidate_counties_table()
 
 
 def test_counties_handler_1(
@@ -174,6 +175,79 @@ def test_counties_handler_3(apigw_event_get_non_county, counties_table_backend):
     assert ret["statusCode"] == 404
 
 
+def test_counties_handler_4(
+    apigw_event_get_counties, counties_table, counties_table_backend
+):
+    """counties_handler meta only"""
+    apigw_event_get_counties["queryStringParameters"] = {"meta_only": "true"}
+    ret = counties_api.counties_handler(apigw_event_get_counties, "")
+    body = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert "ETag" in ret["headers"]
+    assert "data" not in body
+    assert "links" in body
+    assert body["meta"]["record_count"] == len(counties_table)
+
+
+def test_counties_handler_5(
+    apigw_event_get_counties, counties_table, counties_table_backend
+):
+    """counties_handler HEAD request"""
+    apigw_event_get_counties["httpMethod"] = "HEAD"
+    ret = counties_api.counties_handler(apigw_event_get_counties, "")
+
+    assert ret["statusCode"] == 200
+    assert ret["body"] == ""
+    assert ret["headers"]["X-Record-Count"] == str(len(counties_table))
+
+
+def test_counties_handler_6(
+    apigw_event_get_counties, counties_table, counties_table_backend
+):
+    """counties_handler CSV result"""
+    apigw_event_get_counties["headers"]["Accept"] = "text/csv"
+    ret = counties_api.counties_handler(apigw_event_get_counties, "")
+
+    assert ret["statusCode"] == 200
+    assert ret["headers"]["Content-Type"] == "text/csv"
+    assert "Link" in ret["headers"]
+    assert ret["body"].splitlines()[:2] == ["GEOID,county", "34001,Atlantic County"]
+
+
+def test_counties_handler_7(apigw_event_get_county, monkeypatch):
+    """counties_handler rejects a malformed GEOID without loading the table"""
+
+    def mock_build_counties_table(table_name, total_segments=1):
+        raise AssertionError("table loaded")
+
+    monkeypatch.setattr(
+        "counties.app.counties_data.build_counties_table", mock_build_counties_table
+    )
+    counties_data.invalidate_counties_table()
+    apigw_event_get_county["pathParameters"] = {"GEOID": "34005x"}
+    ret = counties_api.counties_handler(apigw_event_get_county, "")
+
+    assert ret["statusCode"] == HTTPStatus.BAD_REQUEST
+
+
+def test_prewarm_counties_1(counties_table, counties_table_backend):
+    """prewarm_counties prerenders the counties list, which the handler returns"""
+    counties_api.prewarm_counties()
+    event = counties_api.make_prewarm_event("/nj/counties")
+    rendered = counties_data.get_counties_indexes()["rendered"]
+    assert list(rendered) == [counties_api.make_render_key(event)]
+
+    ret = counties_api.counties_handler(event, "")
+    assert ret["statusCode"] == 200
+    assert ret == rendered[counties_api.make_render_key(event)]
+    assert len(json.loads(ret["body"])["data"]) == len(counties_table)
+    ret["headers"]["Access-Control-Allow-Origin"] = "*"
+    assert "Access-Control-Allow-Origin" not in (
+        rendered[counties_api.make_render_key(event)]["headers"]
+    )
+
+
 def test_return_counties_table_1(counties_table):
     """return_counties_table basic test"""
     aux = {}
@@ -246,3 +320,62 @@ def test_process_counties_params_4(apigw_event_bad_pagination):
     )
     assert HTTPStatus.BAD_REQUEST == status
     assert message is not None
+
+
+def test_process_counties_params_5(apigw_event_get_counties_base):
+    """process_counties_params with meta_only param"""
+    apigw_event_get_counties_base["queryStringParameters"] = {"meta_only": "true"}
+    status, message, params = counties_api.process_counties_params(
+        apigw_event_get_counties_base
+    )
+    assert HTTPStatus.OK == status
+    assert message is None
+    assert {"page_size": 100, "meta_only": True} == params
+
+
+def test_process_counties_params_6(apigw_event_get_counties_base):
+    """process_counties_params with invalid meta_only param"""
+    apigw_event_get_counties_base["queryStringParameters"] = {"meta_only": "maybe"}
+    status, message, params = counties_api.process_counties_params(
+        apigw_event_get_counties_base
+    )
+    assert HTTPStatus.BAD_REQUEST == status
+    assert message is not None
+
+
+def test_make_counties_key_1(apigw_event_get_counties_base):
+    """make_counties_key ignores unknown query params, and is None if invalid"""
+    key = counties_api.make_counties_key(apigw_event_get_counties_base)
+    apigw_event_get_counties_base["queryStringParameters"] = {
+        "page_size": "100",
+        "cachebuster": "1",
+    }
+    assert key == counties_api.make_counties_key(apigw_event_get_counties_base)
+    apigw_event_get_counties_base["queryStringParameters"] = {"page_size": "10"}
+    assert key != counties_api.make_counties_key(apigw_event_get_counties_base)
+    apigw_event_get_counties_base["queryStringParameters"] = {"page_size": "x"}
+    assert counties_api.make_counties_key(apigw_event_get_counties_base) is None
+
+
+def test_counties_handler_params_1(
+    apigw_event_get_counties, counties_table_backend, monkeypatch
+):
+    """counties_handler processes the params of an event once, for keys and handler"""
+    monkeypatch.setenv("RESPONSE_CACHE", "memory")
+    monkeypatch.setenv("RESPONSE_CACHE_TTL_SECONDS", "64")
+    monkeypatch.setattr(counties_data, "get_counties_version", lambda: 1)
+    calls = []
+
+    def get_page_parameters(query_parameters):
+        calls.append(query_parameters)
+        return torguapi_get_page_parameters(query_parameters)
+
+    torguapi_get_page_parameters = counties_api.torguapi_get_page_parameters
+    monkeypatch.setattr(
+        counties_api, "torguapi_get_page_parameters", get_page_parameters
+    )
+    ret = counties_api.counties_handler(apigw_event_get_counties, "")
+    assert HTTPStatus.OK == ret["statusCode"]
+    assert 1 == len(calls)
+    assert ret == counties_api.counties_handler(apigw_event_get_counties, "")
+    assert 2 == len(calls)
@@ -1,7 +1,12 @@
+import time
+
 import boto3
+import numpy as np
 import pandas as pd
 import pytest
 
+from common_layer import shmlib
+from common_layer.responselib import table_version
 from counties.app import counties_data
 
 
@@ -74,7 +79,7 @@ def test_build_counties_table_1(boto_client_scan_mock):
     )
     expected = pd.DataFrame(
         {
-            "row_number": [1, 2],
+            "row_number": np.array([1, 2], dtype=np.int32),
             "GEOID": ["12345", "54321"],
             "county": ["Foo County", "Bar County"],
             "flag": [True, False],
@@ -105,7 +110,7 @@ def test_build_counties_table_2(boto_client_scan_mock):
     )
     expected = pd.DataFrame(
         {
-            "row_number": [1, 2],
+            "row_number": np.array([1, 2], dtype=np.int32),
             "GEOID": ["12345", "54321"],
             "county": ["Foo County", None],
             "county_2": [None, "Bar County"],
@@ -144,23 +149,122 @@ def test_get_counties_table_1():
             ]
         }
     )
-    counties_data.counties_table = tbl
+    counties_data.counties_cache.set(
+        counties_data.TABLE_KEY, {"table": tbl, "indexes": {}}
+    )
     result = counties_data.get_counties_table()
     pd.testing.assert_frame_equal(tbl, result)
 
 
 def test_get_counties_table_2(monkeypatch, table_name_mock):
     """get_counties_table fetches table by name"""
-    counties_data.counties_table = None
+    counties_data.invalidate_counties_table()
     monkeypatch.setenv("TABLE_COUNTIES", "counties_table")
     result = counties_data.get_counties_table()
-    expected = pd.DataFrame({"row_number": [1], "GEOID": ["12345"]})
+    expected = pd.DataFrame(
+        {"row_number": np.array([1], dtype=np.int32), "GEOID": ["12345"]}
+    )
     pd.testing.assert_frame_equal(expected, result)
 
 
 def test_get_counties_table_3(monkeypatch, table_name_mock):
     """get_counties_table throws exception on name mismatch"""
-    counties_data.counties_table = None
+    counties_data.invalidate_counties_table()
     monkeypatch.setenv("TABLE_COUNTIES", "counties_table_wrong")
     with pytest.raises(Exception):
         counties_data.get_counties_table()
+
+
+def test_get_counties_indexes_1(monkeypatch, table_name_mock):
+    """get_counties_indexes returns the indexes built when the table loads"""
+    counties_data.invalidate_counties_table()
+    monkeypatch.setenv("TABLE_COUNTIES", "counties_table")
+    tbl = counties_data.get_counties_table()
+    indexes = counties_data.counties_cache.peek(counties_data.TABLE_KEY)["indexes"]
+    assert indexes is not None
+    assert counties_data.get_counties_indexes() is indexes
+    assert counties_data.get_counties_table() is tbl
+    assert isinstance(indexes["version"], str)
+    assert indexes["footprint"]["total"] > 0
+
+
+def test_get_counties_snapshot_1(monkeypatch, table_name_mock):
+    """get_counties_snapshot returns the table with the indexes built from it"""
+    counties_data.invalidate_counties_table()
+    monkeypatch.setenv("TABLE_COUNTIES", "counties_table")
+    snapshot = counties_data.get_counties_snapshot()
+    assert counties_data.get_counties_table() is snapshot["table"]
+    assert counties_data.get_counties_indexes() is snapshot["indexes"]
+    assert snapshot["indexes"]["version"] == table_version(snapshot["table"])
+
+
+def test_get_counties_table_4(monkeypatch):
+    """get_counties_table reloads the table when its version marker changes"""
+    versions = {"counties_table": "1"}
+    scans = []
+
+    class MockClient:
+        @staticmethod
+        def scan(TableName):
+            scans.append(TableName)
+            return {"Items": [{"row_number": {"N": "1"}, "GEOID": {"S": "12345"}}]}
+
+        @staticmethod
+        def get_item(TableName, Key):
+            assert "versions_table" == TableName
+            version = versions[Key["table_name"]["S"]]
+            return {"Item": {"version": {"N": version}}}
+
+    monkeypatch.setattr(boto3, "client", lambda *args, **kwargs: MockClient())
+    monkeypatch.setenv("TABLE_COUNTIES", "counties_table")
+    monkeypatch.setenv("TABLE_VERSIONS", "versions_table")
+    monkeypatch.setenv("VERSION_CHECK_SECONDS", "0.001")
+    counties_data.invalidate_counties_table()
+    tbl = counties_data.get_counties_table()
+    assert (
+        1 == counties_data.counties_cache.peek(counties_data.TABLE_KEY)["data_version"]
+    )
+    time.sleep(0.01)
+    assert counties_data.get_counties_table() is tbl
+    versions["counties_table"] = "2"
+    time.sleep(0.01)
+    assert counties_data.get_counties_table() is not tbl
+    assert 2 == len(scans)
+    counties_data.invalidate_counties_table()
+
+
+def test_publish_counties_table_1(monkeypatch, tmp_path, table_name_mock):
+    """Workers attach to the published table and switch to new versions"""
+    monkeypatch.setenv("TABLE_COUNTIES", "counties_table")
+    version = counties_data.publish_counties_table(tmp_path)
+    monkeypatch.setattr(boto3, "client", lambda *args: pytest.fail("scanned"))
+    monkeypatch.setenv("SHARED_TABLE_DIR", str(tmp_path))
+    monkeypatch.setenv("VERSION_CHECK_SECONDS", "0.001")
+    counties_data.invalidate_counties_table()
+    tbl = counties_data.get_counties_table()
+    assert ["12345"] == list(tbl["GEOID"])
+    assert (
+        version
+        == counties_data.counties_cache.peek(counties_data.TABLE_KEY)["data_version"]
+    )
+
+    new_version = shmlib.publish_table(tbl.assign(GEOID="54321"), tmp_path, "counties")
+    time.sleep(0.01)
+    assert ["54321"] == list(counties_data.get_counties_table()["GEOID"])
+    assert new_version == counties_data.get_counties_version()
+    counties_data.invalidate_counties_table()
+
+
+def test_get_counties_data_version_1(monkeypatch, tmp_path, table_name_mock):
+    """get_counties_data_version reads the marker only if nothing is cached"""
+    monkeypatch.setenv("TABLE_COUNTIES", "counties_table")
+    version = counties_data.publish_counties_table(tmp_path)
+    monkeypatch.setenv("SHARED_TABLE_DIR", str(tmp_path))
+    monkeypatch.delenv("VERSION_CHECK_SECONDS", raising=False)
+    counties_data.invalidate_counties_table()
+    assert version == counties_data.get_counties_data_version()
+    assert counties_data.counties_cache.peek(counties_data.TABLE_KEY) is None
+    counties_data.get_counties_table()
+    shmlib.publish_table(pd.DataFrame({"GEOID": ["54321"]}), tmp_path, "counties")
+    assert version == counties_data.get_counties_data_version()
+    counties_data.invalidate_counties_table()
@@ -61,6 +61,26 @@ def test_get_counties_4(counties_table):
         counties_lib.handle_get_counties(counties_table, params)
 
 
+def test_get_counties_5(counties_table):
+    """get_counties meta only"""
+    params = {"page_size": 5, "page_number": 3, "meta_only": True}
+    result_set, aux = counties_lib.handle_get_counties(counties_table, params)
+    assert result_set is None
+    expected_aux = {
+        "page_size": 5,
+        "page_number": 3,
+        "record_count": len(counties_table),
+    }
+    assert expected_aux == aux
+
+
+def test_get_counties_6(counties_table):
+    """get_counties meta only out-of-range pagination"""
+    params = {"page_size": 5, "page_number": 4, "meta_only": True}
+    with pytest.raises(counties_lib.CountiesNotFoundError):
+        counties_lib.handle_get_counties(counties_table, params)
+
+
 def test_get_county_1(counties_table):
     """ "get_county basic test"""
     params = {"GEOID": "10005"}
@@ -103,3 +103,136 @@ def test_itemlist_to_pd_1(ddb_itemlist):
         }
     )
     pd.testing.assert_frame_equal(expected, tbl)
+
+
+class PagedScanClient:
+    """Mock client whose scan returns each segment in pages of one item"""
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.calls = []
+
+    def scan(self, TableName, Segment=0, TotalSegments=1, ExclusiveStartKey=None):
+        self.calls.append((TableName, Segment, TotalSegments, ExclusiveStartKey))
+        items = self.segments[Segment]
+        position = 0 if ExclusiveStartKey is None else ExclusiveStartKey["position"] + 1
+        data = {"Items": items[position : position + 1]}
+        if position + 1 < len(items):
+            data["LastEvaluatedKey"] = {"position": position}
+        return data
+
+
+def test_ddb_scan_segment_1():
+    """ "ddb_scan_segment follows LastEvaluatedKey"""
+    client = PagedScanClient([[{"a": 1}, {"a": 2}, {"a": 3}]])
+    items = ddblib.ddb_scan_segment(client, "foo")
+    assert [{"a": 1}, {"a": 2}, {"a": 3}] == items
+    assert [
+        ("foo", 0, 1, None),
+        ("foo", 0, 1, {"position": 0}),
+        ("foo", 0, 1, {"position": 1}),
+    ] == client.calls
+
+
+def test_ddb_scan_items_1():
+    """ "ddb_scan_items scans every segment, and returns items in segment order"""
+    client = PagedScanClient([[{"a": 1}, {"a": 2}], [], [{"a": 3}]])
+    items = ddblib.ddb_scan_items(client, "foo", 3)
+    assert [{"a": 1}, {"a": 2}, {"a": 3}] == items
+    assert {0, 1, 2} == {segment for _, segment, _, _ in client.calls}
+    assert all(total_segments == 3 for _, _, total_segments, _ in client.calls)
+
+
+def test_ddb_scan_items_2():
+    """ "ddb_scan_items with one segment makes a plain scan"""
+    client = PagedScanClient([[{"a": 1}]])
+    assert [{"a": 1}] == ddblib.ddb_scan_items(client, "foo")
+    assert [("foo", 0, 1, None)] == client.calls
+
+
+def test_pd_to_ddb_itemlist_1():
+    """pd_to_ddb_itemlist is the inverse of ddb_itemlist_to_pd"""
+    tbl = pd.DataFrame({"row_number": [1, 2], "GEOID": ["12345", "67890"]})
+    items = ddblib.pd_to_ddb_itemlist(tbl)
+    assert [
+        {"row_number": {"N": "1"}, "GEOID": {"S": "12345"}},
+        {"row_number": {"N": "2"}, "GEOID": {"S": "67890"}},
+    ] == items
+    pd.testing.assert_frame_equal(tbl, ddblib.ddb_itemlist_to_pd(items, ["row_number"]))
+
+
+class VersionsClient:
+    """Mock client for a versions table"""
+
+    def __init__(self, versions):
+        self.versions = versions
+
+    def get_item(self, TableName, Key):
+        version = self.versions.get(Key["table_name"]["S"], None)
+        if version is None:
+            return {}
+        return {"Item": {"table_name": Key["table_name"], "version": {"N": version}}}
+
+    def update_item(self, TableName, Key, ExpressionAttributeValues, **kwargs):
+        version = int(self.versions.get(Key["table_name"]["S"], "0"))
+        version += int(ExpressionAttributeValues[":one"]["N"])
+        self.versions[Key["table_name"]["S"]] = str(version)
+        return {"Attributes": {"version": {"N": str(version)}}}
+
+
+def test_ddb_get_version_1():
+    """ddb_get_version returns the version, or 0 for an unversioned table"""
+    client = VersionsClient({"foo": "3"})
+    assert 3 == ddblib.ddb_get_version(client, "versions", "foo")
+    assert 0 == ddblib.ddb_get_version(client, "versions", "bar")
+
+
+def test_ddb_bump_version_1():
+    """ddb_bump_version increments the version and returns it"""
+    client = VersionsClient({"foo": "3"})
+    assert 4 == ddblib.ddb_bump_version(client, "versions", "foo")
+    assert 1 == ddblib.ddb_bump_version(client, "versions", "bar")
+    assert 4 == ddblib.ddb_get_version(client, "versions", "foo")
+
+
+def test_ddb_stream_records_to_changes_1():
+    """ddb_stream_records_to_changes keeps the last change for each key"""
+    records = [
+        {
+            "eventName": "INSERT",
+            "dynamodb": {
+                "Keys": {"row_number": {"N": "1"}},
+                "NewImage": {"a": {"S": "x"}},
+            },
+        },
+        {
+            "eventName": "MODIFY",
+            "dynamodb": {
+                "Keys": {"row_number": {"N": "1"}},
+                "NewImage": {"a": {"S": "y"}},
+            },
+        },
+        {"eventName": "REMOVE", "dynamodb": {"Keys": {"row_number": {"N": "2"}}}},
+    ]
+    changes = ddblib.ddb_stream_records_to_changes(records)
+    assert {1: {"a": {"S": "y"}}, 2: None} == changes
+    with pytest.raises(ValueError):
+        ddblib.ddb_stream_records_to_changes(
+            [
+                {
+                    "eventName": "TRUNCATE",
+                    "dynamodb": {"Keys": {"row_number": {"N": "1"}}},
+                }
+            ]
+        )
+
+
+def test_ddb_read_stream_records_1(tmp_path):
+    """ddb_read_stream_records reads one record per line"""
+    path = tmp_path / "changes.jsonl"
+    path.write_text(
+        '{"eventName": "REMOVE", "dynamodb": {"Keys": {"row_number": {"N": "2"}}}}\n\n'
+    )
+    assert [
+        {"eventName": "REMOVE", "dynamodb": {"Keys": {"row_number": {"N": "2"}}}}
+    ] == ddblib.ddb_read_stream_records(path)
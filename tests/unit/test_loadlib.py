@@ -0,0 +1,33 @@
+import asyncio
+import threading
+
+import pytest
+
+from common_layer import loadlib
+
+
+def test_load_all_1():
+    """load_all runs loaders concurrently"""
+    barrier = threading.Barrier(2, timeout=5)
+
+    def loader(name):
+        def _loader():
+            barrier.wait()
+            return name
+
+        return _loader
+
+    result = asyncio.run(
+        loadlib.load_all({"a": loader("table a"), "b": loader("table b")})
+    )
+    assert {"a": "table a", "b": "table b"} == result
+
+
+def test_load_all_2():
+    """load_all raises loader exceptions"""
+
+    def loader():
+        raise KeyError("GEOID")
+
+    with pytest.raises(KeyError):
+        asyncio.run(loadlib.load_all({"a": loader}))
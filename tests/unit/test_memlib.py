@@ -0,0 +1,118 @@
+import json
+import threading
+import tracemalloc
+
+from common_layer import memlib
+
+
+def allocate(size):
+    return [bytearray(1000) for _ in range(size)]
+
+
+def read_records(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_memory_sampled_1(monkeypatch, capsys):
+    """memory_sampled does not profile calls with the default rate"""
+    monkeypatch.delenv("MEMORY_SAMPLE_RATE", raising=False)
+    assert 10 == len(memlib.memory_sampled("phase")(allocate)(10))
+    assert [] == read_records(capsys)
+    assert not tracemalloc.is_tracing()
+
+
+def test_memory_sampled_2(monkeypatch, capsys):
+    """memory_sampled logs allocations and top allocation sites"""
+    monkeypatch.setenv("MEMORY_SAMPLE_RATE", "1")
+    monkeypatch.setenv("MEMORY_SAMPLE_TOP", "3")
+    kept = memlib.memory_sampled("phase")(allocate)(1000)
+    (record,) = read_records(capsys)
+    assert "phase" == record["memory_profile"]
+    assert record["allocated_bytes"] >= 1000 * 1000
+    assert record["peak_traced_bytes"] >= record["allocated_bytes"]
+    assert record["peak_rss_bytes"] > 0
+    assert len(record["top"]) <= 3
+    assert record["top"][0]["site"].startswith(__file__)
+    assert not tracemalloc.is_tracing()
+    assert 1000 == len(kept)
+
+
+def test_memory_sampled_3(monkeypatch, capsys):
+    """memory_sampled profiles nested calls, and the outer peak includes them"""
+    monkeypatch.setenv("MEMORY_SAMPLE_RATE", "1")
+
+    @memlib.memory_sampled("inner")
+    def inner():
+        allocate(1000)
+
+    @memlib.memory_sampled("outer")
+    def outer():
+        monkeypatch.setenv("MEMORY_SAMPLE_RATE", "0")
+        inner()
+
+    outer()
+    inner_record, outer_record = read_records(capsys)
+    assert "inner" == inner_record["memory_profile"]
+    assert "outer" == outer_record["memory_profile"]
+    assert inner_record["peak_traced_bytes"] >= 1000 * 1000
+    assert outer_record["peak_traced_bytes"] >= inner_record["peak_traced_bytes"]
+    assert not tracemalloc.is_tracing()
+
+
+def test_memory_sampled_4(monkeypatch, capsys):
+    """memory_sampled logs and stops tracing when the call raises"""
+    monkeypatch.setenv("MEMORY_SAMPLE_RATE", "1")
+
+    @memlib.memory_sampled("failing")
+    def failing():
+        raise ValueError("failed")
+
+    try:
+        failing()
+    except ValueError:
+        pass
+    assert ["failing"] == [r["memory_profile"] for r in read_records(capsys)]
+    assert not tracemalloc.is_tracing()
+
+
+def test_memory_sampled_5(monkeypatch, capsys):
+    """memory_sampled keeps tracing until overlapping calls in other threads return"""
+    monkeypatch.setenv("MEMORY_SAMPLE_RATE", "1")
+    started = threading.Event()
+    released = threading.Event()
+
+    @memlib.memory_sampled("first")
+    def first():
+        started.wait(5)
+
+    @memlib.memory_sampled("second")
+    def second():
+        started.set()
+        released.wait(5)
+        return allocate(1000)
+
+    results = []
+    first_thread = threading.Thread(target=first)
+    second_thread = threading.Thread(target=lambda: results.append(second()))
+    first_thread.start()
+    second_thread.start()
+    first_thread.join()
+    assert tracemalloc.is_tracing()
+    released.set()
+    second_thread.join()
+    assert 1000 == len(results[0])
+    assert ["first", "second"] == [r["memory_profile"] for r in read_records(capsys)]
+    assert not tracemalloc.is_tracing()
+
+
+def test_memory_sampled_6(monkeypatch, capsys):
+    """memory_sampled logs a failure to profile and returns the result"""
+    monkeypatch.setenv("MEMORY_SAMPLE_RATE", "1")
+
+    def fail(*args):
+        raise RuntimeError("failed")
+
+    monkeypatch.setattr(memlib, "top_allocation_sites", fail)
+    assert 10 == len(memlib.memory_sampled("phase")(allocate)(10))
+    assert "RuntimeError: failed" in capsys.readouterr().err
+    assert not tracemalloc.is_tracing()
@@ -4,7 +4,7 @@ from http import HTTPStatus
 import pandas as pd
 import pytest
 
-from municipalities.app import municipalities_api
+from municipalities.app import municipalities_api, municipalities_data
 
 
 @pytest.fixture()
@@ -113,13 +113,14 @@ def municipalities_table():
 def municipalities_table_backend(monkeypatch, municipalities_table):
     """ "A municipalities table as a dataframe"""
 
-    def mock_build_municipalities_table(table_name):
+    def mock_build_municipalities_table(table_name, total_segments=1):
         return municipalities_table
 
     monkeypatch.setattr(
         "municipalities.app.municipalities_data.build_municipalities_table",
         mock_build_municipalities_table,
     )
+    municipalities_data.invalidate_municipalities_table()
 
 
 def test_municipality_handler_1(
@@ -246,6 +247,173 @@ def test_xref_handler_1(apigw_event_get_xrefs, municipalities_table_backend):
     assert meta["record_count"] == 3
 
 
+def test_history_handler_1(apigw_event_get_base, municipalities_table_backend):
+    """history_handler basic test"""
+    apigw_event_get_base["pathParameters"] = {"GEOID": "0000000021"}
+    ret = municipalities_api.history_handler(apigw_event_get_base, "")
+    body = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert "data" in body
+    assert "links" in body
+    data = body["data"]
+    assert [row["GEOID"] for row in data] == [
+        "0000000001",
+        "0000000011",
+        "0000000021",
+    ]
+    assert [row["municipality"] for row in data] == ["Town B1", "Town B2", "Town B2"]
+    assert [row["first_year"] for row in data] == [2000, 2005, 2010]
+
+
+def test_history_handler_2(apigw_event_get_base, municipalities_table_backend):
+    """history_handler GEOID not found"""
+    apigw_event_get_base["pathParameters"] = {"GEOID": "9999999999"}
+    ret = municipalities_api.history_handler(apigw_event_get_base, "")
+    body = json.loads(ret["body"])
+
+    assert ret["statusCode"] == HTTPStatus.NOT_FOUND
+    assert "errors" in body
+
+
+def test_xref_handler_2(apigw_event_get_xrefs, municipalities_table_backend):
+    """xref_handler panel across several years"""
+    apigw_event_get_xrefs["pathParameters"] = {"years": "2000,2005-2006"}
+    ret = municipalities_api.xref_handler(apigw_event_get_xrefs, "")
+    body = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    data = body["data"]
+    assert data[1] == {
+        "GEOID_Y2K": "0000000001",
+        "GEOID_2000": "0000000001",
+        "GEOID_2005": "0000000011",
+        "GEOID_2006": "0000000011",
+    }
+    assert body["meta"]["record_count"] == 3
+
+
+def test_changes_handler_1(apigw_event_get_xrefs, municipalities_table_backend):
+    """changes_handler basic test"""
+    ret = municipalities_api.changes_handler(apigw_event_get_xrefs, "")
+    body = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert "data" in body
+    assert "links" in body
+    assert "meta" in body
+    data = body["data"]
+    meta = body["meta"]
+    expected_data = [
+        {
+            "year_ref": 2000,
+            "year": 2010,
+            "GEOID_ref": "0000000001",
+            "GEOID": "0000000021",
+            "municipality_ref": "Town B1",
+            "municipality": "Town B2",
+            "change_type": "recoded",
+        },
+    ]
+    assert expected_data == data
+    assert meta["record_count"] == 1
+
+
+def test_municipality_handler_4(
+    apigw_event_get_municipalities, municipalities_table_backend
+):
+    """ "municipalities_handler with filter and sort"""
+    apigw_event_get_municipalities["queryStringParameters"] = {
+        "filter[county]": "County B",
+        "sort": "-municipality",
+    }
+    ret = municipalities_api.municipalities_handler(apigw_event_get_municipalities, "")
+    body = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert [row["GEOID"] for row in body["data"]] == ["0000000021"]
+    assert body["meta"]["record_count"] == 1
+    assert "filter%5Bcounty%5D=County+B" in body["links"]["self"]
+
+
+def test_municipality_handler_5(
+    apigw_event_get_municipalities, municipalities_table_backend
+):
+    """ "municipalities_handler meta only"""
+    apigw_event_get_municipalities["queryStringParameters"] = {"meta_only": "true"}
+    ret = municipalities_api.municipalities_handler(apigw_event_get_municipalities, "")
+    body = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert "ETag" in ret["headers"]
+    assert "data" not in body
+    assert body["meta"]["record_count"] == 3
+
+
+def test_municipality_handler_6(apigw_event_get_municipalities, monkeypatch):
+    """municipalities_handler rejects a malformed year or GEOID without loading
+    the table"""
+
+    def mock_build_municipalities_table(table_name, total_segments=1):
+        raise AssertionError("table loaded")
+
+    monkeypatch.setattr(
+        "municipalities.app.municipalities_data.build_municipalities_table",
+        mock_build_municipalities_table,
+    )
+    municipalities_data.invalidate_municipalities_table()
+    for path_parameters in [
+        {"year": "20100"},
+        {"year": "2010", "GEOID": "00000"},
+        {"year": "2010", "GEOID": "000000000x"},
+    ]:
+        apigw_event_get_municipalities["pathParameters"] = path_parameters
+        ret = municipalities_api.municipalities_handler(
+            apigw_event_get_municipalities, ""
+        )
+        assert ret["statusCode"] == HTTPStatus.BAD_REQUEST
+
+
+def test_prewarm_municipalities_1(municipalities_table_backend):
+    """prewarm_municipalities fills the changes cache and prerenders the default
+    year"""
+    municipalities_api.prewarm_municipalities()
+    indexes = municipalities_data.get_municipalities_indexes()
+    assert (2004, 2005) in indexes["changes"]
+    assert len(indexes["rendered"]) == 2
+
+    event = municipalities_api.make_prewarm_event(
+        "/nj/municipalities/2025", {"year": "2025"}
+    )
+    ret = municipalities_api.municipalities_handler(event, "")
+    assert ret["statusCode"] == 200
+    assert ret == indexes["rendered"][municipalities_api.make_render_key(event)]
+    event["queryStringParameters"] = {"page_size": "1"}
+    ret = municipalities_api.municipalities_handler(event, "")
+    assert len(json.loads(ret["body"])["data"]) == 1
+
+
+def test_xref_handler_3(apigw_event_get_xrefs, municipalities_table_backend):
+    """xref_handler HEAD request"""
+    apigw_event_get_xrefs["httpMethod"] = "HEAD"
+    ret = municipalities_api.xref_handler(apigw_event_get_xrefs, "")
+
+    assert ret["statusCode"] == 200
+    assert ret["body"] == ""
+    assert ret["headers"]["X-Record-Count"] == "3"
+
+
+def test_xref_handler_4(apigw_event_get_xrefs, municipalities_table_backend):
+    """xref_handler CSV result"""
+    apigw_event_get_xrefs["headers"]["Accept"] = "text/csv"
+    ret = municipalities_api.xref_handler(apigw_event_get_xrefs, "")
+
+    assert ret["statusCode"] == 200
+    assert ret["headers"]["Content-Type"] == "text/csv"
+    assert ret["headers"]["X-Record-Count"] == "3"
+    assert ret["body"].splitlines()[0] == "year_ref,year,GEOID_ref,GEOID"
+
+
 def test_return_xref_table_1():
     """return_xref_table basic test"""
     aux = {"year": 2005, "year_ref": 2006}
@@ -333,6 +501,59 @@ def test_make_municipalities_path_2():
     assert "nj/municipalities/2010/9999999999" == path
 
 
+def test_make_xref_path_2():
+    """make_xref_path with years"""
+    aux = {"years": [2000, 2001, 2002]}
+    path = municipalities_api.make_xref_path(aux)
+    assert "nj/municipality_xref_panel/2000-2002" == path
+
+
+def test_parse_years_1():
+    """parse_years with years and ranges"""
+    assert [2000, 2010, 2011, 2012] == municipalities_api.parse_years("2010-2012,2000")
+
+
+def test_parse_years_2():
+    """parse_years with invalid years"""
+    assert municipalities_api.parse_years("2000,x") is None
+    assert municipalities_api.parse_years("2010-2000") is None
+    assert municipalities_api.parse_years("2010-") is None
+    assert municipalities_api.parse_years("") is None
+
+
+def test_format_years_1():
+    """format_years with and without gaps"""
+    assert "2000-2002" == municipalities_api.format_years([2000, 2001, 2002])
+    assert "2000,2002" == municipalities_api.format_years([2000, 2002])
+    assert "2000" == municipalities_api.format_years([2000])
+
+
+def test_make_changes_path_1():
+    """make_changes_path basic test"""
+    aux = {"year": 2010, "year_ref": 2011}
+    path = municipalities_api.make_changes_path(aux)
+    assert "nj/municipality_changes/2011/2010" == path
+
+
+def test_make_history_path_1():
+    """make_history_path basic test"""
+    aux = {"GEOID": "9999999999"}
+    path = municipalities_api.make_history_path(aux)
+    assert "nj/municipalities/history/9999999999" == path
+
+
+def test_make_municipalities_query_1():
+    """make_municipalities_query with filter and sort"""
+    aux = {"year": 2010, "filter": {"county": "County A"}, "sort": "-GEOID"}
+    query = municipalities_api.make_municipalities_query(aux)
+    assert {"filter[county]": "County A", "sort": "-GEOID"} == query
+
+
+def test_make_municipalities_query_2():
+    """make_municipalities_query without filter and sort"""
+    assert {} == municipalities_api.make_municipalities_query({"year": 2010})
+
+
 def test_make_xref_path_1():
     """make_xref_path basic test"""
     aux = {"year": 2010, "year_ref": 2011}
@@ -377,6 +598,27 @@ def test_process_xref_params_3(apigw_event_get_xrefs):
     assert message is not None
 
 
+def test_process_xref_params_4(apigw_event_get_xrefs):
+    """process_xref_params with years"""
+    apigw_event_get_xrefs["pathParameters"] = {"years": "2000-2002"}
+    status, message, params = municipalities_api.process_xref_params(
+        apigw_event_get_xrefs
+    )
+    assert HTTPStatus.OK == status
+    assert message is None
+    assert {"page_size": 100, "years": [2000, 2001, 2002]} == params
+
+
+def test_process_xref_params_5(apigw_event_get_xrefs):
+    """process_xref_params with invalid years"""
+    apigw_event_get_xrefs["pathParameters"] = {"years": "2000-x"}
+    status, message, params = municipalities_api.process_xref_params(
+        apigw_event_get_xrefs
+    )
+    assert HTTPStatus.BAD_REQUEST == status
+    assert message is not None
+
+
 def test_process_municipality_params_1(apigw_event_get_municipalities):
     """process_municipality_params with no params"""
     status, message, params = municipalities_api.process_municipality_params(
@@ -441,3 +683,192 @@ def test_process_municipality_params_5(apigw_event_get_municipalities):
     )
     assert HTTPStatus.BAD_REQUEST == status
     assert message is not None
+
+
+def test_process_municipality_params_6(apigw_event_get_municipalities):
+    """process_municipality_params with filter and sort params"""
+    apigw_event_get_municipalities["queryStringParameters"] = {
+        "filter[county]": "County A",
+        "filter[GEOID_prefix]": "3400",
+        "filter[unknown]": "x",
+        "sort": "-municipality",
+    }
+    status, message, params = municipalities_api.process_municipality_params(
+        apigw_event_get_municipalities
+    )
+    assert HTTPStatus.OK == status
+    assert message is None
+    assert {
+        "page_size": 100,
+        "filter": {"county": "County A", "GEOID_prefix": "3400"},
+        "sort": "-municipality",
+    } == params
+
+
+def test_process_municipality_params_7(apigw_event_get_municipalities):
+    """process_municipality_params with invalid sort param"""
+    apigw_event_get_municipalities["queryStringParameters"] = {"sort": "row_number"}
+    status, message, params = municipalities_api.process_municipality_params(
+        apigw_event_get_municipalities
+    )
+    assert HTTPStatus.BAD_REQUEST == status
+    assert message is not None
+
+
+def test_process_municipality_params_8(apigw_event_get_municipalities):
+    """process_municipality_params with meta_only param"""
+    apigw_event_get_municipalities["queryStringParameters"] = {"meta_only": "true"}
+    status, message, params = municipalities_api.process_municipality_params(
+        apigw_event_get_municipalities
+    )
+    assert HTTPStatus.OK == status
+    assert message is None
+    assert {"page_size": 100, "meta_only": True} == params
+
+
+def test_process_xref_params_6(apigw_event_get_xrefs):
+    """process_xref_params HEAD request"""
+    apigw_event_get_xrefs["httpMethod"] = "HEAD"
+    status, message, params = municipalities_api.process_xref_params(
+        apigw_event_get_xrefs
+    )
+    assert HTTPStatus.OK == status
+    assert message is None
+    assert {
+        "page_size": 100,
+        "year": 2010,
+        "year_ref": 2000,
+        "meta_only": True,
+    } == params
+
+
+def test_municipality_handler_7(
+    apigw_event_get_municipalities, municipalities_table_backend
+):
+    """municipalities_handler with a year range returns each row once"""
+    apigw_event_get_municipalities["queryStringParameters"] = {
+        "from": "2003",
+        "to": "2006",
+    }
+    ret = municipalities_api.municipalities_handler(apigw_event_get_municipalities, "")
+    body = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert [
+        (row["GEOID"], row["first_year"], row["final_year"]) for row in body["data"]
+    ] == [
+        ("0000000000", 2003, 2006),
+        ("0000000001", 2003, 2004),
+        ("0000000011", 2005, 2006),
+        ("0000000002", 2003, 2006),
+    ]
+    assert body["meta"]["record_count"] == 4
+    assert "from=2003&to=2006" in body["links"]["self"]
+
+
+def test_process_municipality_params_9(apigw_event_get_municipalities):
+    """process_municipality_params with a year range"""
+    apigw_event_get_municipalities["queryStringParameters"] = {
+        "from": "2000",
+        "to": "2025",
+    }
+    status, message, params = municipalities_api.process_municipality_params(
+        apigw_event_get_municipalities
+    )
+    assert HTTPStatus.OK == status
+    assert {"page_size": 100, "from": 2000, "to": 2025} == params
+
+
+def test_process_municipality_params_10(apigw_event_get_municipalities):
+    """process_municipality_params with invalid year ranges"""
+    for query, path in [
+        ({"from": "2000"}, None),
+        ({"from": "2010", "to": "2000"}, None),
+        ({"from": "20x0", "to": "2025"}, None),
+        ({"from": "2000", "to": "2025"}, {"year": "2010"}),
+    ]:
+        apigw_event_get_municipalities["queryStringParameters"] = query
+        apigw_event_get_municipalities["pathParameters"] = path
+        status, message, params = municipalities_api.process_municipality_params(
+            apigw_event_get_municipalities
+        )
+        assert HTTPStatus.BAD_REQUEST == status
+        assert "Invalid year range" == message
+
+
+def test_make_municipalities_path_3():
+    """make_municipalities_path with a year range"""
+    aux = {"from": 2000, "to": 2025}
+    assert "nj/municipalities" == municipalities_api.make_municipalities_path(aux)
+    assert {"from": 2000, "to": 2025} == municipalities_api.make_municipalities_query(
+        aux
+    )
+
+
+def test_history_handler_3(apigw_event_get_base, municipalities_table_backend):
+    """history_handler HEAD request"""
+    apigw_event_get_base["pathParameters"] = {"GEOID": "0000000021"}
+    apigw_event_get_base["httpMethod"] = "HEAD"
+    ret = municipalities_api.history_handler(apigw_event_get_base, "")
+
+    assert ret["statusCode"] == 200
+    assert ret["body"] == ""
+    assert ret["headers"]["X-Record-Count"] == "3"
+
+
+def test_process_history_params_1(apigw_event_get_base):
+    """process_history_params rejects params that do not apply to history"""
+    apigw_event_get_base["pathParameters"] = {"GEOID": "0000000021"}
+    status, message, params = municipalities_api.process_history_params(
+        apigw_event_get_base
+    )
+    assert HTTPStatus.OK == status
+    assert {"GEOID": "0000000021"} == params
+    for query_parameters in [
+        {"from": "2000", "to": "2010"},
+        {"filter[county]": "County B"},
+        {"meta_only": "true"},
+        {"page_size": "10"},
+    ]:
+        apigw_event_get_base["queryStringParameters"] = query_parameters
+        status, message, params = municipalities_api.process_history_params(
+            apigw_event_get_base
+        )
+        assert HTTPStatus.BAD_REQUEST == status
+        assert message.startswith("Unsupported query parameter")
+
+
+def test_municipalities_routes_1():
+    """No two routes have differently named path parameters at the same level"""
+    names = {}
+    for template in municipalities_api.MUNICIPALITIES_ROUTES:
+        segments = template.strip("/").split("/")
+        for level, segment in enumerate(segments):
+            if segment.startswith("{"):
+                names.setdefault(tuple(segments[:level]), set()).add(segment)
+    assert all(1 == len(segment_names) for segment_names in names.values())
+
+
+def test_municipality_handler_8(
+    monkeypatch, apigw_event_get_municipalities, municipalities_table_backend
+):
+    """municipalities_handler reads the table and indexes from one snapshot, so
+    a refresh while it runs does not mix versions"""
+    get_snapshot = municipalities_data.get_municipalities_snapshot
+
+    def get_snapshot_then_refresh():
+        snapshot = get_snapshot()
+        municipalities_data.municipalities_cache.set(
+            municipalities_data.TABLE_KEY,
+            {"table": None, "indexes": None, "data_version": None},
+        )
+        return snapshot
+
+    monkeypatch.setattr(
+        municipalities_api, "get_municipalities_snapshot", get_snapshot_then_refresh
+    )
+    apigw_event_get_municipalities["queryStringParameters"] = {"sort": "GEOID"}
+    ret = municipalities_api.municipalities_handler(apigw_event_get_municipalities, "")
+    assert ret["statusCode"] == 200
+    assert json.loads(ret["body"])["meta"]["record_count"] == 3
+    municipalities_data.invalidate_municipalities_table()
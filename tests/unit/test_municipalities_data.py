@@ -1,8 +1,23 @@
+import asyncio
+import json
+import threading
+import time
+
 import boto3
+import numpy as np
 import pandas as pd
 import pytest
 
-from municipalities.app import municipalities_data
+from common_layer.ddblib import ddb_read_stream_records, pd_to_ddb_itemlist
+from common_layer.responsecachelib import response_cached
+from common_layer.responselib import table_version
+from common_layer.shmlib import attach_table, published_version
+from municipalities.app import (
+    municipalities_api,
+    municipalities_data,
+    municipalities_lib,
+)
+from tools import synthetic_data
 
 
 @pytest.fixture
@@ -54,6 +69,19 @@ def table_name_mock(boto_client_scan_mock):
     boto_client_scan_mock(scanner)
 
 
+def municipality_item(municipality):
+    """A municipalities table item, as returned by scan"""
+    return {
+        "row_number": {"N": "1"},
+        "GEOID": {"S": "12345647890"},
+        "GEOID_Y2K": {"S": "12345647890"},
+        "first_year": {"S": "2000"},
+        "final_year": {"S": "2025"},
+        "county": {"S": "Foo County"},
+        "municipality": {"S": municipality},
+    }
+
+
 def test_build_municipalities_table_1(boto_client_scan_mock):
     """build_municipalities_table basic test. We include spurious columns to test
     additional types"""
@@ -87,12 +115,12 @@ def test_build_municipalities_table_1(boto_client_scan_mock):
     )
     expected = pd.DataFrame(
         {
-            "row_number": [1, 2],
+            "row_number": np.array([1, 2], dtype=np.int32),
             "GEOID": ["1111111110", "2222222220"],
             "GEOID_Y2K": ["1111111111", "2222222222"],
-            "first_year": [2000, 2001],
-            "final_year": [2025, 2021],
-            "county": ["Foo County", "Bar County"],
+            "first_year": np.array([2000, 2001], dtype=np.int16),
+            "final_year": np.array([2025, 2021], dtype=np.int16),
+            "county": pd.Categorical(["Foo County", "Bar County"]),
             "municipality": ["Foo town", "Bar town"],
             "flag": [True, False],
             "string_list": [{"a", "b", "c"}, {"1", "2"}],
@@ -130,12 +158,12 @@ def test_build_municipalities_table_2(boto_client_scan_mock):
     )
     expected = pd.DataFrame(
         {
-            "row_number": [1, 2],
+            "row_number": np.array([1, 2], dtype=np.int32),
             "GEOID": ["1111111110", "2222222220"],
             "GEOID_Y2K": ["1111111111", "2222222222"],
-            "first_year": [2000, 2001],
-            "final_year": [2025, 2021],
-            "county": ["Foo County", "Bar County"],
+            "first_year": np.array([2000, 2001], dtype=np.int16),
+            "final_year": np.array([2025, 2021], dtype=np.int16),
+            "county": pd.Categorical(["Foo County", "Bar County"]),
             "municipality": ["Foo town", None],
             "municipality_2": [None, "Bar town"],
         }
@@ -185,24 +213,26 @@ def test_get_municipalities_table_1():
             ]
         }
     )
-    municipalities_data.municipalities_table = tbl
+    municipalities_data.municipalities_cache.set(
+        municipalities_data.TABLE_KEY, {"table": tbl, "indexes": {}}
+    )
     result = municipalities_data.get_municipalities_table()
     pd.testing.assert_frame_equal(tbl, result)
 
 
 def test_get_municipalities_table_2(monkeypatch, table_name_mock):
     """get_municipalities_table fetches table by name"""
-    municipalities_data.municipalities_table = None
+    municipalities_data.invalidate_municipalities_table()
     monkeypatch.setenv("TABLE_MUNICIPALITIES", "municipalities_table")
     result = municipalities_data.get_municipalities_table()
     expected = pd.DataFrame(
         {
-            "row_number": [1],
+            "row_number": np.array([1], dtype=np.int32),
             "GEOID": ["12345647890"],
             "GEOID_Y2K": ["12345647890"],
-            "first_year": [2000],
-            "final_year": [2025],
-            "county": ["Foo County"],
+            "first_year": np.array([2000], dtype=np.int16),
+            "final_year": np.array([2025], dtype=np.int16),
+            "county": pd.Categorical(["Foo County"]),
             "municipality": ["Foo town"],
         }
     )
@@ -211,7 +241,385 @@ def test_get_municipalities_table_2(monkeypatch, table_name_mock):
 
 def test_get_municipalities_table_3(monkeypatch, table_name_mock):
     """get_municipalities_table throws exception on name mismatch"""
-    municipalities_data.municipalities_table = None
+    municipalities_data.invalidate_municipalities_table()
     monkeypatch.setenv("TABLE_COUNTIES", "municipalities_table_wrong")
     with pytest.raises(Exception):
         municipalities_data.get_municipalities_table()
+
+
+def test_get_municipalities_indexes_1(monkeypatch, table_name_mock):
+    """get_municipalities_indexes returns the indexes built when the table loads"""
+    municipalities_data.invalidate_municipalities_table()
+    monkeypatch.setenv("TABLE_MUNICIPALITIES", "municipalities_table")
+    tbl = municipalities_data.get_municipalities_table()
+    indexes = municipalities_data.municipalities_cache.peek(
+        municipalities_data.TABLE_KEY
+    )["indexes"]
+    assert indexes is not None
+    assert municipalities_data.get_municipalities_indexes() is indexes
+    assert municipalities_data.get_municipalities_table() is tbl
+    assert indexes["lineage"]["GEOID"]["12345647890"] == ("12345647890",)
+    assert indexes["year_counts"][2025] == 1
+    assert isinstance(indexes["version"], str)
+    assert indexes["footprint"]["total"] > 0
+
+
+def test_get_municipalities_table_async_1(monkeypatch, boto_client_scan_mock):
+    """get_municipalities_table_async scans once for concurrent first requests"""
+    calls = []
+
+    def scanner(TableName=None):
+        calls.append(TableName)
+        time.sleep(0.1)
+        return {
+            "Items": [
+                {
+                    "row_number": {"N": "1"},
+                    "GEOID": {"S": "12345647890"},
+                    "GEOID_Y2K": {"S": "12345647890"},
+                    "first_year": {"S": "2000"},
+                    "final_year": {"S": "2025"},
+                    "county": {"S": "Foo County"},
+                    "municipality": {"S": "Foo town"},
+                },
+            ]
+        }
+
+    boto_client_scan_mock(scanner)
+    municipalities_data.invalidate_municipalities_table()
+    monkeypatch.setenv("TABLE_MUNICIPALITIES", "municipalities_table")
+
+    async def main():
+        return await asyncio.gather(
+            *(municipalities_data.get_municipalities_table_async() for _ in range(4))
+        )
+
+    results = asyncio.run(main())
+    assert ["municipalities_table"] == calls
+    assert all(result is results[0] for result in results)
+    assert municipalities_data.get_municipalities_indexes()["year_counts"][2025] == 1
+
+
+def test_get_municipalities_snapshot_1(monkeypatch, table_name_mock):
+    """get_municipalities_snapshot returns the table with the indexes built from it"""
+    municipalities_data.invalidate_municipalities_table()
+    monkeypatch.setenv("TABLE_MUNICIPALITIES", "municipalities_table")
+    snapshot = municipalities_data.get_municipalities_snapshot()
+    assert municipalities_data.get_municipalities_table() is snapshot["table"]
+    assert municipalities_data.get_municipalities_indexes() is snapshot["indexes"]
+    assert snapshot["indexes"]["version"] == table_version(snapshot["table"])
+
+
+def test_get_municipalities_table_4(monkeypatch, boto_client_scan_mock):
+    """get_municipalities_table scans once for concurrent threads"""
+    calls = []
+
+    def scanner(TableName=None):
+        calls.append(TableName)
+        time.sleep(0.1)
+        return {"Items": [municipality_item("Foo town")]}
+
+    boto_client_scan_mock(scanner)
+    municipalities_data.invalidate_municipalities_table()
+    monkeypatch.setenv("TABLE_MUNICIPALITIES", "municipalities_table")
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(
+                municipalities_data.get_municipalities_table()
+            )
+        )
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ["municipalities_table"] == calls
+    assert 8 == len(results)
+    assert all(result is results[0] for result in results)
+
+
+def test_refresh_municipalities_table_1(monkeypatch, boto_client_scan_mock):
+    """refresh_municipalities_table swaps in a new table and indexes together"""
+    names = ["Foo town", "Bar town"]
+    boto_client_scan_mock(lambda TableName: {"Items": [municipality_item(names[0])]})
+    municipalities_data.invalidate_municipalities_table()
+    monkeypatch.setenv("TABLE_MUNICIPALITIES", "municipalities_table")
+    old_indexes = municipalities_data.get_municipalities_indexes()
+    assert ["Foo town"] == list(
+        municipalities_data.get_municipalities_table().municipality
+    )
+
+    names.pop(0)
+    tbl = municipalities_data.refresh_municipalities_table()
+    assert ["Bar town"] == list(tbl.municipality)
+    assert municipalities_data.get_municipalities_table() is tbl
+    indexes = municipalities_data.get_municipalities_indexes()
+    assert indexes is not old_indexes
+    assert indexes["version"] != old_indexes["version"]
+
+
+def stream_record(event_name, row_number, image=None):
+    """DynamoDB Streams style change record"""
+    data = {"Keys": {"row_number": {"N": str(row_number)}}}
+    if image is not None:
+        data["NewImage"] = image
+    return {"eventName": event_name, "dynamodb": data}
+
+
+@pytest.fixture
+def synthetic_items():
+    counties = synthetic_data.generate_counties_table(counties=20, states=2)
+    tbl = synthetic_data.generate_municipalities_table(places=300, counties=counties)
+    return {
+        row_number: item for row_number, item in enumerate(pd_to_ddb_itemlist(tbl), 1)
+    }
+
+
+@pytest.fixture
+def replay(tmp_path, synthetic_items):
+    """Replay file that renames, ends, removes and adds rows, and the items
+    of the table after the changes"""
+    renamed = dict(synthetic_items[5], municipality={"S": "Renamed town"})
+    ended = dict(synthetic_items[6], final_year={"S": "2010"})
+    created = dict(
+        synthetic_items[7],
+        row_number={"N": "1000"},
+        GEOID={"S": "9999999999"},
+        GEOID_Y2K={"S": "9999999999"},
+        first_year={"S": "2020"},
+        final_year={"S": "2025"},
+    )
+    records = [
+        stream_record("MODIFY", 5, dict(renamed, municipality={"S": "Interim"})),
+        stream_record("MODIFY", 5, renamed),
+        stream_record("MODIFY", 6, ended),
+        stream_record("REMOVE", 8),
+        stream_record("INSERT", 1000, created),
+    ]
+    path = tmp_path / "changes.jsonl"
+    path.write_text("\n".join(json.dumps(record) for record in records) + "\n")
+    items = dict(synthetic_items)
+    items.update({5: renamed, 6: ended, 1000: created})
+    del items[8]
+    return path, list(items.values())
+
+
+def load_snapshot(monkeypatch, boto_client_scan_mock, items):
+    """Load the municipalities table from items, and return the snapshot"""
+    boto_client_scan_mock({"Items": items})
+    monkeypatch.setenv("TABLE_MUNICIPALITIES", "municipalities_table")
+    municipalities_data.invalidate_municipalities_table()
+    municipalities_data.get_municipalities_table()
+    return municipalities_data.municipalities_cache.peek(municipalities_data.TABLE_KEY)
+
+
+def test_apply_municipalities_changes_1(
+    monkeypatch, boto_client_scan_mock, synthetic_items, replay
+):
+    """apply_municipalities_changes gives the same table and indexes as a rescan"""
+    path, items = replay
+    expected = load_snapshot(monkeypatch, boto_client_scan_mock, items)
+    load_snapshot(monkeypatch, boto_client_scan_mock, list(synthetic_items.values()))
+    boto_client_scan_mock(lambda TableName: pytest.fail("rescanned"))
+
+    records = ddb_read_stream_records(path)
+    assert 4 == municipalities_data.apply_municipalities_changes(records)
+    result = municipalities_data.municipalities_cache.peek(
+        municipalities_data.TABLE_KEY
+    )
+    pd.testing.assert_frame_equal(
+        expected["table"].reset_index(drop=True),
+        result["table"].reset_index(drop=True),
+    )
+    for key in ["version", "year_counts"]:
+        assert expected["indexes"][key] == result["indexes"][key]
+    pd.testing.assert_frame_equal(
+        expected["indexes"]["xref_panel"], result["indexes"]["xref_panel"]
+    )
+    for key, order in expected["indexes"]["sort"].items():
+        np.testing.assert_array_equal(order, result["indexes"]["sort"][key])
+    assert (
+        expected["indexes"]["lineage"]["GEOID"] == result["indexes"]["lineage"]["GEOID"]
+    )
+    municipalities_data.invalidate_municipalities_table()
+
+
+def test_apply_municipalities_changes_2(
+    monkeypatch, boto_client_scan_mock, synthetic_items
+):
+    """apply_municipalities_changes keeps memoized results for unchanged years"""
+    load_snapshot(monkeypatch, boto_client_scan_mock, list(synthetic_items.values()))
+    indexes = municipalities_data.get_municipalities_indexes()
+    indexes["changes"].update({(2000, 2001): "kept", (2010, 2011): "dropped"})
+    indexes["xref_panels"][(2000,)] = "kept"
+    indexes["xref_panels"][(2000, 2011)] = "dropped"
+    indexes["rendered"]["key"] = "dropped"
+    created = dict(
+        synthetic_items[1],
+        row_number={"N": "1000"},
+        GEOID_Y2K={"S": "9999999999"},
+        first_year={"S": "2011"},
+        final_year={"S": "2012"},
+    )
+
+    municipalities_data.apply_municipalities_changes(
+        [stream_record("INSERT", 1000, created)]
+    )
+    indexes = municipalities_data.get_municipalities_indexes()
+    assert {(2000, 2001): "kept"} == indexes["changes"]
+    assert [((2000,), "kept")] == indexes["xref_panels"].items()
+    assert {} == indexes["rendered"]
+    municipalities_data.invalidate_municipalities_table()
+
+
+def test_publish_municipalities_changes_1(
+    monkeypatch, tmp_path, boto_client_scan_mock, synthetic_items, replay
+):
+    """publish_municipalities_changes publishes the patched table, without a rescan"""
+    path, items = replay
+    expected = load_snapshot(monkeypatch, boto_client_scan_mock, items)["table"]
+    municipalities_data.invalidate_municipalities_table()
+    boto_client_scan_mock({"Items": list(synthetic_items.values())})
+
+    count, version = municipalities_data.publish_municipalities_changes(
+        str(tmp_path), ddb_read_stream_records(path)
+    )
+    assert 4 == count
+    assert version == published_version(str(tmp_path), "municipalities")
+    assert version == municipalities_data.get_municipalities_data_version()
+    _, result = attach_table(str(tmp_path), "municipalities")
+    pd.testing.assert_frame_equal(
+        expected.reset_index(drop=True),
+        result.reset_index(drop=True),
+        check_categorical=False,
+    )
+    municipalities_data.invalidate_municipalities_table()
+
+
+def test_apply_municipalities_changes_4(
+    monkeypatch, boto_client_scan_mock, synthetic_items
+):
+    """apply_municipalities_changes changes the data version, so cached responses miss"""
+    monkeypatch.setattr(municipalities_data, "get_municipalities_version", lambda: 7)
+    monkeypatch.setenv("RESPONSE_CACHE", "memory")
+    monkeypatch.setenv("RESPONSE_CACHE_TTL_SECONDS", "63")
+    load_snapshot(monkeypatch, boto_client_scan_mock, list(synthetic_items.values()))
+    calls = []
+
+    @response_cached(
+        "foo_handler",
+        municipalities_data.get_municipalities_data_version,
+        lambda event: "key",
+    )
+    def foo_handler(event, context):
+        calls.append(event)
+        return {"statusCode": 200, "headers": {}, "body": str(len(calls))}
+
+    assert "1" == foo_handler({}, None)["body"]
+    assert "1" == foo_handler({}, None)["body"]
+    municipalities_data.apply_municipalities_changes(
+        [stream_record("REMOVE", 1)], data_version=8
+    )
+    assert 8 == municipalities_data.get_municipalities_data_version()
+    assert "2" == foo_handler({}, None)["body"]
+    municipalities_data.apply_municipalities_changes([stream_record("REMOVE", 2)])
+    indexes = municipalities_data.get_municipalities_indexes()
+    assert indexes["version"] == municipalities_data.get_municipalities_data_version()
+    assert "3" == foo_handler({}, None)["body"]
+    municipalities_data.invalidate_municipalities_table()
+
+
+def test_apply_municipalities_changes_3(boto_client_scan_mock):
+    """apply_municipalities_changes ignores changes if nothing is cached"""
+    municipalities_data.invalidate_municipalities_table()
+    boto_client_scan_mock(lambda TableName: pytest.fail("scanned"))
+    records = [stream_record("REMOVE", 1)]
+    assert municipalities_data.apply_municipalities_changes(records) is None
+    assert municipalities_data.municipalities_cache.peek("municipalities") is None
+
+
+def test_get_municipalities_indexes_2(
+    monkeypatch, boto_client_scan_mock, synthetic_items
+):
+    """The fast paths enabled by the integrity checks match the pandas paths"""
+    snapshot = load_snapshot(
+        monkeypatch, boto_client_scan_mock, list(synthetic_items.values())
+    )
+    tbl, indexes = snapshot["table"], snapshot["indexes"]
+    assert indexes["integrity"]["unique_GEOID_year"]
+    assert municipalities_lib.is_GEOID_Y2K_unique(indexes["integrity"])
+    for GEOID, year in zip(tbl["GEOID"][::7], tbl["first_year"][::7]):
+        params = {"GEOID": GEOID, "year": int(year)}
+        pd.testing.assert_frame_equal(
+            municipalities_lib.handle_get_municipality(tbl, params)[0],
+            municipalities_lib.handle_get_municipality(tbl, params, indexes["GEOID"])[
+                0
+            ],
+        )
+    for year_ref, year in [(2000, 2025), (2025, 2000), (2013, 2014)]:
+        params = {"year": year, "year_ref": year_ref, "page_size": 50}
+        pd.testing.assert_frame_equal(
+            municipalities_lib.handle_get_xrefs(tbl, params)[0],
+            municipalities_lib.handle_get_xrefs(
+                tbl, params, None, indexes["integrity"]
+            )[0],
+        )
+    municipalities_data.invalidate_municipalities_table()
+
+
+def test_get_municipalities_indexes_3(
+    monkeypatch, boto_client_scan_mock, synthetic_items, capsys
+):
+    """A table with overlapping GEOID intervals is logged, and has no GEOID index"""
+    duplicate = dict(synthetic_items[1], row_number={"N": "1000"})
+    items = list(synthetic_items.values()) + [duplicate]
+    indexes = load_snapshot(monkeypatch, boto_client_scan_mock, items)["indexes"]
+    assert indexes["GEOID"] is None
+    assert not municipalities_lib.is_GEOID_Y2K_unique(indexes["integrity"])
+    record = json.loads(capsys.readouterr().out)
+    assert "municipalities" == record["integrity"]
+    assert [synthetic_items[1]["GEOID"]["S"]] == record["overlapping_GEOIDs"]
+    municipalities_data.invalidate_municipalities_table()
+
+
+def test_get_municipalities_indexes_4(
+    monkeypatch, boto_client_scan_mock, synthetic_items, capsys
+):
+    """A table with missing GEOIDs and GEOID_Y2Ks has no lineage index, and is served"""
+    items = dict(synthetic_items)
+    items[1] = {key: value for key, value in items[1].items() if key != "GEOID"}
+    items[2] = {key: value for key, value in items[2].items() if key != "GEOID_Y2K"}
+    indexes = load_snapshot(monkeypatch, boto_client_scan_mock, list(items.values()))[
+        "indexes"
+    ]
+    assert not indexes["integrity"]["complete_GEOID_Y2K"]
+    assert indexes["lineage"] is None
+    capsys.readouterr()
+
+    GEOID = items[2]["GEOID"]["S"]
+    event = {
+        "httpMethod": "GET",
+        "resource": "/nj/municipalities/history/{GEOID}",
+        "path": f"/nj/municipalities/history/{GEOID}",
+        "pathParameters": {"GEOID": GEOID},
+        "queryStringParameters": None,
+        "headers": {},
+    }
+    response = municipalities_api.history_handler(event, None)
+    assert 200 == response["statusCode"]
+    assert GEOID in [row["GEOID"] for row in json.loads(response["body"])["data"]]
+    event = {
+        "httpMethod": "GET",
+        "resource": "/nj/municipalities/{year}",
+        "path": "/nj/municipalities/2000",
+        "pathParameters": {"year": "2000"},
+        "queryStringParameters": {"sort": "-GEOID", "page_size": "500"},
+        "headers": {},
+    }
+    response = municipalities_api.municipalities_handler(event, None)
+    assert 200 == response["statusCode"]
+    assert json.loads(response["body"])["data"][-1]["GEOID"] is None
+    municipalities_data.invalidate_municipalities_table()
@@ -60,6 +60,76 @@ def test_handle_get_municipalities_page_4(municipality_table):
         )
 
 
+def test_handle_get_municipalities_page_5(municipality_table):
+    """ "Filter by county"""
+
+    municipality_table["county"] = ["A", "B", "A", "B"]
+    result_set, aux = municipalities_lib.handle_get_municipalities(
+        municipality_table, {"year": 2000, "filter": {"county": "A"}}
+    )
+    assert list(result_set.GEOID) == ["0001", "0002"]
+    assert aux["record_count"] == 2
+    assert aux["filter"] == {"county": "A"}
+
+
+def test_handle_get_municipalities_page_6(municipality_table):
+    """ "Filter by GEOID prefix and sort descending, with prebuilt indexes"""
+
+    municipality_table.loc[4, "GEOID"] = "9003"
+    county_index = municipalities_lib.build_county_index(municipality_table)
+    sort_index = municipalities_lib.build_sort_index(municipality_table)
+    result_set, aux = municipalities_lib.handle_get_municipalities(
+        municipality_table,
+        {"year": 2010, "filter": {"GEOID_prefix": "90"}, "sort": "-GEOID"},
+        county_index,
+        sort_index,
+    )
+    assert list(result_set.GEOID) == ["9003", "9001"]
+    assert aux["sort"] == "-GEOID"
+
+
+def test_handle_get_municipalities_page_7(municipality_table):
+    """ "Sort by municipality, with pagination"""
+
+    municipality_table["municipality"] = ["z", "y", "x", "w"]
+    result_set, aux = municipalities_lib.handle_get_municipalities(
+        municipality_table,
+        {"year": 2000, "sort": "municipality", "page_size": 2, "page_number": 1},
+    )
+    assert list(result_set.municipality) == ["w", "x"]
+    assert aux["record_count"] == 3
+
+
+def test_handle_get_municipalities_page_8(municipality_table):
+    """ "Filter with no matches"""
+
+    with pytest.raises(municipalities_lib.MunicipalitiesNotFoundError):
+        municipalities_lib.handle_get_municipalities(
+            municipality_table, {"year": 2000, "filter": {"county": "none"}}
+        )
+
+
+def test_handle_get_municipalities_page_9(municipality_table):
+    """ "Meta only, with and without year counts"""
+
+    year_counts = municipalities_lib.build_year_counts(municipality_table)
+    for counts in (None, year_counts):
+        result_set, aux = municipalities_lib.handle_get_municipalities(
+            municipality_table,
+            {"year": 2000, "page_size": 2, "page_number": 2, "meta_only": True},
+            year_counts=counts,
+        )
+        assert result_set is None
+        assert aux["record_count"] == 3
+
+    with pytest.raises(municipalities_lib.MunicipalitiesNotFoundError):
+        municipalities_lib.handle_get_municipalities(
+            municipality_table,
+            {"year": 1999, "meta_only": True},
+            year_counts=year_counts,
+        )
+
+
 def test_handle_get_municipality_1(municipality_table):
     """ "Municipality that exists at late edge of specified range"""
 
@@ -123,3 +193,459 @@ def test_handle_get_xrefs_4(municipality_table):
         municipalities_lib.handle_get_xrefs(
             municipality_table, {"year": 2000, "year_ref": 1999}
         )
+
+
+def test_handle_get_xrefs_5(municipality_table):
+    """ "Meta only, with and without year counts"""
+
+    year_counts = municipalities_lib.build_year_counts(municipality_table)
+    for counts in (None, year_counts):
+        result_set, aux = municipalities_lib.handle_get_xrefs(
+            municipality_table,
+            {"year": 2021, "year_ref": 2000, "meta_only": True},
+            counts,
+        )
+        assert result_set is None
+        assert aux["record_count"] == 2
+
+        with pytest.raises(municipalities_lib.MunicipalitiesNotFoundError):
+            municipalities_lib.handle_get_xrefs(
+                municipality_table,
+                {"year": 2021, "year_ref": 1999, "meta_only": True},
+                counts,
+            )
+
+
+def test_handle_get_history_1(municipality_table):
+    """ "History by current GEOID includes earlier GEOIDs"""
+
+    result_set, aux = municipalities_lib.handle_get_history(
+        municipality_table, {"GEOID": "9001"}
+    )
+    assert list(result_set.GEOID) == ["0001", "9001"]
+    assert list(result_set.first_year) == [2000, 2010]
+    assert list(result_set.final_year) == [2009, 2021]
+    assert aux == {"GEOID": "9001"}
+
+
+def test_handle_get_history_2(municipality_table):
+    """ "History by GEOID_Y2K, with a prebuilt lineage index"""
+
+    lineage = municipalities_lib.build_lineage_index(municipality_table)
+    result_set, aux = municipalities_lib.handle_get_history(
+        municipality_table, {"GEOID": "0001"}, lineage
+    )
+    assert list(result_set.GEOID) == ["0001", "9001"]
+    assert list(result_set.municipality) == ["a", "b"]
+
+
+def test_handle_get_history_3(municipality_table):
+    """ "GEOID that does not exist"""
+
+    with pytest.raises(municipalities_lib.MunicipalitiesNotFoundError):
+        municipalities_lib.handle_get_history(municipality_table, {"GEOID": "9999"})
+
+
+def test_handle_get_history_4(municipality_table):
+    """ "History without a lineage index matches the index, and includes rows
+    missing their GEOID_Y2K"""
+
+    lineage = municipalities_lib.build_lineage_index(municipality_table)
+    for GEOID in ["0001", "9001", "0003"]:
+        pd.testing.assert_frame_equal(
+            municipalities_lib.handle_get_history(
+                municipality_table, {"GEOID": GEOID}, lineage
+            )[0],
+            municipalities_lib.handle_get_history(municipality_table, {"GEOID": GEOID})[
+                0
+            ],
+        )
+    municipality_table.loc[3, "GEOID_Y2K"] = None
+    municipality_table.loc[3, "GEOID"] = "9002"
+    result_set, aux = municipalities_lib.handle_get_history(
+        municipality_table, {"GEOID": "9002"}
+    )
+    assert list(result_set.municipality) == ["c"]
+
+
+def test_build_lineage_index_1(municipality_table):
+    """ "Lineage index keyed by GEOID_Y2K and GEOID"""
+
+    lineage = municipalities_lib.build_lineage_index(municipality_table)
+    assert list(lineage["GEOID_Y2K"]["0001"]) == [0, 1]
+    assert list(lineage["GEOID_Y2K"]["0003"]) == [3]
+    assert lineage["GEOID"]["9001"] == ("0001",)
+
+
+def test_handle_get_changes_1(municipality_table):
+    """ "Recoded and removed municipalities"""
+
+    result_set, aux = municipalities_lib.handle_get_changes(
+        municipality_table, {"year": 2021, "year_ref": 2000}
+    )
+    assert list(result_set.GEOID_ref) == ["0001", "0003"]
+    assert list(result_set.GEOID) == ["9001", numpy.nan]
+    assert list(result_set.change_type) == ["recoded", "removed"]
+    assert aux["record_count"] == 2
+
+
+def test_handle_get_changes_2(municipality_table):
+    """ "Added municipalities, with memoization"""
+
+    changes_cache = {}
+    result_set, aux = municipalities_lib.handle_get_changes(
+        municipality_table, {"year": 2000, "year_ref": 2021}, changes_cache
+    )
+    assert list(result_set.change_type) == ["recoded", "added"]
+    assert list(changes_cache) == [(2021, 2000)]
+
+    changes_cache[(2021, 2000)] = changes_cache[(2021, 2000)].iloc[:1]
+    result_set, aux = municipalities_lib.handle_get_changes(
+        municipality_table, {"year": 2000, "year_ref": 2021}, changes_cache
+    )
+    assert list(result_set.change_type) == ["recoded"]
+
+
+def test_handle_get_changes_3(municipality_table):
+    """ "No changes between years"""
+
+    with pytest.raises(municipalities_lib.MunicipalitiesNotFoundError):
+        municipalities_lib.handle_get_changes(
+            municipality_table, {"year": 2001, "year_ref": 2000}
+        )
+
+
+def test_handle_get_changes_4(municipality_table):
+    """ "No data for ref year"""
+
+    with pytest.raises(municipalities_lib.MunicipalitiesNotFoundError):
+        municipalities_lib.handle_get_changes(
+            municipality_table, {"year": 2000, "year_ref": 1999}
+        )
+
+
+def test_build_changes_table_1(municipality_table):
+    """ "Renamed municipality"""
+
+    municipality_table.loc[3, "final_year"] = 2009
+    municipality_table.loc[5] = ["county name", "0002", "0002", 2010, 2021, "e"]
+    result = municipalities_lib.build_changes_table(municipality_table, 2005, 2015)
+    assert list(result.GEOID) == ["9001", "0002"]
+    assert list(result.municipality_ref) == ["a", "c"]
+    assert list(result.municipality) == ["b", "e"]
+    assert list(result.change_type) == ["recoded", "renamed"]
+
+
+def test_handle_get_xref_panel_1(municipality_table):
+    """ "Panel across several years"""
+
+    result_set, aux = municipalities_lib.handle_get_xref_panel(
+        municipality_table, {"years": [2000, 2010, 2021]}
+    )
+    assert list(result_set.columns) == [
+        "GEOID_Y2K",
+        "GEOID_2000",
+        "GEOID_2010",
+        "GEOID_2021",
+    ]
+    assert list(result_set.GEOID_Y2K) == ["0001", "0002", "0003"]
+    assert list(result_set.GEOID_2010) == ["9001", "0002", "0003"]
+    assert list(result_set.GEOID_2021) == ["9001", "0002", numpy.nan]
+    assert aux["record_count"] == 3
+
+
+def test_handle_get_xref_panel_2(municipality_table):
+    """ "Panel pagination, with a prebuilt panel and memoization"""
+
+    panel = municipalities_lib.build_xref_panel(municipality_table)
+    panel_cache = {}
+    result_set, aux = municipalities_lib.handle_get_xref_panel(
+        municipality_table,
+        {"years": [2016, 2021], "page_size": 1, "page_number": 2},
+        panel,
+        panel_cache,
+    )
+    assert list(result_set.GEOID_Y2K) == ["0002"]
+    assert aux["record_count"] == 2
+    assert list(panel_cache) == [(2016, 2021)]
+
+
+def test_handle_get_xref_panel_3(municipality_table):
+    """ "No data for one of the years"""
+
+    with pytest.raises(municipalities_lib.MunicipalitiesNotFoundError):
+        municipalities_lib.handle_get_xref_panel(
+            municipality_table, {"years": [1999, 2000]}
+        )
+
+
+def test_build_xref_panel_1(municipality_table):
+    """ "One row per GEOID_Y2K, one column per year"""
+
+    panel = municipalities_lib.build_xref_panel(municipality_table)
+    assert list(panel.index) == ["0001", "0002", "0003"]
+    assert list(panel.columns) == list(range(2000, 2022))
+    assert list(panel[2009]) == ["0001", "0002", "0003"]
+
+
+def test_build_county_index_1(municipality_table):
+    """ "County index on a categorical county column"""
+
+    municipality_table["county"] = pd.Categorical(["A", "B", "A", "B"])
+    county_index = municipalities_lib.build_county_index(municipality_table)
+    assert list(county_index["A"]) == [0, 2]
+    assert list(county_index["B"]) == [1, 3]
+
+
+def test_build_sort_index_1(municipality_table):
+    """ "Sort permutations, with ties broken by GEOID"""
+
+    municipality_table["county"] = ["B", "A", "B", "A"]
+    sort_index = municipalities_lib.build_sort_index(municipality_table)
+    assert list(sort_index["GEOID"]) == [0, 2, 3, 1]
+    assert list(sort_index["county"]) == [3, 1, 0, 2]
+    assert list(sort_index["GEOID_values"]) == ["0001", "0002", "0003", "9001"]
+
+
+def test_build_sort_index_2(municipality_table):
+    """ "Missing values sort last, and descending sorts keep GEOID ascending"""
+
+    municipality_table["GEOID"] = ["0001", None, "0002", "0003"]
+    municipality_table["county"] = ["B", "A", None, "A"]
+    sort_index = municipalities_lib.build_sort_index(municipality_table)
+    assert list(sort_index["GEOID"]) == [0, 2, 3, 1]
+    assert list(sort_index["-GEOID"]) == [3, 2, 0, 1]
+    assert list(sort_index["county"]) == [3, 1, 0, 2]
+    assert list(sort_index["-county"]) == [0, 3, 1, 2]
+    assert list(sort_index["GEOID_values"]) == ["0001", "0002", "0003"]
+
+    result_set, aux = municipalities_lib.handle_get_municipalities(
+        municipality_table,
+        {"year": 2010, "sort": "-county", "filter": {"GEOID_prefix": "000"}},
+    )
+    assert list(result_set["GEOID"]) == ["0003", "0002"]
+
+
+def test_handle_get_changes_5(municipality_table):
+    """ "Meta only"""
+
+    result_set, aux = municipalities_lib.handle_get_changes(
+        municipality_table, {"year": 2021, "year_ref": 2000, "meta_only": True}
+    )
+    assert result_set is None
+    assert aux["record_count"] == 2
+
+
+def test_handle_get_xref_panel_4(municipality_table):
+    """ "Meta only"""
+
+    result_set, aux = municipalities_lib.handle_get_xref_panel(
+        municipality_table, {"years": [2016, 2021], "meta_only": True}
+    )
+    assert result_set is None
+    assert aux["record_count"] == 2
+
+
+def test_build_year_counts_1(municipality_table):
+    """ "Counts for each year with at least one municipality"""
+
+    year_counts = municipalities_lib.build_year_counts(municipality_table)
+    assert list(year_counts) == list(range(2000, 2022))
+    assert year_counts[2000] == 3
+    assert year_counts[2010] == 3
+    assert year_counts[2016] == 2
+
+
+def test_build_year_counts_2(municipality_table):
+    """ "Counts and panel are unchanged with compact int16 years"""
+
+    compact_table = municipality_table.astype(
+        {"first_year": "int16", "final_year": "int16", "county": "category"}
+    )
+    assert municipalities_lib.build_year_counts(
+        compact_table
+    ) == municipalities_lib.build_year_counts(municipality_table)
+    pd.testing.assert_frame_equal(
+        municipalities_lib.build_xref_panel(compact_table),
+        municipalities_lib.build_xref_panel(municipality_table),
+    )
+
+
+def test_update_year_counts_1(municipality_table):
+    """ "Updated counts match counts built from the changed table"""
+
+    removed = municipality_table.iloc[[3]]
+    added = removed.assign(final_year=2025)
+    changed = pd.concat([municipality_table.iloc[:3], added])
+    year_counts = municipalities_lib.update_year_counts(
+        municipalities_lib.build_year_counts(municipality_table), removed, added
+    )
+    assert year_counts == municipalities_lib.build_year_counts(changed)
+    assert year_counts[2025] == 1
+
+
+def test_update_xref_panel_1(municipality_table):
+    """ "Updated panel matches panel built from the changed table"""
+
+    panel = municipalities_lib.build_xref_panel(municipality_table)
+    changed = pd.concat(
+        [
+            municipality_table.iloc[[0, 2]],
+            municipality_table.iloc[[2]].assign(GEOID_Y2K="0004", final_year=2023),
+        ]
+    )
+    updated = municipalities_lib.update_xref_panel(
+        panel, changed, ["0001", "0003", "0004"]
+    )
+    pd.testing.assert_frame_equal(updated, municipalities_lib.build_xref_panel(changed))
+    assert list(updated.index) == ["0001", "0002", "0004"]
+    assert list(updated.columns) == list(range(2000, 2024))
+
+
+def test_handle_get_municipalities_range_1(municipality_table):
+    """ "Rows overlapping the range, once each, with clipped years"""
+
+    result_set, aux = municipalities_lib.handle_get_municipalities_range(
+        municipality_table, {"from": 2005, "to": 2012}
+    )
+    assert list(result_set["GEOID"]) == ["0001", "9001", "0002", "0003"]
+    assert list(result_set["first_year"]) == [2005, 2010, 2005, 2005]
+    assert list(result_set["final_year"]) == [2009, 2012, 2012, 2012]
+    assert list(result_set.columns) == [
+        "first_year",
+        "final_year",
+        "GEOID",
+        "county",
+        "municipality",
+    ]
+    assert aux == {
+        "from": 2005,
+        "to": 2012,
+        "page_size": 100,
+        "page_number": 1,
+        "record_count": 4,
+    }
+
+
+def test_handle_get_municipalities_range_2(municipality_table):
+    """ "Range excludes rows outside it, and supports sort and meta_only"""
+
+    result_set, aux = municipalities_lib.handle_get_municipalities_range(
+        municipality_table, {"from": 2016, "to": 2030, "sort": "-GEOID"}
+    )
+    assert list(result_set["GEOID"]) == ["9001", "0002"]
+    assert list(result_set["final_year"]) == [2021, 2021]
+    result_set, aux = municipalities_lib.handle_get_municipalities_range(
+        municipality_table, {"from": 2000, "to": 2000, "meta_only": True}
+    )
+    assert result_set is None
+    assert aux["record_count"] == 3
+
+
+def test_handle_get_municipalities_range_3(municipality_table):
+    """ "Range with no municipalities"""
+
+    with pytest.raises(municipalities_lib.MunicipalitiesNotFoundError):
+        municipalities_lib.handle_get_municipalities_range(
+            municipality_table, {"from": 1990, "to": 1999}
+        )
+
+
+def test_build_interval_index_1(municipality_table):
+    """ "Positions ordered by first_year"""
+
+    interval_index = municipalities_lib.build_interval_index(municipality_table)
+    assert list(interval_index["order"]) == [0, 2, 3, 1]
+    assert list(interval_index["first_year"]) == [2000, 2000, 2000, 2010]
+
+
+def test_check_municipalities_integrity_1(municipality_table):
+    """ "Clean table"""
+
+    integrity = municipalities_lib.check_municipalities_integrity(municipality_table)
+    assert integrity == {
+        "valid_intervals": True,
+        "complete_GEOID_Y2K": True,
+        "unique_GEOID_year": True,
+        "unique_GEOID_Y2K_year": True,
+        "overlapping_GEOIDs": [],
+        "overlapping_GEOID_Y2Ks": [],
+    }
+    assert municipalities_lib.is_GEOID_Y2K_unique(integrity)
+    assert not municipalities_lib.is_GEOID_Y2K_unique(None)
+
+
+def test_check_municipalities_integrity_2(municipality_table):
+    """ "Overlapping intervals, invalid intervals and missing GEOID_Y2K"""
+
+    extra = pd.DataFrame(
+        {
+            "county": ["county name"] * 3,
+            "GEOID_Y2K": ["0001", "0003", None],
+            "GEOID": ["0002", "0003", "0004"],
+            "first_year": [2015, 2016, 2000],
+            "final_year": [2021, 2010, 2021],
+            "municipality": ["e", "f", "g"],
+        },
+        index=pd.Index([5, 6, 7], name="row_number"),
+    )
+    tbl = pd.concat([municipality_table, extra])
+    integrity = municipalities_lib.check_municipalities_integrity(tbl)
+    assert not integrity["valid_intervals"]
+    assert not integrity["complete_GEOID_Y2K"]
+    assert integrity["overlapping_GEOIDs"] == ["0002"]
+    assert integrity["overlapping_GEOID_Y2Ks"] == ["0001"]
+    assert not integrity["unique_GEOID_year"]
+    assert not municipalities_lib.is_GEOID_Y2K_unique(integrity)
+
+
+def test_build_GEOID_index_1(municipality_table):
+    """ "Row positions of each GEOID"""
+
+    tbl = pd.concat([municipality_table, municipality_table.iloc[[0]]])
+    GEOID_index = municipalities_lib.build_GEOID_index(tbl)
+    assert {key: list(value) for key, value in GEOID_index.items()} == {
+        "0001": [0, 4],
+        "9001": [1],
+        "0002": [2],
+        "0003": [3],
+    }
+
+
+def test_handle_get_municipality_4(municipality_table):
+    """ "Lookup with the GEOID index matches the scan"""
+
+    GEOID_index = municipalities_lib.build_GEOID_index(municipality_table)
+    for GEOID in ["0001", "9001", "0002", "0003", "0004"]:
+        for year in [1999, 2000, 2009, 2010, 2021, 2022]:
+            params = {"year": year, "GEOID": GEOID}
+            try:
+                expected = municipalities_lib.handle_get_municipality(
+                    municipality_table, params
+                )
+            except municipalities_lib.MunicipalitiesNotFoundError:
+                with pytest.raises(municipalities_lib.MunicipalitiesNotFoundError):
+                    municipalities_lib.handle_get_municipality(
+                        municipality_table, params, GEOID_index
+                    )
+                continue
+            result_set, aux = municipalities_lib.handle_get_municipality(
+                municipality_table, params, GEOID_index
+            )
+            pd.testing.assert_frame_equal(expected[0], result_set)
+            assert expected[1] == aux
+
+
+def test_handle_get_xrefs_6(municipality_table):
+    """ "Gathering with integrity checks matches the join"""
+
+    integrity = municipalities_lib.check_municipalities_integrity(municipality_table)
+    for year_ref, year in [(2000, 2021), (2021, 2000), (2010, 2000), (2000, 2000)]:
+        for page in [{}, {"page_size": 1, "page_number": 2}]:
+            params = dict(page, year=year, year_ref=year_ref)
+            expected = municipalities_lib.handle_get_xrefs(municipality_table, params)
+            result = municipalities_lib.handle_get_xrefs(
+                municipality_table, params, None, integrity
+            )
+            pd.testing.assert_frame_equal(expected[0], result[0])
+            assert expected[1] == result[1]
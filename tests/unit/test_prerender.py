@@ -0,0 +1,118 @@
+import functools
+import hashlib
+import json
+
+import pandas as pd
+import pytest
+
+from tools import prerender
+
+
+@pytest.fixture
+def counties():
+    return pd.DataFrame({"GEOID": ["34001", "34003"]})
+
+
+@pytest.fixture
+def municipalities():
+    return pd.DataFrame(
+        {
+            "GEOID": ["3400100100", "3400100200", None],
+            "first_year": [2000, 2001, 2000],
+            "final_year": [2001, 2001, 2001],
+        }
+    )
+
+
+def make_handler(record_count, page_size=2):
+    """Returns a fake handler of a list of record_count records"""
+
+    def handler(event, context):
+        query_parameters = event["queryStringParameters"] or {}
+        page_size_ = int(query_parameters.get("page_size", page_size))
+        meta = {"page_count": -(-record_count // page_size_)}
+        body = json.dumps({"meta": meta, "data": [event["path"], query_parameters]})
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/vnd.api+json"},
+            "body": body,
+        }
+
+    return handler
+
+
+def test_static_file_name_1():
+    """static_file_name mirrors the path, with sorted query params"""
+    event = prerender.make_event("/nj/municipalities/{year}", {"year": "2010"})
+    assert "nj/municipalities/2010/index.json" == prerender.static_file_name(event)
+    event["queryStringParameters"] = {"page_size": "50", "page_number": "2"}
+    assert "nj/municipalities/2010/page_number=2&page_size=50.json" == (
+        prerender.static_file_name(event)
+    )
+
+
+def test_enumerate_tasks_1(counties, municipalities):
+    """enumerate_tasks covers each year, page size, GEOID and year pair"""
+    tasks = prerender.enumerate_tasks(counties, municipalities, [2000, 2001], [50])
+    paths = {(route, event["path"]) for route, event in tasks}
+    assert ("counties_handler", "/nj/counties/34003") in paths
+    assert ("municipalities_handler", "/nj/municipalities/2001") in paths
+    assert ("municipalities_handler", "/nj/municipalities/2000/3400100100") in paths
+    assert ("municipalities_handler", "/nj/municipalities/2000/3400100200") not in (
+        paths
+    )
+    assert ("history_handler", "/nj/municipalities/history/3400100200") in paths
+    assert ("xref_handler", "/nj/municipality_xrefs/2001/2000") in paths
+    assert ("changes_handler", "/nj/municipality_changes/2000/2001") in paths
+    listings = [
+        event["queryStringParameters"]
+        for route, event in tasks
+        if event["path"] == "/nj/municipalities/2000"
+    ]
+    assert [None, {"page_size": "50"}] == listings
+    assert 2 + 2 + 2 + 2 * 2 + 3 + 2 + 4 + 4 == len(tasks)
+
+
+def test_prerender_1(tmp_path):
+    """prerender renders every page, and writes files and the manifest"""
+    handlers = {"municipalities_handler": make_handler(5), "history_handler": None}
+    tasks = [
+        (
+            "municipalities_handler",
+            prerender.make_event("/nj/municipalities/{year}", {"year": "2010"}, q),
+        )
+        for q in [None, {"page_size": "5"}]
+    ]
+    render = functools.partial(prerender.render_task, handlers=handlers)
+    entries, skipped = prerender.prerender(tasks, str(tmp_path), render=render)
+    assert 0 == skipped
+    assert [
+        "nj/municipalities/2010/index.json",
+        "nj/municipalities/2010/page_size=5.json",
+        "nj/municipalities/2010/page_number=2.json",
+        "nj/municipalities/2010/page_number=3.json",
+    ] == [entry["file"] for entry in entries]
+    with open(tmp_path / "nj/municipalities/2010/page_number=3.json", "rb") as f:
+        body = f.read()
+    assert ["/nj/municipalities/2010", {"page_number": "3"}] == json.loads(body)["data"]
+
+    prerender.write_manifest(entries, str(tmp_path), {"municipalities": "abc"})
+    with open(tmp_path / prerender.MANIFEST) as f:
+        manifest = json.load(f)
+    assert {"municipalities": "abc"} == manifest["versions"]
+    file = manifest["files"]["nj/municipalities/2010/page_number=3.json"]
+    assert hashlib.sha256(body).hexdigest() == file["sha256"]
+    assert {"page_number": "3"} == file["query"]
+    assert "/nj/municipalities/2010" == file["path"]
+
+
+def test_prerender_2(tmp_path):
+    """prerender skips unsuccessful responses"""
+    handlers = {"history_handler": lambda event, context: {"statusCode": 404}}
+    task = (
+        "history_handler",
+        prerender.make_event("/nj/municipalities/history/{GEOID}", {"GEOID": "1"}),
+    )
+    render = functools.partial(prerender.render_task, handlers=handlers)
+    assert ([], 1) == prerender.prerender([task], str(tmp_path), render=render)
+    assert [] == list(tmp_path.iterdir())
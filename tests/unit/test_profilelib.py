@@ -0,0 +1,125 @@
+import json
+import time
+
+import pytest
+
+from common_layer import profilelib
+
+
+def busy(seconds):
+    """Spins for seconds, so the profiler has something to sample"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+@pytest.fixture
+def sampler():
+    with profilelib.StackSampler(interval=0.001) as sampler:
+        busy(0.05)
+    return sampler
+
+
+def test_stack_sampler_1(sampler):
+    """StackSampler samples the stack of the calling thread, outermost first"""
+    assert sampler.samples
+    assert sampler.duration >= 0.05
+    assert any(stack[-1][0] == "busy" for stack in sampler.samples)
+    assert all(stack[-1][0] != "_run" for stack in sampler.samples)
+
+
+def test_collapsed_stacks_1():
+    """collapsed_stacks counts each distinct stack"""
+    outer = ("outer", "a.py", 1)
+    inner = ("inner;x", "a.py", 5)
+    samples = [(outer, inner), (outer,), (outer, inner)]
+    assert (
+        "outer (a.py:1) 1\nouter (a.py:1);inner:x (a.py:5) 2\n"
+        == profilelib.collapsed_stacks(samples)
+    )
+
+
+def test_speedscope_profile_1():
+    """speedscope_profile shares frames between samples"""
+    outer = ("outer", "a.py", 1)
+    inner = ("inner", "a.py", 5)
+    profile = profilelib.speedscope_profile([(outer, inner), (outer,)], "foo", 0.01)
+    assert [
+        {"name": "outer", "file": "a.py", "line": 1},
+        {"name": "inner", "file": "a.py", "line": 5},
+    ] == profile["shared"]["frames"]
+    assert [[0, 1], [0]] == profile["profiles"][0]["samples"]
+    assert [0.01, 0.01] == profile["profiles"][0]["weights"]
+    assert "sampled" == profile["profiles"][0]["type"]
+
+
+def test_write_profile_1(tmp_path, sampler):
+    """write_profile writes collapsed or speedscope files"""
+    path = profilelib.write_profile(sampler, "foo", tmp_path / "out")
+    assert path.endswith(".txt")
+    with open(path) as f:
+        assert "busy (" in f.read()
+    path = profilelib.write_profile(sampler, "foo", tmp_path, "speedscope")
+    with open(path) as f:
+        assert "foo" == json.load(f)["name"]
+    with pytest.raises(ValueError):
+        profilelib.write_profile(sampler, "foo", tmp_path, "pprof")
+
+
+def test_is_profile_requested_1(monkeypatch):
+    """is_profile_requested with the header requires the configured token"""
+    monkeypatch.delenv("PROFILE_SAMPLE_RATE", raising=False)
+    event = {"headers": {"X-Debug-Profile": "secret"}}
+    monkeypatch.delenv("PROFILE_TOKEN", raising=False)
+    assert not profilelib.is_profile_requested(event)
+    monkeypatch.setenv("PROFILE_TOKEN", "secret")
+    assert profilelib.is_profile_requested(event)
+    assert not profilelib.is_profile_requested({"headers": {"x-debug-profile": "x"}})
+    assert not profilelib.is_profile_requested({"headers": None})
+    monkeypatch.setenv("PROFILE_SAMPLE_RATE", "1")
+    assert profilelib.is_profile_requested({"headers": None})
+
+
+def test_profile_sampled_1(monkeypatch, tmp_path, capsys):
+    """profile_sampled writes a profile for requested invocations only"""
+    monkeypatch.setenv("PROFILE_TOKEN", "secret")
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("PROFILE_INTERVAL_MS", "1")
+    monkeypatch.setenv("PROFILE_FORMAT", "speedscope")
+    monkeypatch.delenv("PROFILE_SAMPLE_RATE", raising=False)
+
+    @profilelib.profile_sampled("foo_handler")
+    def foo_handler(event, context):
+        busy(0.02)
+        return {"statusCode": 200}
+
+    assert {"statusCode": 200} == foo_handler({"headers": {}}, None)
+    assert [] == list(tmp_path.iterdir())
+    event = {"headers": {"X-Debug-Profile": "secret"}}
+    assert {"statusCode": 200} == foo_handler(event, None)
+    (path,) = tmp_path.iterdir()
+    record = json.loads(capsys.readouterr().out)
+    assert str(path) == record["path"]
+    assert "foo_handler" == record["profile"]
+    with open(path) as f:
+        profile = json.load(f)
+    frames = [frame["name"] for frame in profile["shared"]["frames"]]
+    assert "busy" in frames
+
+
+def test_profile_sampled_2(monkeypatch, tmp_path, capsys):
+    """profile_sampled logs a profile it cannot write and returns the response"""
+    monkeypatch.setenv("PROFILE_TOKEN", "secret")
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("PROFILE_FORMAT", "flamegraph")
+
+    @profilelib.profile_sampled("foo_handler")
+    def foo_handler(event, context):
+        return {"statusCode": 200}
+
+    event = {"headers": {"X-Debug-Profile": "secret"}}
+    assert {"statusCode": 200} == foo_handler(event, None)
+    assert [] == list(tmp_path.iterdir())
+    captured = capsys.readouterr()
+    assert "" == captured.out
+    assert "Unsupported format flamegraph" in captured.err
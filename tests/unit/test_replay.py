@@ -0,0 +1,97 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from tools import replay
+
+
+def make_capture(route, path, query_parameters=None):
+    return {
+        "capture": route,
+        "event": {
+            "httpMethod": "GET",
+            "path": path,
+            "pathParameters": None,
+            "queryStringParameters": query_parameters,
+            "headers": {"accept": "text/csv"},
+        },
+        "status": 200,
+    }
+
+
+@pytest.fixture
+def captures():
+    return [
+        make_capture("counties_handler", "/nj/counties"),
+        make_capture("municipalities_handler", "/nj/municipalities/2010"),
+        make_capture("municipalities_handler", "/nj/municipalities/20x0"),
+    ]
+
+
+def test_make_url_1():
+    """make_url appends the path and query params to the host"""
+    event = make_capture("a", "/nj/municipalities", {"from": "2000", "to": "2010"})
+    assert "http://localhost:3000/nj/municipalities?from=2000&to=2010" == (
+        replay.make_url("http://localhost:3000/", event["event"])
+    )
+
+
+def test_replay_1(captures):
+    """replay sends each capture repeat times to its handler"""
+    calls = []
+    lock = threading.Lock()
+
+    def handler(status):
+        def handle(event, context):
+            with lock:
+                calls.append(event["path"])
+            return {"statusCode": 400 if "x" in event["path"] else status}
+
+        return handle
+
+    send = replay.make_in_process_sender(
+        {"counties_handler": handler(200), "municipalities_handler": handler(500)}
+    )
+    results = replay.replay(captures, send, concurrency=4, repeat=3)
+    assert 9 == len(results)
+    assert 3 == calls.count("/nj/counties")
+    summary = replay.summarize(results)
+    assert {"count": 3, "errors": 0} == {
+        key: summary["counties_handler"][key] for key in ("count", "errors")
+    }
+    assert 6 == summary["municipalities_handler"]["count"]
+    assert 3 == summary["municipalities_handler"]["errors"]
+    stats = summary["municipalities_handler"]
+    assert 0 <= stats["p50"] <= stats["p90"] <= stats["p99"]
+    assert "municipalities_handler" in replay.format_summary(summary)
+
+
+def test_make_http_sender_1(captures):
+    """make_http_sender sends the captured path, query and headers"""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append((self.path, self.headers["Accept"]))
+            status = 400 if "x" in self.path else 200
+            self.send_response(status)
+            self.end_headers()
+            self.wfile.write(json.dumps({}).encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        send = replay.make_http_sender(f"http://127.0.0.1:{server.server_port}")
+        assert [200, 400] == [send(capture) for capture in captures[1:]]
+    finally:
+        server.shutdown()
+    assert [
+        ("/nj/municipalities/2010", "text/csv"),
+        ("/nj/municipalities/20x0", "text/csv"),
+    ] == requests
@@ -0,0 +1,258 @@
+import json
+import threading
+import time
+
+import pytest
+
+from common_layer import responsecachelib
+from common_layer.responselib import make_render_key
+
+
+class FakeDynamoDB:
+    """In-memory stand-in for the DynamoDB client calls used by DynamoDBBackend"""
+
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, TableName, Key):
+        item = self.items.get((TableName, Key["cache_key"]["S"]), None)
+        return {} if item is None else {"Item": item}
+
+    def put_item(self, TableName, Item):
+        self.items[(TableName, Item["cache_key"]["S"])] = Item
+
+
+def make_event(path="/nj/counties", accept=None):
+    return {
+        "httpMethod": "GET",
+        "path": path,
+        "pathParameters": None,
+        "queryStringParameters": None,
+        "headers": {} if accept is None else {"Accept": accept},
+    }
+
+
+def make_key(path="/nj/counties", accept=None):
+    return make_render_key(make_event(path, accept))
+
+
+def make_response(body="{}", status=200):
+    return {"statusCode": status, "headers": {}, "body": body}
+
+
+@pytest.fixture(
+    params=[
+        lambda tmp_path: responsecachelib.MemoryBackend(),
+        lambda tmp_path: responsecachelib.FileBackend(str(tmp_path / "responses")),
+        lambda tmp_path: responsecachelib.DynamoDBBackend("cache", FakeDynamoDB()),
+    ],
+    ids=["memory", "file", "dynamodb"],
+)
+def backend(request, tmp_path):
+    return request.param(tmp_path)
+
+
+def test_response_cache_1(backend):
+    """ResponseCache keys responses by handler, version and request"""
+    cache = responsecachelib.ResponseCache(backend)
+    key = make_key()
+    assert cache.get("foo", 1, key) is None
+    assert cache.put("foo", 1, key, make_response("a"))
+    assert make_response("a") == cache.get("foo", 1, key)
+    assert cache.get("foo", 2, key) is None
+    assert cache.get("bar", 1, key) is None
+    assert cache.get("foo", 1, make_key(accept="text/csv")) is None
+    assert cache.get("foo", 1, make_key("/nj/counties/34001")) is None
+
+
+def test_response_cache_2(backend):
+    """ResponseCache skips errors and large responses, and expires entries"""
+    cache = responsecachelib.ResponseCache(backend, ttl=-1, max_bytes=100)
+    key = make_key()
+    assert not cache.put("foo", 1, key, make_response(status=404))
+    assert not cache.put("foo", 1, key, make_response("x" * 100))
+    assert cache.put("foo", 1, key, make_response())
+    assert cache.get("foo", 1, key) is None
+
+
+def test_response_cache_3(capsys):
+    """ResponseCache treats backend errors as misses"""
+
+    class FailingBackend:
+        def get(self, key):
+            raise OSError("unavailable")
+
+        def put(self, key, expires_at, payload):
+            raise OSError("unavailable")
+
+    cache = responsecachelib.ResponseCache(FailingBackend())
+    assert cache.get("foo", 1, make_key()) is None
+    assert not cache.put("foo", 1, make_key(), make_response())
+    assert "unavailable" in capsys.readouterr().err
+
+
+def test_memory_backend_1():
+    """MemoryBackend evicts the least recently used entries"""
+    backend = responsecachelib.MemoryBackend(max_entries=2)
+    for key in "abc":
+        backend.put(key, time.time() + 60, json.dumps(key))
+        backend.get("a")
+    assert backend.get("b") is None
+    assert backend.get("a") is not None
+    assert backend.get("c") is not None
+
+
+def test_file_backend_1(tmp_path):
+    """FileBackend removes expired entries, and the first to expire beyond max_bytes"""
+    backend = responsecachelib.FileBackend(str(tmp_path), max_bytes=300)
+    now = time.time()
+    backend.put("expired", now - 1, "x" * 50)
+    assert backend.get("expired") is None
+    assert not (tmp_path / "expired.json").exists()
+    for index, key in enumerate("abcd"):
+        backend.put(key, now + 60 + index, "x" * 50)
+    backend.put("e", now - 1, "x" * 50)
+    assert 2 == backend.sweep()
+    assert ["b.json", "c.json", "d.json"] == sorted(
+        path.name for path in tmp_path.iterdir()
+    )
+    assert backend.get("d") is not None
+
+
+def test_get_response_cache_1(monkeypatch, tmp_path):
+    """get_response_cache is configured by the environment"""
+    monkeypatch.delenv("RESPONSE_CACHE", raising=False)
+    assert responsecachelib.get_response_cache() is None
+    monkeypatch.setenv("RESPONSE_CACHE", "file")
+    monkeypatch.setenv("RESPONSE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("RESPONSE_CACHE_TTL_SECONDS", "60")
+    cache = responsecachelib.get_response_cache()
+    assert isinstance(cache.backend, responsecachelib.FileBackend)
+    assert 60 == cache.ttl
+    assert cache is responsecachelib.get_response_cache()
+    monkeypatch.setenv("RESPONSE_CACHE", "redis")
+    with pytest.raises(ValueError):
+        responsecachelib.get_response_cache()
+
+
+def test_response_cached_1(monkeypatch):
+    """response_cached serves hits without calling the handler"""
+    monkeypatch.setenv("RESPONSE_CACHE", "memory")
+    monkeypatch.setenv("RESPONSE_CACHE_TTL_SECONDS", "61")
+    calls = []
+    versions = [1]
+
+    @responsecachelib.response_cached("foo_handler", lambda: versions[0])
+    def foo_handler(event, context):
+        calls.append(event["path"])
+        return make_response(json.dumps(len(calls)))
+
+    event = make_event("/nj/foo")
+    assert make_response("1") == foo_handler(event, None)
+    assert make_response("1") == foo_handler(event, None)
+    versions[0] = 2
+    assert make_response("2") == foo_handler(event, None)
+    versions[0] = None
+    assert make_response("3") == foo_handler(event, None)
+    assert make_response("4") == foo_handler(event, None)
+    assert 4 == len(calls)
+
+
+def test_response_cached_2(monkeypatch):
+    """response_cached keys responses with make_key, and bypasses the cache for None"""
+    monkeypatch.setenv("RESPONSE_CACHE", "memory")
+    monkeypatch.setenv("RESPONSE_CACHE_TTL_SECONDS", "62")
+    calls = []
+
+    def make_path_key(event):
+        return None if event["path"] == "/nj/invalid" else event["path"]
+
+    @responsecachelib.response_cached("foo_handler", lambda: 1, make_path_key)
+    def foo_handler(event, context):
+        calls.append(event["path"])
+        return make_response(json.dumps(len(calls)))
+
+    event = make_event("/nj/foo")
+    assert make_response("1") == foo_handler(event, None)
+    event["queryStringParameters"] = {"foo": "bar"}
+    assert make_response("1") == foo_handler(event, None)
+    assert make_response("2") == foo_handler(make_event("/nj/invalid"), None)
+    assert make_response("3") == foo_handler(make_event("/nj/invalid"), None)
+    assert 3 == len(calls)
+
+
+def test_request_coalesced_1(monkeypatch):
+    """request_coalesced shares the response of identical concurrent requests"""
+    monkeypatch.setattr(
+        responsecachelib, "request_coalescer", responsecachelib.RequestCoalescer()
+    )
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    @responsecachelib.request_coalesced("foo_handler")
+    def foo_handler(event, context):
+        calls.append(event["path"])
+        started.set()
+        assert release.wait(timeout=5)
+        return make_response(event["path"])
+
+    responses = []
+    thread = threading.Thread(
+        target=lambda: responses.append(foo_handler(make_event(), None))
+    )
+    thread.start()
+    assert started.wait(timeout=5)
+    follower = threading.Thread(
+        target=lambda: responses.append(foo_handler(make_event(), None))
+    )
+    follower.start()
+    while responsecachelib.request_coalescer.followers < 1:
+        time.sleep(0.001)
+    release.set()
+    assert make_response("/nj/foo") == foo_handler(make_event("/nj/foo"), None)
+    thread.join()
+    follower.join()
+    assert ["/nj/counties", "/nj/foo"] == calls
+    assert [make_response("/nj/counties")] * 2 == responses
+    assert responses[0] is not responses[1]
+    assert responses[0]["headers"] is not responses[1]["headers"]
+
+
+def test_request_coalesced_2(monkeypatch):
+    """request_coalesced coalesces requests with the same make_key, unless it is None"""
+    monkeypatch.setattr(
+        responsecachelib, "request_coalescer", responsecachelib.RequestCoalescer()
+    )
+    started = threading.Event()
+    release = threading.Event()
+
+    def make_path_key(event):
+        return None if event["path"] == "/nj/invalid" else event["path"]
+
+    @responsecachelib.request_coalesced("foo_handler", make_path_key)
+    def foo_handler(event, context):
+        if event["path"] == "/nj/foo":
+            started.set()
+            assert release.wait(timeout=5)
+        return make_response(event["path"])
+
+    responses = []
+    thread = threading.Thread(
+        target=lambda: responses.append(foo_handler(make_event("/nj/foo"), None))
+    )
+    thread.start()
+    assert started.wait(timeout=5)
+    event = dict(make_event("/nj/foo"), queryStringParameters={"foo": "bar"})
+    follower = threading.Thread(
+        target=lambda: responses.append(foo_handler(event, None))
+    )
+    follower.start()
+    while responsecachelib.request_coalescer.followers < 1:
+        time.sleep(0.001)
+    assert make_response("/nj/invalid") == foo_handler(make_event("/nj/invalid"), None)
+    release.set()
+    thread.join()
+    follower.join()
+    assert [make_response("/nj/foo")] * 2 == responses
+    assert 1 == responsecachelib.request_coalescer.followers
@@ -0,0 +1,212 @@
+import base64
+import io
+import json
+from http import HTTPStatus
+
+import pandas as pd
+import pytest
+
+from common_layer import responselib
+
+
+def test_table_version_1():
+    """table_version is stable, and changes with the table contents"""
+    tbl = pd.DataFrame({"GEOID": ["34001", "34003"], "row_number": [1, 2]})
+    version = responselib.table_version(tbl)
+    assert version == responselib.table_version(tbl.copy())
+    tbl.loc[1, "GEOID"] = "34005"
+    assert version != responselib.table_version(tbl)
+
+
+def test_parse_meta_only_1():
+    """parse_meta_only with and without the meta_only param"""
+    event = {"httpMethod": "GET"}
+    assert responselib.parse_meta_only(event, {}) is False
+    assert responselib.parse_meta_only(event, {"meta_only": "true"}) is True
+    assert responselib.parse_meta_only(event, {"meta_only": "False"}) is False
+
+
+def test_parse_meta_only_2():
+    """parse_meta_only HEAD requests and invalid params"""
+    assert responselib.parse_meta_only({"httpMethod": "HEAD"}, {}) is True
+    assert (
+        responselib.parse_meta_only({"httpMethod": "GET"}, {"meta_only": "1"}) is None
+    )
+
+
+def test_make_etag_1():
+    """make_etag depends on version, links and meta"""
+    links = {"self": "https://example.com/nj/counties"}
+    meta = {"record_count": 21, "page_count": 1}
+    etag = responselib.make_etag("v1", links, meta)
+    assert etag.startswith('W/"')
+    assert etag == responselib.make_etag("v1", links, dict(meta))
+    assert etag != responselib.make_etag("v2", links, meta)
+    assert etag != responselib.make_etag("v1", links, {"record_count": 20})
+
+
+def test_meta_result_1():
+    """meta_result returns links and meta, without data"""
+    links = {"self": "https://example.com/nj/counties"}
+    meta = {"record_count": 21, "page_count": 1}
+    result = responselib.meta_result(links, meta, 'W/"x"')
+    assert result["statusCode"] == HTTPStatus.OK
+    assert result["headers"]["ETag"] == 'W/"x"'
+    assert result["headers"]["X-Record-Count"] == "21"
+    assert result["headers"]["X-Page-Count"] == "1"
+    assert {"links": links, "meta": meta} == json.loads(result["body"])
+
+
+def test_meta_result_2():
+    """meta_result for HEAD requests has an empty body"""
+    result = responselib.meta_result({}, {"record_count": 21}, 'W/"x"', head=True)
+    assert result["body"] == ""
+    assert result["headers"]["X-Record-Count"] == "21"
+
+
+@pytest.fixture
+def result_set():
+    return pd.DataFrame(
+        {
+            "year": [2010, 2010],
+            "GEOID": ["3400100100", None],
+            "county": pd.Categorical(["Atlantic County", "Atlantic County"]),
+        }
+    )
+
+
+def test_negotiate_content_type_1():
+    """negotiate_content_type defaults to JSON:API"""
+    assert responselib.JSONAPI_CONTENT_TYPE == responselib.negotiate_content_type(
+        {"headers": None}
+    )
+    browser = "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"
+    assert responselib.JSONAPI_CONTENT_TYPE == responselib.negotiate_content_type(
+        {"headers": {"Accept": browser}}
+    )
+    assert responselib.JSONAPI_CONTENT_TYPE == responselib.negotiate_content_type(
+        {"headers": {"Accept": "application/xml"}}
+    )
+
+
+def test_negotiate_content_type_2():
+    """negotiate_content_type honors media types and quality values"""
+    assert responselib.CSV_CONTENT_TYPE == responselib.negotiate_content_type(
+        {"headers": {"accept": "text/csv"}}
+    )
+    assert responselib.CSV_CONTENT_TYPE == responselib.negotiate_content_type(
+        {"headers": {"Accept": "application/json;q=0.5, text/*"}}
+    )
+    assert responselib.JSONAPI_CONTENT_TYPE == responselib.negotiate_content_type(
+        {"headers": {"Accept": "application/json, text/csv;q=0.5"}}
+    )
+
+
+def test_make_render_key_1():
+    """make_render_key ignores query param order, and includes the content type"""
+    event = responselib.make_prewarm_event("/nj/municipalities/2025", {"year": "2025"})
+    assert (
+        "GET",
+        "/nj/municipalities/2025",
+        (),
+        responselib.JSONAPI_CONTENT_TYPE,
+    ) == responselib.make_render_key(event)
+    event_1 = dict(event, queryStringParameters={"page_size": "10", "sort": "GEOID"})
+    event_2 = dict(event, queryStringParameters={"sort": "GEOID", "page_size": "10"})
+    assert responselib.make_render_key(event_1) == responselib.make_render_key(event_2)
+    event_3 = dict(event, headers={"Accept": "text/csv"})
+    assert responselib.make_render_key(event) != responselib.make_render_key(event_3)
+
+
+def test_make_link_header_1():
+    """make_link_header basic test"""
+    links = {"self": "https://example.com/a?page_number=2", "next": "https://x/b"}
+    assert (
+        '<https://example.com/a?page_number=2>; rel="self", <https://x/b>; rel="next"'
+        == responselib.make_link_header(links)
+    )
+
+
+def test_formatted_result_1(result_set):
+    """formatted_result as CSV"""
+    result = responselib.formatted_result(
+        result_set,
+        {"self": "https://example.com/a"},
+        {"record_count": 2},
+        responselib.CSV_CONTENT_TYPE,
+    )
+    assert result["statusCode"] == HTTPStatus.OK
+    assert result["isBase64Encoded"] is False
+    assert result["headers"]["Content-Type"] == "text/csv"
+    assert result["headers"]["Link"] == '<https://example.com/a>; rel="self"'
+    assert result["headers"]["X-Record-Count"] == "2"
+    data = pd.read_csv(io.StringIO(result["body"]), dtype=str)
+    assert list(data.columns) == ["year", "GEOID", "county"]
+    assert list(data.GEOID.fillna("")) == ["3400100100", ""]
+
+
+def test_formatted_result_2(result_set):
+    """formatted_result as MessagePack"""
+    msgpack = pytest.importorskip("msgpack")
+    result = responselib.formatted_result(
+        result_set, {}, {}, responselib.MSGPACK_CONTENT_TYPE
+    )
+    assert result["isBase64Encoded"] is True
+    columns = msgpack.unpackb(base64.b64decode(result["body"]))
+    assert {
+        "year": [2010, 2010],
+        "GEOID": ["3400100100", None],
+        "county": ["Atlantic County", "Atlantic County"],
+    } == columns
+
+
+def test_formatted_result_3(result_set):
+    """formatted_result as an Arrow IPC stream"""
+    pyarrow = pytest.importorskip("pyarrow")
+    result = responselib.formatted_result(
+        result_set, {}, {}, responselib.ARROW_CONTENT_TYPE
+    )
+    assert result["isBase64Encoded"] is True
+    table = pyarrow.ipc.open_stream(base64.b64decode(result["body"])).read_all()
+    assert table.column_names == ["year", "GEOID", "county"]
+    assert table.column("GEOID").to_pylist() == ["3400100100", None]
+
+
+def test_formatted_result_4(result_set):
+    """formatted_result unsupported content type"""
+    with pytest.raises(ValueError):
+        responselib.formatted_result(result_set, {}, {}, "application/xml")
+
+
+def test_copy_response_1():
+    """copy_response copies the headers, so changing them leaves response alone"""
+    response = {"statusCode": 200, "headers": {"ETag": "x"}, "body": "{}"}
+    copied = responselib.copy_response(response)
+    copied["headers"]["ETag"] = "y"
+    assert {"statusCode": 200, "headers": {"ETag": "x"}, "body": "{}"} == response
+    assert {"statusCode": 200} == responselib.copy_response({"statusCode": 200})
+
+
+def test_process_params_once_1():
+    """process_params_once reuses the params of an event only within params_memoized"""
+    calls = []
+
+    def process_params(event):
+        calls.append(event)
+        return HTTPStatus.OK, None, {"page_size": event["page_size"]}
+
+    event = {"path": "/nj/counties", "page_size": 10}
+    with responselib.params_memoized():
+        key = responselib.make_params_key(process_params, event)
+        with responselib.params_memoized():
+            assert key == responselib.make_params_key(process_params, event)
+        _, _, params = responselib.process_params_once(process_params, event)
+        assert {"page_size": 10} == params
+        assert 1 == len(calls)
+        responselib.process_params_once(process_params, dict(event))
+        assert 2 == len(calls)
+    event["page_size"] = 20
+    _, _, params = responselib.process_params_once(process_params, event)
+    assert {"page_size": 20} == params
+    responselib.process_params_once(process_params, event)
+    assert 4 == len(calls)
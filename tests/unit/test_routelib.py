@@ -0,0 +1,95 @@
+import pytest
+
+from common_layer import routelib
+
+ROUTES = routelib.compile_routes(
+    ["/nj/municipalities/{year}", "/nj/municipalities/{year}/{GEOID}"],
+    {"year": r"\d{4}", "GEOID": r"\d{10}"},
+)
+
+
+def test_compile_routes_1():
+    """compile_routes lists the parameters of each route"""
+    assert [] == [name for name, _ in routelib.compile_routes(["/nj/a"], {})["/nj/a"]]
+    assert ["year", "GEOID"] == [
+        name for name, _ in ROUTES["/nj/municipalities/{year}/{GEOID}"]
+    ]
+
+
+def test_compile_routes_2():
+    """compile_routes rejects parameters without a pattern"""
+    with pytest.raises(ValueError):
+        routelib.compile_routes(
+            ["/nj/municipalities/{year}/{GEOID}"], {"year": r"\d{4}"}
+        )
+
+
+def test_find_invalid_path_parameter_1():
+    """find_invalid_path_parameter checks the parameters of the event route"""
+    event = {
+        "resource": "/nj/municipalities/{year}/{GEOID}",
+        "pathParameters": {"year": "2010", "GEOID": "3400108680"},
+    }
+    assert routelib.find_invalid_path_parameter(ROUTES, event) is None
+    event["pathParameters"]["GEOID"] = "34001"
+    assert ("GEOID", "34001") == routelib.find_invalid_path_parameter(ROUTES, event)
+    event["pathParameters"]["year"] = "20100"
+    assert ("year", "20100") == routelib.find_invalid_path_parameter(ROUTES, event)
+
+
+def test_find_invalid_path_parameter_2():
+    """find_invalid_path_parameter checks every known parameter for other resources"""
+    event = {"resource": "/{proxy+}", "pathParameters": {"year": "x"}}
+    assert ("year", "x") == routelib.find_invalid_path_parameter(ROUTES, event)
+    event["pathParameters"] = None
+    assert routelib.find_invalid_path_parameter(ROUTES, event) is None
+
+
+def test_match_route_1():
+    """match_route returns the template and path parameters of a path"""
+    routes = dict(ROUTES, **{"/nj/municipalities/history/{GEOID}": ()})
+    assert ("/nj/municipalities/{year}", {"year": "2010"}) == routelib.match_route(
+        routes, "/nj/municipalities/2010/"
+    )
+    assert (
+        "/nj/municipalities/history/{GEOID}",
+        {"GEOID": "3400100100"},
+    ) == routelib.match_route(routes, "nj/municipalities/history/3400100100")
+    assert ("/nj/municipalities/{year}/{GEOID}", {"year": "x", "GEOID": "y"}) == (
+        routelib.match_route(routes, "/nj/municipalities/x/y")
+    )
+    assert routelib.match_route(routes, "/nj/counties") is None
+    assert routelib.match_route(routes, "/nj/municipalities//3400100100") is None
+
+
+def test_memoize_links_and_meta_1():
+    """memoize_links_and_meta caches by path and pagination, and returns copies"""
+    calls = []
+
+    def make_links_and_meta(aux, path):
+        calls.append((path, aux["page_number"]))
+        return {"self": f"{path}?page_number={aux['page_number']}"}, {"page_count": 2}
+
+    memoized = routelib.memoize_links_and_meta(make_links_and_meta)
+    aux = {"page_size": 100, "page_number": 1, "record_count": 150, "year": 2010}
+    links, meta = memoized(aux, "nj/municipalities/2010")
+    links["self"] = "modified"
+    assert ({"self": "nj/municipalities/2010?page_number=1"}, {"page_count": 2}) == (
+        memoized(dict(aux, year=2011), "nj/municipalities/2010")
+    )
+    memoized(dict(aux, page_number=2), "nj/municipalities/2010")
+    assert [("nj/municipalities/2010", 1), ("nj/municipalities/2010", 2)] == calls
+
+
+def test_memoize_links_and_meta_2():
+    """memoize_links_and_meta evicts the least recently used result"""
+    calls = []
+
+    def make_links_and_meta(aux, path):
+        calls.append(path)
+        return {}, {}
+
+    memoized = routelib.memoize_links_and_meta(make_links_and_meta, maxsize=2)
+    for path in ["a", "b", "a", "c", "a", "b"]:
+        memoized({}, path)
+    assert ["a", "b", "c", "b"] == calls
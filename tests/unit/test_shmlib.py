@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from common_layer import shmlib
+from common_layer.tablelib import compact_table
+
+
+@pytest.fixture
+def table():
+    return compact_table(
+        pd.DataFrame(
+            {
+                "row_number": [1, 2, 3],
+                "GEOID": ["3400100100", "3400100200", None],
+                "first_year": [2000, 2000, 2010],
+                "county": ["Atlantic County", "Bergen County", "Atlantic County"],
+            }
+        ),
+        {"row_number": "int32", "first_year": "int16", "county": "category"},
+        ["GEOID"],
+    )
+
+
+def test_publish_table_1(tmp_path, table):
+    """attach_table returns the published table"""
+    version = shmlib.publish_table(table, tmp_path, "foo")
+    assert version == shmlib.published_version(tmp_path, "foo")
+    attached_version, attached = shmlib.attach_table(tmp_path, "foo")
+    assert version == attached_version
+    pd.testing.assert_frame_equal(table, attached)
+
+
+def test_publish_table_2(tmp_path, table):
+    """attach_table maps numeric columns read-only"""
+    shmlib.publish_table(table, tmp_path, "foo")
+    _, attached = shmlib.attach_table(tmp_path, "foo")
+    row_numbers = attached["row_number"].to_numpy()
+    assert not row_numbers.flags.writeable
+    base = row_numbers
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    assert isinstance(base, np.memmap)
+
+
+def test_publish_table_3(tmp_path, table):
+    """A new version replaces the current one, and old versions are removed"""
+    versions = [shmlib.publish_table(table, tmp_path, "foo") for _ in range(2)]
+    _, attached = shmlib.attach_table(tmp_path, "foo")
+    versions.append(
+        shmlib.publish_table(table.assign(first_year=2020), tmp_path, "foo")
+    )
+    assert versions[2] == shmlib.published_version(tmp_path, "foo")
+    assert [2000, 2000, 2010] == list(attached["first_year"])
+    assert [2020] * 3 == list(shmlib.attach_table(tmp_path, "foo")[1]["first_year"])
+    assert sorted(versions[1:] + ["foo.current"]) == sorted(os.listdir(tmp_path))
+
+
+def test_attach_table_1(tmp_path):
+    """attach_table with nothing published"""
+    assert shmlib.published_version(tmp_path, "foo") is None
+    with pytest.raises(FileNotFoundError):
+        shmlib.attach_table(tmp_path, "foo")
@@ -0,0 +1,112 @@
+import json
+
+import boto3
+import pandas as pd
+import pytest
+
+from common_layer.ddblib import pd_to_ddb_itemlist
+from municipalities.app import municipalities_data, municipalities_lib
+from tools import synthetic_data
+
+
+@pytest.fixture
+def counties():
+    return synthetic_data.generate_counties_table(counties=60, states=3)
+
+
+@pytest.fixture
+def municipalities(counties):
+    return synthetic_data.generate_municipalities_table(3000, counties, seed=1)
+
+
+def test_generate_counties_table_1(counties):
+    """generate_counties_table generates distinct five-digit GEOIDs"""
+    assert synthetic_data.COUNTIES_COLUMNS == list(counties.columns)
+    assert 60 == counties["GEOID"].nunique()
+    assert counties["GEOID"].str.fullmatch(r"\d{5}").all()
+    assert counties["GEOID"].is_monotonic_increasing
+    assert list(range(1, 61)) == list(counties["row_number"])
+
+
+def test_generate_municipalities_table_1(counties, municipalities):
+    """generate_municipalities_table generates consistent lineages"""
+    assert synthetic_data.MUNICIPALITIES_COLUMNS == list(municipalities.columns)
+    assert 3000 == municipalities["GEOID_Y2K"].nunique()
+    assert municipalities["GEOID"].str.fullmatch(r"\d{10}").all()
+    assert set(municipalities["county"]) <= set(counties["county"])
+    first_year = municipalities["first_year"].astype(int)
+    final_year = municipalities["final_year"].astype(int)
+    assert (first_year <= final_year).all()
+    assert first_year.min() == 2000 and final_year.max() == 2025
+
+    # Intervals in a lineage do not overlap, and each year has one GEOID
+    previous_final_year = final_year.groupby(municipalities["GEOID_Y2K"]).shift()
+    assert (previous_final_year.isna() | (previous_final_year < first_year)).all()
+    assert not municipalities.duplicated(["GEOID", "first_year"]).any()
+
+
+def test_generate_municipalities_table_3(municipalities):
+    """Every merged place has a successor in its county, named for both"""
+    final_year = municipalities["final_year"].astype(int)
+    merged = municipalities[
+        (final_year < 2025)
+        & ~municipalities["GEOID_Y2K"].duplicated(keep=False)
+        & (municipalities["first_year"] == "2000")
+    ]
+    assert len(merged)
+    for row in merged.itertuples():
+        successor = municipalities[
+            (municipalities["county"] == row.county)
+            & (municipalities["first_year"] == str(int(row.final_year) + 1))
+            & municipalities["municipality"].str.endswith(f" and {row.municipality}")
+        ]
+        assert 1 == len(successor)
+
+
+def test_generate_tables_1(counties):
+    """The generators reject sizes whose codes do not fit in the GEOIDs"""
+    with pytest.raises(ValueError):
+        synthetic_data.generate_counties_table(counties=501, states=1)
+    with pytest.raises(ValueError):
+        synthetic_data.generate_counties_table(counties=100, states=51)
+    one_county = synthetic_data.generate_counties_table(counties=1, states=1)
+    tbl = synthetic_data.generate_municipalities_table(4999, one_county)
+    assert tbl["GEOID"].str.fullmatch(r"\d{10}").all()
+    with pytest.raises(ValueError):
+        synthetic_data.generate_municipalities_table(5000, one_county)
+
+
+def test_generate_municipalities_table_2(monkeypatch, municipalities):
+    """Generated items build into a municipalities table with every kind of change"""
+
+    class MockClient:
+        @staticmethod
+        def scan(TableName):
+            return {"Items": pd_to_ddb_itemlist(municipalities)}
+
+    monkeypatch.setattr(boto3, "client", lambda *args, **kwargs: MockClient())
+    tbl = municipalities_data.build_municipalities_table("foo")
+    assert len(municipalities) == len(tbl)
+
+    changes = municipalities_lib.build_changes_table(tbl, 2000, 2025)
+    assert {"added", "removed", "recoded", "renamed"} == set(changes["change_type"])
+    year_counts = municipalities_lib.build_year_counts(tbl)
+    assert list(range(2000, 2026)) == list(year_counts)
+
+
+def test_write_table_1(tmp_path, municipalities):
+    """write_table writes each format, and rejects unknown formats"""
+    path = synthetic_data.write_table(municipalities, tmp_path / "m", "csv")
+    pd.testing.assert_frame_equal(
+        municipalities,
+        pd.read_csv(path, dtype=str).astype({"row_number": int}),
+    )
+    path = synthetic_data.write_table(municipalities, tmp_path / "m", "pickle")
+    pd.testing.assert_frame_equal(municipalities, pd.read_pickle(path))
+    path = synthetic_data.write_table(municipalities, tmp_path / "m", "ddb")
+    with open(path) as f:
+        items = json.load(f)["Items"]
+    assert {"N": "1"} == items[0]["row_number"]
+    assert {"S": municipalities["first_year"].iat[0]} == items[0]["first_year"]
+    with pytest.raises(ValueError):
+        synthetic_data.write_table(municipalities, tmp_path / "m", "xml")
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from common_layer import tablelib
+
+
+def test_intern_string_1():
+    """intern_string returns one object for equal strings, and passes others through"""
+    a = "".join(["34", "001"])
+    b = "".join(["340", "01"])
+    assert a is not b
+    assert tablelib.intern_string(a) is tablelib.intern_string(b)
+    assert tablelib.intern_string(None) is None
+    assert np.isnan(tablelib.intern_string(np.nan))
+
+
+def test_compact_table_1():
+    """compact_table converts dtypes and interns strings across columns"""
+    tbl = pd.DataFrame(
+        {
+            "row_number": [1, 2],
+            "GEOID": ["".join(["34", "001"]), "34003"],
+            "GEOID_Y2K": ["".join(["340", "01"]), "34005"],
+            "first_year": [2000, 2001],
+            "county": ["Foo County", "Bar County"],
+        }
+    )
+    result = tablelib.compact_table(
+        tbl,
+        {"row_number": "int32", "first_year": "int16", "county": "category"},
+        ["GEOID", "GEOID_Y2K"],
+    )
+    expected = pd.DataFrame(
+        {
+            "row_number": np.array([1, 2], dtype=np.int32),
+            "GEOID": ["34001", "34003"],
+            "GEOID_Y2K": ["34001", "34005"],
+            "first_year": np.array([2000, 2001], dtype=np.int16),
+            "county": pd.Categorical(["Foo County", "Bar County"]),
+        }
+    )
+    pd.testing.assert_frame_equal(expected, result)
+    assert result["GEOID"].iloc[0] is result["GEOID_Y2K"].iloc[0]
+    assert tbl["row_number"].dtype == np.int64
+
+
+def test_compact_table_2():
+    """compact_table ignores missing columns and keeps missing values"""
+    tbl = pd.DataFrame({"GEOID": ["34001", None]})
+    result = tablelib.compact_table(tbl, {"first_year": "int16"}, ["GEOID", "county"])
+    pd.testing.assert_frame_equal(tbl, result)
+
+
+def test_table_footprint_1():
+    """table_footprint counts shared objects once"""
+    shared = pd.DataFrame({"a": ["x" * 100] * 10, "b": np.zeros(10, dtype=np.int16)})
+    distinct = pd.DataFrame(
+        {"a": ["x" * 99 + str(i) for i in range(10)], "b": np.zeros(10, dtype=np.int16)}
+    )
+    footprint = tablelib.table_footprint(shared)
+    assert footprint["columns"]["b"] == 20
+    assert (
+        footprint["columns"]["a"] < tablelib.table_footprint(distinct)["columns"]["a"]
+    )
+    assert footprint["total"] == sum(footprint["columns"].values()) + footprint["index"]
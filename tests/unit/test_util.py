@@ -0,0 +1,36 @@
+from common_layer import util
+
+
+def test_un_none_1():
+    """un_none replaces None with default"""
+    assert {} == util.un_none(None, {})
+    assert {"a": 1} == util.un_none({"a": 1}, {})
+
+
+def test_add_query_to_links_1():
+    """add_query_to_links appends to links with and without queries"""
+    links = {
+        "self": "https://example.com/nj/municipalities/2010?page_number=1",
+        "first": "https://example.com/nj/municipalities/2010",
+    }
+    result = util.add_query_to_links(links, {"filter[county]": "A B"})
+    assert {
+        "self": "https://example.com/nj/municipalities/2010?page_number=1&filter%5Bcounty%5D=A+B",
+        "first": "https://example.com/nj/municipalities/2010?filter%5Bcounty%5D=A+B",
+    } == result
+
+
+def test_add_query_to_links_2():
+    """add_query_to_links with empty query"""
+    links = {"self": "https://example.com/nj/counties"}
+    assert links == util.add_query_to_links(links, {})
+
+
+def test_env_flag_1(monkeypatch):
+    """env_flag is True only for "true", ignoring case"""
+    monkeypatch.delenv("PREWARM", raising=False)
+    assert not util.env_flag("PREWARM")
+    monkeypatch.setenv("PREWARM", "True")
+    assert util.env_flag("PREWARM")
+    monkeypatch.setenv("PREWARM", "1")
+    assert not util.env_flag("PREWARM")
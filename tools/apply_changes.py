@@ -0,0 +1,43 @@
+"""
+Applies a replay file of changes to the published municipalities table
+
+Hosts that run several worker processes share one copy of the table,
+published to a directory such as /dev/shm/nj (see SHARED_TABLE_DIR).  This
+patches the table with DynamoDB Streams style change records, such as those
+saved by tools/bulk_load.py with --changes, and publishes the patched
+table, instead of rescanning DynamoDB.  Workers switch to it on their next
+version check, and build its indexes as for any new version.
+
+Usage, with common_layer on PYTHONPATH, and SHARED_TABLE_DIR set to the
+directory of the published table (or TABLE_MUNICIPALITIES, to scan it):
+
+    python -m tools.apply_changes changes.jsonl --shared-dir /dev/shm/nj
+"""
+
+import argparse
+import os
+
+from ddblib import ddb_read_stream_records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path", help="Replay file of change records")
+    parser.add_argument(
+        "--shared-dir",
+        default=os.environ.get("SHARED_TABLE_DIR"),
+        help="Directory of published tables",
+    )
+    args = parser.parse_args(argv)
+    if not args.shared_dir:
+        parser.error("--shared-dir or SHARED_TABLE_DIR is required")
+
+    from municipalities.app.municipalities_data import publish_municipalities_changes
+
+    records = ddb_read_stream_records(args.path)
+    count, version = publish_municipalities_changes(args.shared_dir, records)
+    print(f"municipalities: {count} changed rows, published {version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Loads a CSV dump into a DynamoDB table, writing only the changed items
+
+The CSV is in the format used by ImportSourceSpecification in template.yaml:
+a header row, a numeric key column (row_number) and string attributes.  The
+current table is scanned and diffed with the CSV by key, and then changed
+and new items are put, and items missing from the CSV are deleted, with
+parallel BatchWriteItem calls.  Unprocessed items and throttled requests are
+retried with exponential backoff.  If anything was written, the version
+marker of the table in the versions table is incremented, so that warm
+Lambda containers know to refresh their cached copy.
+
+Usage, with common_layer on PYTHONPATH:
+
+    python -m tools.bulk_load --table municipalities --versions-table versions \\
+        municipalities.csv
+
+Use --endpoint-url to load into DynamoDB Local, and --dry-run to report the
+diff without writing.  With --changes, the changes written are also saved
+as a replay file of DynamoDB Streams style records, for tools/apply_changes.py.
+"""
+
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pandas as pd
+from botocore.exceptions import ClientError
+from ddblib import ddb_bump_version, ddb_scan_items, pd_to_ddb_itemlist
+
+# Maximum number of requests in a BatchWriteItem call
+BATCH_SIZE = 25
+
+# Error codes of BatchWriteItem failures that are retried
+RETRYABLE_ERRORS = {
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "ThrottlingException",
+    "InternalServerError",
+}
+
+
+def read_csv_items(path, key="row_number"):
+    """
+    Reads a CSV dump as a DynamoDB 'Items' list
+
+    Args:
+        path: CSV file path
+        key: numeric key column
+
+    Returns:
+        'Item' list, with key encoded as a number and other columns as strings
+    """
+    tbl = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return pd_to_ddb_itemlist(tbl, [key])
+
+
+def diff_items(current_items, new_items, key="row_number"):
+    """
+    Compares the items of a table with a new set of items
+
+    Args:
+        current_items: 'Item' list of the table
+        new_items: 'Item' list to load
+        key: key attribute
+
+    Returns:
+        list of items to put, because they are new or changed
+        list of keys to delete, because they are not in new_items
+    """
+    current = {item[key]["N"]: item for item in current_items}
+    new = {item[key]["N"]: item for item in new_items}
+    puts = [item for value, item in new.items() if current.get(value, None) != item]
+    deletes = [{key: {"N": value}} for value in current if value not in new]
+    return puts, deletes
+
+
+def make_stream_records(current_items, puts, deletes, key="row_number"):
+    """
+    Returns DynamoDB Streams style change records of items to put and keys to delete
+
+    Args:
+        current_items: 'Item' list of the table, before the change
+        puts: items to put, from diff_items
+        deletes: keys to delete, from diff_items
+        key: key attribute
+
+    Returns:
+        list of change records, as read by ddb_read_stream_records
+    """
+    current = {item[key]["N"] for item in current_items}
+    records = [
+        {
+            "eventName": "MODIFY" if item[key]["N"] in current else "INSERT",
+            "dynamodb": {"Keys": {key: item[key]}, "NewImage": item},
+        }
+        for item in puts
+    ]
+    records += [{"eventName": "REMOVE", "dynamodb": {"Keys": keys}} for keys in deletes]
+    return records
+
+
+def write_stream_records(records, path):
+    """Writes change records as a replay file, one JSON record per line"""
+    with open(path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def make_write_requests(puts, deletes):
+    """Returns the BatchWriteItem requests for items to put and keys to delete"""
+    return [{"PutRequest": {"Item": item}} for item in puts] + [
+        {"DeleteRequest": {"Key": key}} for key in deletes
+    ]
+
+
+def backoff_delay(attempt, base_delay=0.05, max_delay=5.0):
+    """Returns the delay before a retry, with exponential backoff and full jitter"""
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+def write_batch(client, table_name, requests, max_attempts=8, sleep=time.sleep):
+    """
+    Writes up to BATCH_SIZE requests with BatchWriteItem, retrying failures
+
+    Unprocessed items, and the whole batch on a throttling or internal
+    error, are retried with exponential backoff.
+
+    Args:
+        client: boto3 DynamoDB client
+        table_name: table name
+        requests: list of PutRequest and DeleteRequest dicts
+        max_attempts: maximum number of BatchWriteItem calls
+        sleep: function used to wait between attempts
+
+    Returns:
+        number of BatchWriteItem calls made
+
+    Raises:
+        RuntimeError if some requests are still unprocessed after max_attempts
+    """
+    for attempt in range(max_attempts):
+        if attempt > 0:
+            sleep(backoff_delay(attempt))
+        try:
+            data = client.batch_write_item(RequestItems={table_name: requests})
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in RETRYABLE_ERRORS:
+                raise
+            continue
+        requests = data.get("UnprocessedItems", {}).get(table_name, [])
+        if not requests:
+            return attempt + 1
+    raise RuntimeError(
+        f"{len(requests)} writes to {table_name} unprocessed after {max_attempts} attempts"
+    )
+
+
+def write_requests(client, table_name, requests, max_workers=8, **kwargs):
+    """
+    Writes requests in parallel batches of BATCH_SIZE
+
+    Args:
+        client: boto3 DynamoDB client, which is shared between threads
+        table_name: table name
+        requests: list of PutRequest and DeleteRequest dicts
+        max_workers: number of concurrent BatchWriteItem calls
+        kwargs: passed to write_batch
+
+    Returns:
+        number of BatchWriteItem calls made
+    """
+    batches = [
+        requests[offset : offset + BATCH_SIZE]
+        for offset in range(0, len(requests), BATCH_SIZE)
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        calls = executor.map(
+            lambda batch: write_batch(client, table_name, batch, **kwargs), batches
+        )
+        return sum(calls)
+
+
+def bulk_load(
+    client,
+    table_name,
+    path,
+    versions_table=None,
+    key="row_number",
+    total_segments=1,
+    max_workers=8,
+    dry_run=False,
+    changes_path=None,
+):
+    """
+    Loads a CSV dump into a table, writing only the changed items
+
+    Args:
+        client: boto3 DynamoDB client
+        table_name: table name
+        path: CSV file path
+        versions_table: Optional versions table, whose marker for table_name
+            is incremented if anything is written
+        key: numeric key column
+        total_segments: number of segments to scan concurrently
+        max_workers: number of concurrent BatchWriteItem calls
+        dry_run: If True, compute the diff but do not write
+        changes_path: Optional replay file for the change records of the
+            items written
+
+    Returns:
+        dict with the "puts" and "deletes" counts, and the new "version" (or
+        None if the version was not changed)
+    """
+    new_items = read_csv_items(path, key)
+    current_items = ddb_scan_items(client, table_name, total_segments)
+    puts, deletes = diff_items(current_items, new_items, key)
+    summary = {"puts": len(puts), "deletes": len(deletes), "version": None}
+    if dry_run or not (puts or deletes):
+        return summary
+    write_requests(client, table_name, make_write_requests(puts, deletes), max_workers)
+    if changes_path is not None:
+        records = make_stream_records(current_items, puts, deletes, key)
+        write_stream_records(records, changes_path)
+    if versions_table is not None:
+        summary["version"] = ddb_bump_version(client, versions_table, table_name)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path", help="CSV dump to load")
+    parser.add_argument("--table", required=True, help="DynamoDB table name")
+    parser.add_argument("--versions-table", help="Table of version markers")
+    parser.add_argument("--key", default="row_number")
+    parser.add_argument("--segments", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--endpoint-url", help="e.g. http://localhost:8000")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--changes", help="Replay file for the changes written")
+    args = parser.parse_args(argv)
+
+    client = boto3.client("dynamodb", endpoint_url=args.endpoint_url)
+    summary = bulk_load(
+        client,
+        args.table,
+        args.path,
+        args.versions_table,
+        args.key,
+        args.segments,
+        args.workers,
+        args.dry_run,
+        args.changes,
+    )
+    print(
+        f"{args.table}: {summary['puts']} puts, {summary['deletes']} deletes"
+        + ("" if summary["version"] is None else f", version {summary['version']}")
+        + (" (dry run)" if args.dry_run else "")
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Pre-renders every enumerable API response as a static file
+
+The dataset changes about once a year, so the responses to the plain GET
+requests can be enumerated and served from object storage or a CDN without
+invoking the functions.  The responses are rendered by the API handlers,
+in-process, in a pool of worker processes:
+
+    counties: the list, at each page size, and each county
+    municipalities: the list for each year, at each page size, and each
+        municipality in each year
+    history: each GEOID
+    xrefs and changes: each ordered pair of years
+
+Every page of a paginated response is rendered, following the page count in
+its meta block.  Year ranges, filters, sorts and xref panels are not
+enumerated, and are left to the functions.
+
+Files mirror the API paths: the response to /nj/municipalities/2010 is in
+nj/municipalities/2010/index.json, and the response to
+/nj/municipalities/2010?page_size=50&page_number=2 is in
+nj/municipalities/2010/page_number=2&page_size=50.json (query params in
+sorted order).  manifest.json lists every file with its API path, query,
+content type, size and SHA-256, and the versions of the tables.
+
+Usage, with common_layer and the torguapi layer on PYTHONPATH, and
+TABLE_COUNTIES and TABLE_MUNICIPALITIES set as for the functions:
+
+    python -m tools.prerender --out static/ --page-sizes 10,25,50,100
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlencode
+
+# Name of the manifest in the output directory
+MANIFEST = "manifest.json"
+
+# Number of tasks sent to a worker process at a time
+CHUNK_SIZE = 64
+
+
+def load_handlers():
+    """Returns the API handlers, by route name"""
+    from counties.app.counties_api import counties_handler
+    from municipalities.app.municipalities_api import (
+        changes_handler,
+        history_handler,
+        municipalities_handler,
+        xref_handler,
+    )
+
+    return {
+        "counties_handler": counties_handler,
+        "municipalities_handler": municipalities_handler,
+        "history_handler": history_handler,
+        "xref_handler": xref_handler,
+        "changes_handler": changes_handler,
+    }
+
+
+def make_event(resource, path_parameters=None, query_parameters=None):
+    """
+    Returns a GET API Gateway event for a route
+
+    Args:
+        resource: route template, such as "/nj/municipalities/{year}"
+        path_parameters: Optional dict of path params
+        query_parameters: Optional dict of query params
+
+    Returns:
+        API Gateway event
+    """
+    return {
+        "httpMethod": "GET",
+        "resource": resource,
+        "path": resource.format(**(path_parameters or {})),
+        "pathParameters": path_parameters,
+        "queryStringParameters": query_parameters,
+        "headers": {},
+    }
+
+
+def static_file_name(event):
+    """Returns the file of the response to an event, relative to the output"""
+    query_parameters = event.get("queryStringParameters", None)
+    name = urlencode(sorted(query_parameters.items())) if query_parameters else "index"
+    return f"{event['path'].strip('/')}/{name}.json"
+
+
+def enumerate_tasks(counties, municipalities, years, page_sizes):
+    """
+    Returns the first page of every enumerable response
+
+    Args:
+        counties: counties table
+        municipalities: municipalities table
+        years: years of the dataset
+        page_sizes: page sizes at which the lists are rendered, as well as
+            the default
+
+    Returns:
+        list of (route name, event) tasks
+    """
+    paged = [None] + [{"page_size": str(page_size)} for page_size in page_sizes]
+    tasks = [("counties_handler", make_event("/nj/counties", None, q)) for q in paged]
+    tasks.extend(
+        ("counties_handler", make_event("/nj/counties/{GEOID}", {"GEOID": GEOID}))
+        for GEOID in counties["GEOID"]
+    )
+    tasks.extend(
+        ("municipalities_handler", make_event("/nj/municipalities", None, q))
+        for q in paged
+    )
+    for year in years:
+        tasks.extend(
+            (
+                "municipalities_handler",
+                make_event("/nj/municipalities/{year}", {"year": str(year)}, q),
+            )
+            for q in paged
+        )
+    for GEOID, first_year, final_year in zip(
+        municipalities["GEOID"],
+        municipalities["first_year"],
+        municipalities["final_year"],
+    ):
+        if GEOID is None:
+            continue
+        tasks.extend(
+            (
+                "municipalities_handler",
+                make_event(
+                    "/nj/municipalities/{year}/{GEOID}",
+                    {"year": str(year), "GEOID": GEOID},
+                ),
+            )
+            for year in range(int(first_year), int(final_year) + 1)
+        )
+    tasks.extend(
+        (
+            "history_handler",
+            make_event("/nj/municipalities/history/{GEOID}", {"GEOID": GEOID}),
+        )
+        for GEOID in sorted(municipalities["GEOID"].dropna().unique())
+    )
+    for route, resource in [
+        ("xref_handler", "/nj/municipality_xrefs/{year_ref}/{year}"),
+        ("changes_handler", "/nj/municipality_changes/{year_ref}/{year}"),
+    ]:
+        tasks.extend(
+            (route, make_event(resource, {"year_ref": str(ref), "year": str(year)}))
+            for ref in years
+            for year in years
+        )
+    return tasks
+
+
+def next_page_tasks(entries):
+    """
+    Returns the later pages of first-page responses
+
+    Args:
+        entries: manifest entries of rendered responses
+
+    Returns:
+        list of (route name, event) tasks
+    """
+    tasks = []
+    for entry in entries:
+        query_parameters = entry["query"] or {}
+        if entry["page_count"] <= 1 or "page_number" in query_parameters:
+            continue
+        for page_number in range(2, entry["page_count"] + 1):
+            query = dict(query_parameters, page_number=str(page_number))
+            tasks.append(
+                (
+                    entry["route"],
+                    make_event(entry["resource"], entry["path_parameters"], query),
+                )
+            )
+    return tasks
+
+
+def render_task(task, out_dir, handlers=None):
+    """
+    Renders a response with its handler, and writes it to out_dir
+
+    Args:
+        task: (route name, event)
+        out_dir: output directory
+        handlers: Optional dict of handlers by route name.  Defaults to the
+            API handlers.
+
+    Returns:
+        manifest entry, or None if the response was not successful
+    """
+    route, event = task
+    handlers = load_handlers() if handlers is None else handlers
+    response = handlers[route](event, None)
+    if response["statusCode"] != 200:
+        return None
+    body = response["body"].encode()
+    file_name = static_file_name(event)
+    path = os.path.join(out_dir, file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(body)
+    headers = response.get("headers", None) or {}
+    meta = json.loads(body).get("meta", {}) if body else {}
+    return {
+        "file": file_name,
+        "route": route,
+        "resource": event["resource"],
+        "path": event["path"],
+        "path_parameters": event["pathParameters"],
+        "query": event["queryStringParameters"],
+        "content_type": headers.get("Content-Type", "application/vnd.api+json"),
+        "bytes": len(body),
+        "sha256": hashlib.sha256(body).hexdigest(),
+        "page_count": int(meta.get("page_count", 1)),
+    }
+
+
+def prerender(tasks, out_dir, map_tasks=map, render=render_task):
+    """
+    Renders tasks and all their later pages
+
+    Args:
+        tasks: list of (route name, event) first-page tasks
+        out_dir: output directory
+        map_tasks: map-like function used to run render over the tasks
+        render: function of (task, out_dir) returning a manifest entry or None
+
+    Returns:
+        list of manifest entries
+        number of tasks that were not rendered, because they failed
+    """
+    render = functools.partial(render, out_dir=out_dir)
+    entries = []
+    skipped = 0
+    while tasks:
+        rendered = list(map_tasks(render, tasks))
+        skipped += sum(entry is None for entry in rendered)
+        rendered = [entry for entry in rendered if entry is not None]
+        entries.extend(rendered)
+        tasks = next_page_tasks(rendered)
+    return entries, skipped
+
+
+def write_manifest(entries, out_dir, versions):
+    """
+    Writes the manifest of rendered files to out_dir
+
+    Args:
+        entries: manifest entries from prerender
+        out_dir: output directory
+        versions: dict of table versions
+
+    Returns:
+        path of the manifest
+    """
+    files = {
+        entry["file"]: {
+            key: entry[key]
+            for key in ("path", "query", "content_type", "bytes", "sha256")
+        }
+        for entry in sorted(entries, key=lambda entry: entry["file"])
+    }
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path, "w") as f:
+        json.dump({"versions": versions, "files": files}, f, indent=1)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--page-sizes", default="10,25,50,100")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+
+    from counties.app.counties_data import get_counties_snapshot
+    from municipalities.app.municipalities_data import get_municipalities_snapshot
+
+    # Load the tables before starting the pool, so that the forked workers
+    # share them instead of each scanning DynamoDB
+    counties_snapshot = get_counties_snapshot()
+    municipalities_snapshot = get_municipalities_snapshot()
+    counties = counties_snapshot["table"]
+    municipalities = municipalities_snapshot["table"]
+    indexes = municipalities_snapshot["indexes"]
+    versions = {
+        "counties": counties_snapshot["indexes"]["version"],
+        "municipalities": indexes["version"],
+    }
+    page_sizes = [int(page_size) for page_size in args.page_sizes.split(",")]
+    tasks = enumerate_tasks(
+        counties, municipalities, sorted(indexes["year_counts"]), page_sizes
+    )
+    with ProcessPoolExecutor(
+        max_workers=args.workers, mp_context=multiprocessing.get_context("fork")
+    ) as executor:
+        entries, skipped = prerender(
+            tasks,
+            args.out,
+            functools.partial(executor.map, chunksize=CHUNK_SIZE),
+        )
+    write_manifest(entries, args.out, versions)
+    print(
+        f"{len(entries)} files, {sum(entry['bytes'] for entry in entries)} bytes"
+        + (f", {skipped} not found" if skipped else "")
+    )
+
+
+if __name__ == "__main__":
+    main()
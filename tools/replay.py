@@ -0,0 +1,193 @@
+"""
+Replays captured API invocations, and reports latency percentiles per route
+
+Invocations are captured by the handlers with CAPTURE_SAMPLE_RATE set (see
+common_layer/capturelib.py), as JSON log lines.  The captured events are
+sent, in the captured mix of routes, to the handlers in-process or to an
+HTTP host such as `sam local start-api`, from a pool of concurrent workers.
+
+Usage, with common_layer and the torguapi layer on PYTHONPATH:
+
+    python -m tools.replay captures.log --concurrency 8 --repeat 10
+    python -m tools.replay captures.log --url http://127.0.0.1:3000
+
+The in-process handlers read their tables from the DynamoDB tables named by
+TABLE_COUNTIES and TABLE_MUNICIPALITIES, as in the deployed functions.
+"""
+
+import argparse
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import numpy as np
+from capturelib import read_captures
+
+# Latency percentiles in the report
+PERCENTILES = [50, 90, 99]
+
+
+def in_process_handlers():
+    """Returns the handlers of the captured routes, by route name"""
+    from counties.app.counties_api import counties_handler
+    from municipalities.app.municipalities_api import (
+        municipalities_handler,
+        xref_handler,
+    )
+
+    return {
+        "counties_handler": counties_handler,
+        "municipalities_handler": municipalities_handler,
+        "xref_handler": xref_handler,
+    }
+
+
+def make_in_process_sender(handlers):
+    """
+    Returns a function that invokes the handler of a capture in-process
+
+    Args:
+        handlers: dict of handler by route name
+
+    Returns:
+        function of a capture record, returning the response status code
+    """
+
+    def send(capture):
+        return handlers[capture["capture"]](capture["event"], None)["statusCode"]
+
+    return send
+
+
+def make_url(base_url, event):
+    """Returns the URL of a captured event on the host base_url"""
+    url = base_url.rstrip("/") + event["path"]
+    query_parameters = event.get("queryStringParameters", None)
+    if query_parameters:
+        url = f"{url}?{urlencode(query_parameters)}"
+    return url
+
+
+def make_http_sender(base_url, timeout=30):
+    """
+    Returns a function that sends the event of a capture to an HTTP host
+
+    Args:
+        base_url: host URL, such as http://127.0.0.1:3000
+        timeout: request timeout in seconds
+
+    Returns:
+        function of a capture record, returning the response status code
+    """
+
+    def send(capture):
+        event = capture["event"]
+        request = urllib.request.Request(
+            make_url(base_url, event),
+            headers=event.get("headers", None) or {},
+            method=event.get("httpMethod", "GET"),
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    return send
+
+
+def replay(captures, send, concurrency=1, repeat=1):
+    """
+    Sends captured events, and times each one
+
+    Args:
+        captures: list of capture records
+        send: function of a capture record, returning the response status code
+        concurrency: number of concurrent requests
+        repeat: number of times to send each capture
+
+    Returns:
+        list of (route, status code, latency in seconds) tuples
+    """
+
+    def timed(capture):
+        start = time.perf_counter()
+        status = send(capture)
+        return capture["capture"], status, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(timed, captures * repeat))
+
+
+def summarize(results):
+    """
+    Summarizes replay results by route
+
+    Args:
+        results: list of (route, status code, latency in seconds) tuples
+
+    Returns:
+        dict by route of dicts with "count", "errors" (5xx responses), and
+        the latency percentiles in milliseconds, as "p50", "p90" and "p99"
+    """
+    summary = {}
+    for route in sorted({route for route, _, _ in results}):
+        latencies = [latency for r, _, latency in results if r == route]
+        statuses = [status for r, status, _ in results if r == route]
+        summary[route] = {
+            "count": len(latencies),
+            "errors": sum(status >= 500 for status in statuses),
+        }
+        values = np.percentile(np.array(latencies) * 1000, PERCENTILES)
+        summary[route].update(
+            {f"p{p}": float(value) for p, value in zip(PERCENTILES, values)}
+        )
+    return summary
+
+
+def format_summary(summary):
+    """Formats a summary from summarize as a text table"""
+    columns = ["count", "errors"] + [f"p{p}" for p in PERCENTILES]
+    lines = [f"{'route':<24}" + "".join(f"{column:>10}" for column in columns)]
+    for route, stats in summary.items():
+        cells = [f"{stats['count']:>10}", f"{stats['errors']:>10}"] + [
+            f"{stats[f'p{p}']:>10.2f}" for p in PERCENTILES
+        ]
+        lines.append(f"{route:<24}" + "".join(cells))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path", help="Log file of captured invocations")
+    parser.add_argument("--url", help="HTTP host, e.g. http://127.0.0.1:3000")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    with open(args.path) as f:
+        captures = read_captures(f)
+    if args.url is None:
+        handlers = in_process_handlers()
+        captures = [capture for capture in captures if capture["capture"] in handlers]
+        send = make_in_process_sender(handlers)
+    else:
+        send = make_http_sender(args.url)
+    results = replay(captures, send, args.concurrency, args.repeat)
+    print(format_summary(summarize(results)))
+    print("latencies in milliseconds")
+    if args.url is None:
+        from responsecachelib import request_coalescer
+
+        stats = request_coalescer.stats()
+        print(
+            f"coalesced {stats['followers']} of"
+            f" {stats['leaders'] + stats['followers']} requests"
+        )
+
+
+if __name__ == "__main__":
+    main()
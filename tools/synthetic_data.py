@@ -0,0 +1,256 @@
+"""
+Generates synthetic counties and municipalities tables for scale testing
+
+The tables have the schema of the njmunicipalities CSV dumps that are
+imported into DynamoDB: row_number is numeric, and every other attribute,
+including first_year and final_year, is a string.  Municipality lineages
+include places that are recoded (new GEOID), renamed, merged into a
+neighbour, which continues under a consolidated name, or created after
+2000, so every kind of change the API reports appears at scale.
+
+The default sizes are those of the whole US (about 3,100 counties and 35,000
+county subdivisions).  Usage:
+
+    python -m tools.synthetic_data --places 35000 --format ddb --out data/
+
+writes counties and municipalities files in one of the formats:
+    ddb: a DynamoDB scan response, {"Items": [...]}, in wire format
+    csv: a CSV dump, as used by ImportSourceSpecification
+    pickle: a pickled pd.DataFrame snapshot of the CSV dump
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from ddblib import pd_to_ddb_itemlist
+
+FIRST_YEAR = 2000
+FINAL_YEAR = 2025
+
+# Share of places with each kind of change.  The rest are unchanged.
+CHANGE_SHARES = {"recoded": 0.03, "renamed": 0.02, "merged": 0.01, "created": 0.01}
+
+# Largest state, county and place codes that fit the 2, 3 and 5 digits of
+# the GEOIDs
+MAX_STATE_CODE = 99
+MAX_COUNTY_CODE = 999
+MAX_PLACE_CODE = 99999
+
+# Name suffixes for generated municipalities
+PLACE_TYPES = ["borough", "city", "township", "town", "village"]
+
+# Columns of the CSV dumps
+COUNTIES_COLUMNS = ["row_number", "GEOID", "county"]
+MUNICIPALITIES_COLUMNS = [
+    "row_number",
+    "GEOID",
+    "GEOID_Y2K",
+    "first_year",
+    "final_year",
+    "county",
+    "municipality",
+]
+
+
+def generate_counties_table(counties=3100, states=50):
+    """
+    Generates a counties table
+
+    Counties are spread evenly over the states.  State and county codes are
+    odd, as FIPS codes mostly are.  ValueError is raised if the codes do not
+    fit in the GEOIDs, beyond 50 states or 500 counties per state.
+
+    Args:
+        counties: number of counties
+        states: number of states
+
+    Returns:
+        pd.DataFrame with columns "row_number", "GEOID" and "county"
+    """
+    positions = np.arange(counties)
+    state_codes = 1 + 2 * (positions % states)
+    county_codes = 1 + 2 * (positions // states)
+    if state_codes.max(initial=1) > MAX_STATE_CODE:
+        raise ValueError(f"{states} states do not fit in 2-digit state codes")
+    if county_codes.max(initial=1) > MAX_COUNTY_CODE:
+        raise ValueError(
+            f"{counties} counties in {states} states do not fit in 3-digit"
+            " county codes"
+        )
+    GEOIDs = [
+        f"{state:02d}{county:03d}" for state, county in zip(state_codes, county_codes)
+    ]
+    tbl = pd.DataFrame(
+        {
+            "row_number": positions + 1,
+            "GEOID": GEOIDs,
+            "county": [f"County {GEOID}" for GEOID in GEOIDs],
+        }
+    )
+    return tbl.sort_values("GEOID", ignore_index=True).assign(
+        row_number=lambda df: np.arange(1, len(df) + 1)
+    )
+
+
+def generate_municipalities_table(places=35000, counties=None, seed=0):
+    """
+    Generates a municipalities table with realistic lineages
+
+    Each place is assigned to a county and given a lineage of one or more
+    rows, with first_year..final_year intervals that cover the years in which
+    it exists:
+        unchanged: one row for every year
+        recoded: the GEOID changes in a random year
+        renamed: the name changes in a random year
+        merged: the place ends in a random year, and an unchanged place of
+            the same county, its successor, gets a new row from that year
+            named for both ("<successor> and <merged place>")
+        created: the place starts in a random year, with GEOID_Y2K equal to
+            its GEOID
+
+    A merged place with no unchanged place left in its county to succeed it
+    is left unchanged.  Place codes step by 20 within a county, so
+    ValueError is raised beyond 4,999 places in a county, where they would
+    not fit in the GEOIDs.
+
+    Args:
+        places: number of places (distinct GEOID_Y2K values)
+        counties: Optional counties table, from generate_counties_table
+        seed: random seed
+
+    Returns:
+        pd.DataFrame with the columns of the municipalities CSV dump, sorted
+        by GEOID_Y2K and first_year
+    """
+    rng = np.random.default_rng(seed)
+    if counties is None:
+        counties = generate_counties_table()
+    county_positions = np.sort(rng.integers(0, len(counties), places))
+    kinds = rng.choice(
+        ["unchanged", *CHANGE_SHARES],
+        size=places,
+        p=[1 - sum(CHANGE_SHARES.values()), *CHANGE_SHARES.values()],
+    )
+    change_years = rng.integers(FIRST_YEAR + 1, FINAL_YEAR + 1, places)
+    place_types = rng.choice(PLACE_TYPES, places)
+
+    # Place codes are 10, 30, 50, ... in each county, and recoded places
+    # take code + 10
+    county_starts = np.searchsorted(county_positions, county_positions)
+    codes = 10 + 20 * (np.arange(places) - county_starts)
+    if places and codes.max() + 10 > MAX_PLACE_CODE:
+        raise ValueError(f"{places} places do not fit in 5-digit place codes")
+    county_GEOIDs = counties["GEOID"].to_numpy()[county_positions]
+    GEOIDs = [f"{county}{code:05d}" for county, code in zip(county_GEOIDs, codes)]
+    names = [
+        f"Place {GEOID[5:]} {place_type}"
+        for GEOID, place_type in zip(GEOIDs, place_types)
+    ]
+
+    # Each merged place is succeeded by the first unchanged place of its
+    # county that does not already succeed another
+    successors = {}
+    unchanged = set(np.flatnonzero(kinds == "unchanged"))
+    for position in np.flatnonzero(kinds == "merged"):
+        start = county_starts[position]
+        stop = np.searchsorted(county_positions, county_positions[position], "right")
+        successor = next(
+            (other for other in range(start, stop) if other in unchanged), None
+        )
+        if successor is None:
+            kinds[position] = "unchanged"
+            continue
+        unchanged.discard(successor)
+        successors[successor] = position
+
+    rows = []
+    for position, (kind, year, GEOID, name) in enumerate(
+        zip(kinds, change_years, GEOIDs, names)
+    ):
+        county = counties["county"].iat[county_positions[position]]
+        if kind == "recoded":
+            new_GEOID = f"{GEOID[:5]}{codes[position] + 10:05d}"
+            lineage = [
+                (GEOID, FIRST_YEAR, year - 1, name),
+                (new_GEOID, year, FINAL_YEAR, name),
+            ]
+        elif kind == "renamed":
+            lineage = [
+                (GEOID, FIRST_YEAR, year - 1, name),
+                (GEOID, year, FINAL_YEAR, f"{name} {year}"),
+            ]
+        elif kind == "merged":
+            lineage = [(GEOID, FIRST_YEAR, year - 1, name)]
+        elif kind == "created":
+            lineage = [(GEOID, year, FINAL_YEAR, name)]
+        elif position in successors:
+            merged = successors[position]
+            merge_year = change_years[merged]
+            lineage = [
+                (GEOID, FIRST_YEAR, merge_year - 1, name),
+                (GEOID, merge_year, FINAL_YEAR, f"{name} and {names[merged]}"),
+            ]
+        else:
+            lineage = [(GEOID, FIRST_YEAR, FINAL_YEAR, name)]
+        rows.extend(
+            [row_GEOID, GEOID, first_year, final_year, county, row_name]
+            for row_GEOID, first_year, final_year, row_name in lineage
+        )
+
+    tbl = pd.DataFrame(rows, columns=MUNICIPALITIES_COLUMNS[1:])
+    tbl = tbl.sort_values(["GEOID_Y2K", "first_year"], ignore_index=True)
+    tbl = tbl.astype({"first_year": str, "final_year": str})
+    tbl.insert(0, "row_number", np.arange(1, len(tbl) + 1))
+    return tbl
+
+
+def write_table(tbl, path, format):
+    """
+    Writes a generated table in format "ddb", "csv" or "pickle"
+
+    Args:
+        tbl: pd.DataFrame from generate_*_table
+        path: file path, without extension
+        format: output format
+
+    Returns:
+        path of the written file
+    """
+    if format == "ddb":
+        path = f"{path}.json"
+        with open(path, "w") as f:
+            json.dump({"Items": pd_to_ddb_itemlist(tbl)}, f)
+    elif format == "csv":
+        path = f"{path}.csv"
+        tbl.to_csv(path, index=False)
+    elif format == "pickle":
+        path = f"{path}.pkl"
+        tbl.to_pickle(path)
+    else:
+        raise ValueError(f"Unsupported format {format}")
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--places", type=int, default=35000)
+    parser.add_argument("--counties", type=int, default=3100)
+    parser.add_argument("--states", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=["ddb", "csv", "pickle"], default="ddb")
+    parser.add_argument("--out", default=".")
+    args = parser.parse_args(argv)
+
+    counties = generate_counties_table(args.counties, args.states)
+    municipalities = generate_municipalities_table(args.places, counties, args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    for name, tbl in [("counties", counties), ("municipalities", municipalities)]:
+        path = write_table(tbl, os.path.join(args.out, name), args.format)
+        print(f"Wrote {len(tbl)} rows to {path}")
+
+
+if __name__ == "__main__":
+    main()